@@ -1,104 +1,1318 @@
 import sqlite3
+import threading
+import time
+import queue
+import asyncio
+import atexit
+import functools
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+import json
+import os
+import re
+import unicodedata
 import uuid
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
 
 DB_PATH = "history.db"
 
+# Connection pool settings
+POOL_SIZE = 4
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+
+# Write-behind (group commit) settings for add_message
+WRITE_BEHIND = True
+FLUSH_INTERVAL_MS = 5
+FLUSH_MAX_ROWS = 256
+# Backoff while the database stays busy/locked past BUSY_TIMEOUT_MS (e.g. during a VACUUM)
+COMMIT_RETRY_DELAY_MS = 50
+COMMIT_RETRY_MAX_DELAY_MS = 2000
+
+# Pagination
+DEFAULT_PAGE_SIZE = 50
+
+# Full-text search
+SEARCH_SNIPPET_TOKENS = 16
+
+# Length of the last-message preview kept on each session row
+PREVIEW_LENGTH = 120
+
+# In-process LRU cache of recent session history
+HISTORY_CACHE_MAX_BYTES = 32 * 1024 * 1024
+HISTORY_CACHE_MAX_MESSAGES = 500
+
+# Cold storage: sessions idle this long are packed into one compressed blob
+ARCHIVE_IDLE_DAYS = 30
+MAINTENANCE_INTERVAL_HOURS = 24
+
+# NDJSON export/import chunk sizes (rows per query / per transaction)
+EXPORT_CHUNK_SIZE = 500
+IMPORT_CHUNK_SIZE = 1000
+
+
+class ConnectionPool:
+    """
+    A small pool of long-lived SQLite connections.
+
+    Connections are opened once in WAL mode with tuned pragmas and handed out
+    to one thread at a time, so the pool is safe to use from FastAPI's
+    threadpool as well as from the agent's async code.
+    """
+
+    def __init__(self, db_path: str, size: int = POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        # NORMAL is durable across application crashes in WAL mode and only
+        # risks the last transactions on power loss, in exchange for far fewer fsyncs.
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._all) < self.size:
+                conn = self._open()
+                self._all.append(conn)
+                return conn
+
+        # Pool exhausted, wait for a connection to be released
+        return self._idle.get()
+
+    def release(self, conn: sqlite3.Connection):
+        if self._closed:
+            conn.close()
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for conn in self._all:
+                try:
+                    conn.close()
+                except Exception as e:
+                    logger.error(f"Error closing database connection: {e}")
+            self._all = []
+            self._idle = queue.LifoQueue()
+
+
+_pool: ConnectionPool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Return the shared pool, (re)creating it if DB_PATH has changed."""
+    global _pool
+    pool = _pool
+    if pool is not None and pool.db_path == DB_PATH:
+        return pool
+
+    with _pool_lock:
+        if _pool is None or _pool.db_path != DB_PATH:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DB_PATH)
+            _history_cache.clear()
+        return _pool
+
+
+def close_pool():
+    """Close all pooled connections (e.g. on application shutdown)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        _history_cache.clear()
+
+
+# Dedicated threads for the async API so disk I/O never runs on the event loop
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="db")
+
+
+async def run_in_db_thread(fn, *args, **kwargs):
+    """Run a blocking database function on the DB executor and await the result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+@contextmanager
+def get_connection():
+    """Borrow a pooled connection for the duration of the block."""
+    with get_pool().connection() as conn:
+        yield conn
+
+
 def init_db():
     """Initialize the database with sessions and messages tables."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Enable foreign keys
-    cursor.execute("PRAGMA foreign_keys = ON")
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sessions (
-            id TEXT PRIMARY KEY,
-            title TEXT NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    with get_connection() as conn:
+        # Only takes effect on a brand new database; run_maintenance converts old ones
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (session_id) REFERENCES sessions (id) ON DELETE CASCADE
+                )
+            ''')
+
+        _migrate(conn)
+
+
+def _migration_1(conn: sqlite3.Connection):
+    # Keyset pagination and per-session history reads walk this index
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id)')
+
+
+def _migration_2(conn: sqlite3.Connection):
+    # External-content FTS5 index over message text, kept in sync by triggers
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content,
+            content='messages',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    ''')
+    # Index messages written before this migration
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+
+def _migration_3(conn: sqlite3.Connection):
+    # Denormalized per-session summary maintained by _insert_messages, so the
+    # sidebar can sort by recency without touching the messages table
+    conn.execute('ALTER TABLE sessions ADD COLUMN last_message_at DATETIME')
+    conn.execute('ALTER TABLE sessions ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0')
+    conn.execute('ALTER TABLE sessions ADD COLUMN preview TEXT')
+    conn.execute(f'''
+        UPDATE sessions SET
+            message_count = (SELECT COUNT(*) FROM messages WHERE session_id = sessions.id),
+            last_message_at = COALESCE(
+                (SELECT MAX(timestamp) FROM messages WHERE session_id = sessions.id),
+                created_at
+            ),
+            preview = (
+                SELECT substr(content, 1, {PREVIEW_LENGTH}) FROM messages
+                WHERE session_id = sessions.id ORDER BY id DESC LIMIT 1
+            )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_last_message_at ON sessions (last_message_at, id)')
+
+
+def _migration_4(conn: sqlite3.Connection):
+    # Cold storage for idle sessions, one compressed JSON blob per session
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archived_sessions (
+            session_id TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            message_count INTEGER NOT NULL,
+            raw_bytes INTEGER NOT NULL,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions (id) ON DELETE CASCADE
         )
     ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+
+
+def _migration_5(conn: sqlite3.Connection):
+    # Rolling summary of a session's oldest `covered_count` messages, used in
+    # place of turns that no longer fit the model's context budget
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS session_summaries (
+            session_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            covered_count INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions (id) ON DELETE CASCADE
+        )
+    ''')
+
+
+def _migration_6(conn: sqlite3.Connection):
+    # Search index over archived messages. Contentless, so their text is only
+    # kept in the compressed archive; archived_messages maps a hit back to its
+    # session, role and timestamp.
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS archived_fts USING fts5(
+            content,
+            content='',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archived_messages (
+            id INTEGER PRIMARY KEY,
             session_id TEXT NOT NULL,
             role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            timestamp DATETIME,
             FOREIGN KEY (session_id) REFERENCES sessions (id) ON DELETE CASCADE
         )
     ''')
-    
-    conn.commit()
-    conn.close()
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_archived_messages_session_id ON archived_messages (session_id)')
+    # Index sessions archived before this migration
+    for row in conn.execute('SELECT session_id FROM archived_sessions').fetchall():
+        try:
+            _index_archived(conn, row['session_id'], _load_archive(conn, row['session_id']))
+        except RuntimeError as e:
+            logger.warning(f"Archived session {row['session_id']} left out of search: {e}")
+
+
+# Schema migrations, applied in order. PRAGMA user_version records how many ran.
+MIGRATIONS = [
+    _migration_1,
+    _migration_2,
+    _migration_3,
+    _migration_4,
+    _migration_5,
+    _migration_6,
+]
+
+
+def _migrate(conn: sqlite3.Connection):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
 
 def create_session(title: str = "New Chat") -> str:
     """Create a new session and return its ID."""
     session_id = str(uuid.uuid4())
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO sessions (id, title) VALUES (?, ?)', (session_id, title))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        with conn:
+            # last_message_at doubles as "last activity", so new sessions sort first
+            conn.execute('INSERT INTO sessions (id, title, last_message_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
+                         (session_id, title))
     return session_id
 
+def session_exists(session_id: str) -> bool:
+    if not session_id:
+        return False
+    with get_connection() as conn:
+        return conn.execute('SELECT 1 FROM sessions WHERE id = ?', (session_id,)).fetchone() is not None
+
 def get_sessions() -> List[Dict[str, Any]]:
-    """Get all sessions ordered by creation time (newest first)."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM sessions ORDER BY created_at DESC')
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
-
-def get_session_messages(session_id: str) -> List[Dict[str, Any]]:
-    """Get messages for a specific session."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM messages WHERE session_id = ? ORDER BY id ASC', (session_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    
-    history = []
-    for row in rows:
-        role = row['role']
-        # Map for Gemini if needed, but we keep raw role here mostly
-        if role == 'assistant': 
-            role = 'model'
-            
-        history.append({
-            "role": role,
-            "content": row['content']
-        })
-    return history
+    """Get all sessions ordered by last activity (most recent first)."""
+    return get_sessions_page(limit=None)["sessions"]
+
+def get_sessions_page(cursor: str = None, limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+    """
+    Keyset-paginated sessions, most recently active first.
+
+    Returns up to `limit` sessions after `cursor` plus `next_cursor` for the
+    following page, or None on the last page. Each session includes its
+    message_count, last_message_at and a preview of the last message.
+    """
+    query = 'SELECT id, title, created_at, last_message_at, message_count, preview FROM sessions'
+    params = []
+    if cursor:
+        last_message_at, _, last_id = cursor.partition('|')
+        query += ' WHERE (last_message_at, id) < (?, ?)'
+        params.extend([last_message_at, last_id])
+    query += ' ORDER BY last_message_at DESC, id DESC'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit + 1)
+
+    with get_connection() as conn:
+        rows = [dict(row) for row in conn.execute(query, params).fetchall()]
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['last_message_at']}|{rows[-1]['id']}"
+    return {"sessions": rows, "next_cursor": next_cursor}
+
+def _map_role(role: str) -> str:
+    # Map for Gemini if needed, but we keep raw role here mostly
+    if role == 'assistant':
+        return 'model'
+    return role
+
+# Rough per-message overhead (dict, strings, list slot) for memory accounting
+_MESSAGE_OVERHEAD_BYTES = 200
+
+
+class HistoryCache:
+    """
+    Bounded LRU cache of recent session history, keyed by session_id.
+
+    Each entry holds up to HISTORY_CACHE_MAX_MESSAGES of the newest messages
+    and whether that is the whole session. add_message appends to cached
+    entries (write-through) and delete_session evicts them, so hot sessions
+    are served from memory. Total size is capped at HISTORY_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, max_bytes: int = HISTORY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        # Bumped on every write so a load racing with add_message isn't cached stale
+        self._versions = Counter()
+        self._lock = threading.Lock()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _message_size(message: Dict[str, Any]) -> int:
+        return len(message["content"]) + _MESSAGE_OVERHEAD_BYTES
+
+    def get(self, session_id: str, limit: int = None):
+        """Return a copy of the cached messages, or None if they can't be served from cache."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                messages, complete, _ = entry
+                if limit is None and complete:
+                    self._entries.move_to_end(session_id)
+                    self.hits += 1
+                    return [dict(m) for m in messages]
+                if limit is not None and (complete or limit <= len(messages)):
+                    self._entries.move_to_end(session_id)
+                    self.hits += 1
+                    return [dict(m) for m in messages[-limit:]] if limit else []
+            self.misses += 1
+            return None
+
+    def version(self, session_id: str) -> int:
+        with self._lock:
+            return self._versions[session_id]
+
+    def put(self, session_id: str, messages: List[Dict[str, Any]], complete: bool, version: int):
+        with self._lock:
+            if self._versions[session_id] != version:
+                return
+            self._remove(session_id)
+            size = sum(self._message_size(m) for m in messages)
+            if size > self.max_bytes:
+                return
+            self._entries[session_id] = [messages, complete, size]
+            self.size_bytes += size
+            self._evict_to_fit()
+
+    def append(self, session_id: str, message: Dict[str, Any]):
+        with self._lock:
+            self._versions[session_id] += 1
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return
+            messages = entry[0]
+            messages.append(message)
+            added = self._message_size(message)
+            entry[2] += added
+            self.size_bytes += added
+            if len(messages) > HISTORY_CACHE_MAX_MESSAGES:
+                dropped = messages.pop(0)
+                entry[1] = False
+                entry[2] -= self._message_size(dropped)
+                self.size_bytes -= self._message_size(dropped)
+            self._entries.move_to_end(session_id)
+            self._evict_to_fit()
+
+    def evict(self, session_id: str):
+        with self._lock:
+            self._versions[session_id] += 1
+            self._remove(session_id)
+
+    def clear(self):
+        with self._lock:
+            for session_id in self._entries:
+                self._versions[session_id] += 1
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _remove(self, session_id: str):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self.size_bytes -= entry[2]
+
+    def _evict_to_fit(self):
+        while self.size_bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self.size_bytes -= entry[2]
+            self.evictions += 1
+
+
+_history_cache = HistoryCache()
+
+
+def get_history_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters and memory usage of the session history cache."""
+    return _history_cache.stats()
+
+def get_session_messages(session_id: str, limit: int = None) -> List[Dict[str, Any]]:
+    """
+    Get messages for a specific session in chronological order.
+    If limit is given, only the most recent `limit` messages are returned.
+    """
+    cached = _history_cache.get(session_id, limit)
+    if cached is not None:
+        return cached
+
+    version = _history_cache.version(session_id)
+
+    # Read-your-writes: make sure queued messages for this session are on disk
+    if _writer.has_pending(session_id):
+        _writer.flush()
+    _rehydrate_if_archived(session_id)
+
+    # Load the newest window (enough to fill the cache) and serve from it
+    window = HISTORY_CACHE_MAX_MESSAGES if limit is None else max(limit, HISTORY_CACHE_MAX_MESSAGES)
+    with get_connection() as conn:
+        rows = conn.execute('SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?',
+                            (session_id, window + 1)).fetchall()
+        complete = len(rows) <= window
+        if limit is None and not complete:
+            rows = conn.execute('SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC',
+                                (session_id,)).fetchall()
+            complete = True
+    rows.reverse()
+
+    messages = [{"role": _map_role(row['role']), "content": row['content']} for row in rows]
+    cached_window = messages[-HISTORY_CACHE_MAX_MESSAGES:]
+    _history_cache.put(session_id, [dict(m) for m in cached_window],
+                       complete and len(cached_window) == len(messages), version)
+
+    if limit is not None:
+        return messages[-limit:] if limit else []
+    return messages
+
+def get_session_messages_page(session_id: str, before_id: int = None, limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+    """
+    Keyset-paginated session history, newest page first.
+
+    Returns up to `limit` messages older than `before_id` (or the latest ones
+    if before_id is None) in chronological order, plus `next_before_id` to
+    fetch the page before it, or None when the start of the session is reached.
+    A limit of None returns everything before the cursor.
+    """
+    if _writer.has_pending(session_id):
+        _writer.flush()
+    _rehydrate_if_archived(session_id)
+
+    query = 'SELECT id, role, content, timestamp FROM messages WHERE session_id = ?'
+    params = [session_id]
+    if before_id is not None:
+        query += ' AND id < ?'
+        params.append(before_id)
+    query += ' ORDER BY id DESC'
+    if limit is not None:
+        # Fetch one extra row to know whether an older page exists
+        query += ' LIMIT ?'
+        params.append(limit + 1)
+
+    with get_connection() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    has_more = limit is not None and len(rows) > limit
+    if has_more:
+        rows = rows[:limit]
+    rows.reverse()
+
+    messages = [
+        {"id": row['id'], "role": _map_role(row['role']), "content": row['content'], "timestamp": row['timestamp']}
+        for row in rows
+    ]
+    return {
+        "messages": messages,
+        "next_before_id": messages[0]["id"] if has_more else None,
+    }
+
+def get_session_messages_range(session_id: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """Messages at positions [start, end) of a session, in chronological order."""
+    if end <= start:
+        return []
+    if _writer.has_pending(session_id):
+        _writer.flush()
+    _rehydrate_if_archived(session_id)
+
+    with get_connection() as conn:
+        rows = conn.execute(
+            'SELECT id, role, content FROM messages WHERE session_id = ? ORDER BY id ASC LIMIT ? OFFSET ?',
+            (session_id, end - start, start)
+        ).fetchall()
+    return [{"id": row['id'], "role": _map_role(row['role']), "content": row['content']} for row in rows]
+
+def count_session_messages(session_id: str) -> int:
+    """Number of messages in a session, including ones still queued for writing."""
+    if _writer.has_pending(session_id):
+        _writer.flush()
+    with get_connection() as conn:
+        row = conn.execute('SELECT message_count FROM sessions WHERE id = ?', (session_id,)).fetchone()
+    return row['message_count'] if row else 0
+
+def get_session_summary(session_id: str) -> Optional[Dict[str, Any]]:
+    """The stored rolling summary of a session, or None."""
+    with get_connection() as conn:
+        row = conn.execute('SELECT summary, covered_count, updated_at FROM session_summaries WHERE session_id = ?',
+                           (session_id,)).fetchone()
+    return dict(row) if row else None
+
+def save_session_summary(session_id: str, summary: str, covered_count: int):
+    """Store a summary of the first `covered_count` messages; never replaces one that covers more."""
+    with get_connection() as conn:
+        with conn:
+            conn.execute('''
+                INSERT INTO session_summaries (session_id, summary, covered_count) VALUES (?, ?, ?)
+                ON CONFLICT (session_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    covered_count = excluded.covered_count,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE excluded.covered_count > session_summaries.covered_count
+            ''', (session_id, summary, covered_count))
+
+def _preview(content: str) -> str:
+    return " ".join(content.split())[:PREVIEW_LENGTH]
+
+def _insert_messages(conn: sqlite3.Connection, rows: List[tuple]):
+    """
+    Insert (session_id, role, content) rows and update the affected sessions'
+    summary columns. The caller owns the transaction, so both land together.
+    """
+    conn.executemany('INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)', rows)
+
+    summaries = {}
+    for session_id, _, content in rows:
+        count, _ = summaries.get(session_id, (0, None))
+        summaries[session_id] = (count + 1, content)
+    conn.executemany(
+        'UPDATE sessions SET message_count = message_count + ?, last_message_at = CURRENT_TIMESTAMP, preview = ? WHERE id = ?',
+        [(count, _preview(content), session_id) for session_id, (count, content) in summaries.items()]
+    )
+
+
+class MessageWriter:
+    """
+    Write-behind queue for chat messages.
+
+    Messages from all sessions are appended to an in-memory queue and a
+    background thread commits them in a single transaction every
+    FLUSH_INTERVAL_MS or FLUSH_MAX_ROWS rows, whichever comes first. Each
+    batch is atomic, and batches are committed in submission order. A busy
+    or locked database is retried with backoff; only rows that fail on their
+    own (e.g. their session is gone) are dropped.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = []
+        self._pending_sessions = Counter()
+        self._submitted_seq = 0
+        self._committed_seq = 0
+        self._flush_requested = False
+        self._stopping = False
+        self._thread = None
+        self.batches = 0
+        self.rows = 0
+
+    def submit(self, session_id: str, role: str, content: str):
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+            self._submitted_seq += 1
+            self._pending.append((self._submitted_seq, session_id, role, content))
+            self._pending_sessions[session_id] += 1
+            if len(self._pending) >= FLUSH_MAX_ROWS:
+                self._cond.notify_all()
+
+    def has_pending(self, session_id: str = None) -> bool:
+        with self._cond:
+            if session_id is None:
+                return bool(self._pending)
+            return self._pending_sessions[session_id] > 0
+
+    def flush(self):
+        """Block until everything submitted so far has been committed."""
+        with self._cond:
+            target = self._submitted_seq
+            if self._committed_seq >= target:
+                return
+            self._flush_requested = True
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._committed_seq >= target)
+
+    def stop(self):
+        """Flush outstanding messages and stop the writer thread."""
+        with self._cond:
+            thread = self._thread
+            self._stopping = True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopping)
+                if not self._pending:
+                    return
+                # Give concurrent sessions a moment to join this batch
+                if len(self._pending) < FLUSH_MAX_ROWS and not (self._flush_requested or self._stopping):
+                    self._cond.wait_for(
+                        lambda: len(self._pending) >= FLUSH_MAX_ROWS or self._flush_requested or self._stopping,
+                        timeout=FLUSH_INTERVAL_MS / 1000,
+                    )
+                batch = self._pending[:FLUSH_MAX_ROWS]
+                del self._pending[:FLUSH_MAX_ROWS]
+                if not self._pending:
+                    self._flush_requested = False
+
+            self._commit(batch)
+
+            with self._cond:
+                self._committed_seq = batch[-1][0]
+                for _, session_id, _, _ in batch:
+                    self._pending_sessions[session_id] -= 1
+                    if self._pending_sessions[session_id] <= 0:
+                        del self._pending_sessions[session_id]
+                self._cond.notify_all()
+
+    def _commit(self, batch: List[tuple]):
+        rows = [(session_id, role, content) for _, session_id, role, content in batch]
+        try:
+            self._insert(rows)
+            return
+        except Exception as e:
+            logger.error(f"Group commit of {len(rows)} messages failed, retrying individually: {e}")
+
+        # A single bad row (e.g. its session was deleted meanwhile) must not
+        # take the rest of the batch down with it.
+        for row in rows:
+            try:
+                self._insert([row])
+            except Exception as e:
+                logger.error(f"Dropping message for session {row[0]}: {e}")
+                # add_message already put it in the cached history; reload from disk next time
+                _history_cache.evict(row[0])
+
+    def _insert(self, rows: List[tuple]):
+        """Commit `rows`, waiting out a busy or locked database instead of failing."""
+        delay = COMMIT_RETRY_DELAY_MS / 1000
+        while True:
+            try:
+                with get_connection() as conn:
+                    with conn:
+                        _insert_messages(conn, rows)
+                break
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e):
+                    raise
+                logger.warning(f"Database busy, retrying commit of {len(rows)} messages in {delay:.2f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, COMMIT_RETRY_MAX_DELAY_MS / 1000)
+        self.batches += 1
+        self.rows += len(rows)
+
+
+def _is_busy(error: sqlite3.OperationalError) -> bool:
+    """Whether the error is SQLITE_BUSY/SQLITE_LOCKED, i.e. worth retrying as is."""
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+_writer = MessageWriter()
+
+
+def flush_messages():
+    """Wait until all queued messages are committed to disk."""
+    _writer.flush()
+
+
+def shutdown_db():
+    """Flush the write-behind queue and close all pooled connections."""
+    _writer.stop()
+    close_pool()
+
+
+atexit.register(_writer.stop)
+
+
+# Keeps the cache and the write queue in the same order under concurrent writers
+_add_message_lock = threading.Lock()
+
 
 def add_message(session_id: str, role: str, content: str):
-    """Add a message to a specific session."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)', 
-                   (session_id, role, content))
-    conn.commit()
-    conn.close()
+    """
+    Add a message to a specific session.
+
+    With write-behind the row is committed later; if that fails (e.g. the
+    session was deleted meanwhile) the message is dropped and the session's
+    cached history is evicted. Callers check that the session exists first.
+    """
+    if not session_id:
+        raise ValueError("A message needs a session_id")
+    if WRITE_BEHIND:
+        with _add_message_lock:
+            _history_cache.append(session_id, {"role": _map_role(role), "content": content})
+            _writer.submit(session_id, role, content)
+        return
+
+    with get_connection() as conn:
+        with conn:
+            _insert_messages(conn, [(session_id, role, content)])
+    _history_cache.append(session_id, {"role": _map_role(role), "content": content})
+
+def _fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query that ANDs quoted terms, so user input can't break the syntax."""
+    terms = re.findall(r"\w+", text)
+    return " ".join(f'"{term}"' for term in terms)
+
+def _normalize_timestamp(value: str) -> str:
+    # Accept ISO 8601 ("2026-01-10T09:30:00") as well as SQLite's "YYYY-MM-DD HH:MM:SS"
+    return value.replace("T", " ").rstrip("Z")
+
+def search_messages(query: str, session_id: str = None, since: str = None, until: str = None,
+                    limit: int = 20, highlight: tuple = ("<mark>", "</mark>")) -> List[Dict[str, Any]]:
+    """
+    Full-text search across all chat history, archived sessions included,
+    best matches first.
+
+    Each result carries the message id, session id and title, role, timestamp
+    and a snippet with matches wrapped in the `highlight` markers. Results can
+    be restricted to one session and to a [since, until) timestamp range.
+    """
+    match = _fts_query(query)
+    if not match:
+        return []
+
+    if _writer.has_pending():
+        _writer.flush()
+
+    filters = ''
+    filter_params = []
+    if session_id:
+        filters += ' AND m.session_id = ?'
+        filter_params.append(session_id)
+    if since:
+        filters += ' AND m.timestamp >= ?'
+        filter_params.append(_normalize_timestamp(since))
+    if until:
+        filters += ' AND m.timestamp < ?'
+        filter_params.append(_normalize_timestamp(until))
+
+    live_sql = '''
+        SELECT m.id, m.session_id, s.title, m.role, m.timestamp,
+               snippet(messages_fts, 0, ?, ?, '…', ?) AS snippet,
+               bm25(messages_fts) AS score
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        JOIN sessions s ON s.id = m.session_id
+        WHERE messages_fts MATCH ?
+    ''' + filters + ' ORDER BY rank LIMIT ?'
+    archived_sql = '''
+        SELECT m.id, m.session_id, s.title, m.role, m.timestamp,
+               bm25(archived_fts) AS score
+        FROM archived_fts
+        JOIN archived_messages m ON m.id = archived_fts.rowid
+        JOIN sessions s ON s.id = m.session_id
+        WHERE archived_fts MATCH ?
+    ''' + filters + ' ORDER BY rank LIMIT ?'
+
+    with get_connection() as conn:
+        # One snapshot, so a session being archived or rehydrated shows up exactly once
+        conn.execute('BEGIN')
+        try:
+            live = conn.execute(live_sql, [highlight[0], highlight[1], SEARCH_SNIPPET_TOKENS, match,
+                                           *filter_params, limit]).fetchall()
+            archived = conn.execute(archived_sql, [match, *filter_params, limit]).fetchall()
+            archived_text = {}
+            for archived_session in {row['session_id'] for row in archived}:
+                for message_id, _, content, _ in _load_archive(conn, archived_session) or []:
+                    archived_text[message_id] = content
+        finally:
+            conn.rollback()
+
+    results = [_search_result(row, row['snippet']) for row in live]
+    results += [_search_result(row, _snippet(archived_text.get(row['id'], ""), query, highlight)) for row in archived]
+    results.sort(key=lambda result: result["score"])
+    return results[:limit]
+
+def _search_result(row: sqlite3.Row, snippet: str) -> Dict[str, Any]:
+    return {
+        "id": row['id'],
+        "session_id": row['session_id'],
+        "session_title": row['title'],
+        "role": _map_role(row['role']),
+        "timestamp": row['timestamp'],
+        "snippet": snippet,
+        "score": row['score'],
+    }
+
+def _fold(text: str) -> str:
+    # Matches the unicode61 tokenizer's case and diacritic folding
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c)).casefold()
+
+def _snippet(content: str, query: str, highlight: tuple, tokens: int = SEARCH_SNIPPET_TOKENS) -> str:
+    """snippet() for archived messages, whose text the contentless index doesn't keep."""
+    terms = {_fold(term) for term in re.findall(r"\w+", query)}
+    words = list(re.finditer(r"\w+", content))
+    if not words:
+        return content
+    first = next((i for i, word in enumerate(words) if _fold(word.group()) in terms), 0)
+    start = max(0, min(first - tokens // 4, len(words) - tokens))
+    end = min(len(words), start + tokens)
+
+    parts = ["…"] if start > 0 else []
+    position = words[start].start()
+    for word in words[start:end]:
+        parts.append(content[position:word.start()])
+        if _fold(word.group()) in terms:
+            parts.append(f"{highlight[0]}{word.group()}{highlight[1]}")
+        else:
+            parts.append(word.group())
+        position = word.end()
+    parts.append(content[position:] if end == len(words) else "…")
+    return "".join(parts)
+
+def _compress(data: bytes):
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "zlib", zlib.compress(data, 9)
+
+def _decompress(codec: str, payload: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Session was archived with zstd but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+def _load_archive(conn: sqlite3.Connection, session_id: str):
+    """Return the archived message rows (id, role, content, timestamp) of a session, or None."""
+    row = conn.execute('SELECT codec, payload FROM archived_sessions WHERE session_id = ?', (session_id,)).fetchone()
+    if row is None:
+        return None
+    return json.loads(_decompress(row['codec'], row['payload']))
+
+def _index_archived(conn: sqlite3.Connection, session_id: str, rows: List[list]):
+    """Add archived message rows (id, role, content, timestamp) to the archive search index."""
+    conn.executemany('INSERT INTO archived_fts (rowid, content) VALUES (?, ?)',
+                     [(message_id, content) for message_id, _, content, _ in rows])
+    conn.executemany('INSERT INTO archived_messages (id, session_id, role, timestamp) VALUES (?, ?, ?, ?)',
+                     [(message_id, session_id, role, timestamp) for message_id, role, content, timestamp in rows])
+
+def _unindex_archived(conn: sqlite3.Connection, session_id: str, rows: List[list]):
+    # A contentless index can only forget a row given the text it indexed
+    conn.executemany("INSERT INTO archived_fts (archived_fts, rowid, content) VALUES ('delete', ?, ?)",
+                     [(message_id, content) for message_id, _, content, _ in rows])
+    conn.execute('DELETE FROM archived_messages WHERE session_id = ?', (session_id,))
+
+def archive_session(session_id: str) -> Dict[str, int]:
+    """Pack all current messages of a session into a compressed blob and delete the rows."""
+    if _writer.has_pending(session_id):
+        _writer.flush()
+
+    with get_connection() as conn:
+        # Take the write lock up front so a concurrent rehydrate can't interleave
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = [list(row) for row in conn.execute(
+                'SELECT id, role, content, timestamp FROM messages WHERE session_id = ? ORDER BY id ASC', (session_id,))]
+            if not rows:
+                conn.rollback()
+                return {"messages": 0, "raw_bytes": 0, "compressed_bytes": 0}
+
+            # The messages_fts delete trigger drops the rows from the live index
+            _index_archived(conn, session_id, rows)
+            # Merge with an existing archive if the session was archived before
+            previous = _load_archive(conn, session_id) or []
+            rows = previous + rows
+            raw = json.dumps(rows, ensure_ascii=False).encode("utf-8")
+            codec, payload = _compress(raw)
+            conn.execute(
+                'INSERT OR REPLACE INTO archived_sessions (session_id, codec, payload, message_count, raw_bytes) VALUES (?, ?, ?, ?, ?)',
+                (session_id, codec, payload, len(rows), len(raw))
+            )
+            conn.execute('DELETE FROM messages WHERE session_id = ? AND id <= ?', (session_id, rows[-1][0]))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    _history_cache.evict(session_id)
+    return {"messages": len(rows), "raw_bytes": len(raw), "compressed_bytes": len(payload)}
+
+def _rehydrate_if_archived(session_id: str):
+    """Move an archived session's messages back into the messages table, keeping their ids."""
+    with get_connection() as conn:
+        if conn.execute('SELECT 1 FROM archived_sessions WHERE session_id = ?', (session_id,)).fetchone() is None:
+            return
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = _load_archive(conn, session_id)
+            if rows is not None:
+                conn.executemany(
+                    'INSERT OR IGNORE INTO messages (id, session_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)',
+                    [(message_id, session_id, role, content, timestamp) for message_id, role, content, timestamp in rows]
+                )
+                _unindex_archived(conn, session_id, rows)
+                conn.execute('DELETE FROM archived_sessions WHERE session_id = ?', (session_id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def archive_idle_sessions(idle_days: int = ARCHIVE_IDLE_DAYS) -> Dict[str, int]:
+    """Archive every session with no activity in the last `idle_days` days."""
+    with get_connection() as conn:
+        session_ids = [row['id'] for row in conn.execute('''
+            SELECT id FROM sessions
+            WHERE last_message_at < datetime('now', ?)
+              AND EXISTS (SELECT 1 FROM messages WHERE session_id = sessions.id)
+        ''', (f'-{int(idle_days)} days',))]
+
+    report = {"sessions": 0, "messages": 0, "raw_bytes": 0, "compressed_bytes": 0}
+    for session_id in session_ids:
+        try:
+            result = archive_session(session_id)
+        except Exception as e:
+            logger.error(f"Failed to archive session {session_id}: {e}")
+            continue
+        if result["messages"]:
+            report["sessions"] += 1
+            for key in ("messages", "raw_bytes", "compressed_bytes"):
+                report[key] += result[key]
+    return report
+
+def _database_bytes(conn: sqlite3.Connection) -> int:
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    return page_size * page_count
+
+def run_maintenance(idle_days: int = ARCHIVE_IDLE_DAYS) -> Dict[str, Any]:
+    """
+    Archive idle sessions, then give free pages back to the filesystem.
+
+    Uses incremental vacuum; a database created before auto_vacuum was
+    enabled gets a one-off full VACUUM to switch it over. Returns a report
+    including the number of bytes reclaimed.
+    """
+    start = datetime.now()
+    with get_connection() as conn:
+        bytes_before = _database_bytes(conn)
+        file_bytes_before = os.path.getsize(DB_PATH) if os.path.exists(DB_PATH) else 0
+
+    archived = archive_idle_sessions(idle_days)
+
+    with get_connection() as conn:
+        freed_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            conn.execute('PRAGMA incremental_vacuum').fetchall()
+        else:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        bytes_after = _database_bytes(conn)
+    file_bytes_after = os.path.getsize(DB_PATH) if os.path.exists(DB_PATH) else 0
+
+    report = {
+        "archived": archived,
+        "free_pages": freed_pages,
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "bytes_reclaimed": max(0, bytes_before - bytes_after),
+        "file_bytes_before": file_bytes_before,
+        "file_bytes_after": file_bytes_after,
+        "duration_seconds": (datetime.now() - start).total_seconds(),
+    }
+    logger.info(f"Database maintenance: archived {archived['sessions']} sessions, reclaimed {report['bytes_reclaimed']} bytes")
+    return report
+
+async def maintenance_loop(interval_hours: float = MAINTENANCE_INTERVAL_HOURS, idle_days: int = ARCHIVE_IDLE_DAYS):
+    """Background task that runs run_maintenance on the DB executor every interval_hours."""
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            await run_in_db_thread(run_maintenance, idle_days)
+        except Exception as e:
+            logger.error(f"Database maintenance failed: {e}")
+
+def export_ndjson() -> Iterator[str]:
+    """
+    Stream every session and its messages as NDJSON lines.
+
+    Sessions and messages are read in keyset-paginated chunks of
+    EXPORT_CHUNK_SIZE, so memory stays constant regardless of database size
+    and no read transaction is held open between chunks. Archived sessions
+    are exported from their compressed blobs without being rehydrated.
+    """
+    _writer.flush()
+
+    last_session_id = ""
+    while True:
+        with get_connection() as conn:
+            sessions = conn.execute(
+                'SELECT id, title, created_at FROM sessions WHERE id > ? ORDER BY id LIMIT ?',
+                (last_session_id, EXPORT_CHUNK_SIZE)
+            ).fetchall()
+        if not sessions:
+            return
+
+        for session in sessions:
+            session_id = session['id']
+            yield json.dumps({"type": "session", "id": session_id, "title": session['title'],
+                              "created_at": session['created_at']}, ensure_ascii=False) + "\n"
+
+            with get_connection() as conn:
+                archived = _load_archive(conn, session_id) or []
+            for message_id, role, content, timestamp in archived:
+                yield json.dumps({"type": "message", "session_id": session_id, "id": message_id, "role": role,
+                                  "content": content, "timestamp": timestamp}, ensure_ascii=False) + "\n"
+
+            last_message_id = 0
+            while True:
+                with get_connection() as conn:
+                    messages = conn.execute(
+                        'SELECT id, role, content, timestamp FROM messages WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?',
+                        (session_id, last_message_id, EXPORT_CHUNK_SIZE)
+                    ).fetchall()
+                if not messages:
+                    break
+                for message in messages:
+                    yield json.dumps({"type": "message", "session_id": session_id, "id": message['id'],
+                                      "role": message['role'], "content": message['content'],
+                                      "timestamp": message['timestamp']}, ensure_ascii=False) + "\n"
+                last_message_id = messages[-1]['id']
+
+        last_session_id = sessions[-1]['id']
+
+def _import_chunk(conn: sqlite3.Connection, sessions: List[tuple], messages: List[tuple]):
+    conn.executemany(
+        'INSERT INTO sessions (id, title, created_at, last_message_at) VALUES (?, ?, ?, ?)',
+        [(session_id, title, created_at, created_at) for session_id, title, created_at in sessions]
+    )
+    conn.executemany('INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)', messages)
+
+    summaries = {}
+    for session_id, _, content, timestamp in messages:
+        count, last_at, _ = summaries.get(session_id, (0, timestamp, None))
+        summaries[session_id] = (count + 1, max(last_at, timestamp), content)
+    conn.executemany(
+        '''UPDATE sessions SET message_count = message_count + ?,
+               last_message_at = max(COALESCE(last_message_at, ''), ?), preview = ?
+           WHERE id = ?''',
+        [(count, last_at, _preview(content), session_id) for session_id, (count, last_at, content) in summaries.items()]
+    )
+
+def import_ndjson(lines: Iterable) -> Dict[str, int]:
+    """
+    Import NDJSON produced by export_ndjson from any iterable of lines (str or bytes).
+
+    Every imported session gets a fresh id, and messages are remapped onto it
+    and renumbered, so an export can be imported next to existing history.
+    Rows are written with executemany in transactions of IMPORT_CHUNK_SIZE.
+    Malformed lines and messages for unknown sessions are skipped and counted.
+    """
+    session_ids = {}
+    pending_sessions = []
+    pending_messages = []
+    report = {"sessions": 0, "messages": 0, "skipped": 0}
+    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+    def write_chunk():
+        if not pending_sessions and not pending_messages:
+            return
+        with get_connection() as conn:
+            with conn:
+                _import_chunk(conn, pending_sessions, pending_messages)
+        report["sessions"] += len(pending_sessions)
+        report["messages"] += len(pending_messages)
+        pending_sessions.clear()
+        pending_messages.clear()
+
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            kind = record["type"]
+            if kind == "session":
+                new_id = str(uuid.uuid4())
+                session_ids[record["id"]] = new_id
+                pending_sessions.append((new_id, record.get("title") or "Imported Chat", record.get("created_at") or now))
+            elif kind == "message" and record.get("session_id") in session_ids:
+                pending_messages.append((session_ids[record["session_id"]], record["role"], record["content"],
+                                         record.get("timestamp") or now))
+            else:
+                report["skipped"] += 1
+                continue
+        except (ValueError, KeyError, TypeError):
+            report["skipped"] += 1
+            continue
+
+        if len(pending_sessions) + len(pending_messages) >= IMPORT_CHUNK_SIZE:
+            write_chunk()
+
+    write_chunk()
+    return report
 
 def delete_session(session_id: str):
     """Delete a session and its messages."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('PRAGMA foreign_keys = ON')
-    cursor.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
-    conn.commit()
-    conn.close()
+    # Queued rows would otherwise be inserted after the delete and fail as orphans
+    if _writer.has_pending(session_id):
+        _writer.flush()
+    with get_connection() as conn:
+        with conn:
+            archived = _load_archive(conn, session_id)
+            if archived:
+                _unindex_archived(conn, session_id, archived)
+            conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+    _history_cache.evict(session_id)
 
 def update_session_title(session_id: str, title: str):
     """Update session title."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE sessions SET title = ? WHERE id = ?', (title, session_id))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        with conn:
+            conn.execute('UPDATE sessions SET title = ? WHERE id = ?', (title, session_id))
+
+
+# Async API
+# These mirror the functions above but run them on the DB executor, for use
+# from async code such as the chat stream and the FastAPI endpoints.
+
+async def create_session_async(title: str = "New Chat") -> str:
+    return await run_in_db_thread(create_session, title)
+
+async def session_exists_async(session_id: str) -> bool:
+    return await run_in_db_thread(session_exists, session_id)
+
+async def get_sessions_async() -> List[Dict[str, Any]]:
+    return await run_in_db_thread(get_sessions)
+
+async def get_sessions_page_async(cursor: str = None, limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+    return await run_in_db_thread(get_sessions_page, cursor, limit)
+
+async def get_session_messages_async(session_id: str, limit: int = None) -> List[Dict[str, Any]]:
+    return await run_in_db_thread(get_session_messages, session_id, limit)
+
+async def get_session_messages_page_async(session_id: str, before_id: int = None, limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+    return await run_in_db_thread(get_session_messages_page, session_id, before_id, limit)
+
+async def get_session_messages_range_async(session_id: str, start: int, end: int) -> List[Dict[str, Any]]:
+    return await run_in_db_thread(get_session_messages_range, session_id, start, end)
+
+async def count_session_messages_async(session_id: str) -> int:
+    return await run_in_db_thread(count_session_messages, session_id)
+
+async def get_session_summary_async(session_id: str) -> Optional[Dict[str, Any]]:
+    return await run_in_db_thread(get_session_summary, session_id)
+
+async def save_session_summary_async(session_id: str, summary: str, covered_count: int):
+    await run_in_db_thread(save_session_summary, session_id, summary, covered_count)
+
+async def add_message_async(session_id: str, role: str, content: str):
+    if WRITE_BEHIND:
+        # Only enqueues, so there is no disk I/O to move off the loop
+        add_message(session_id, role, content)
+        return
+    await run_in_db_thread(add_message, session_id, role, content)
+
+async def search_messages_async(query: str, session_id: str = None, since: str = None, until: str = None,
+                                limit: int = 20, highlight: tuple = ("<mark>", "</mark>")) -> List[Dict[str, Any]]:
+    return await run_in_db_thread(search_messages, query, session_id, since, until, limit, highlight)
+
+async def run_maintenance_async(idle_days: int = ARCHIVE_IDLE_DAYS) -> Dict[str, Any]:
+    return await run_in_db_thread(run_maintenance, idle_days)
+
+async def import_ndjson_async(lines: Iterable) -> Dict[str, int]:
+    return await run_in_db_thread(import_ndjson, lines)
+
+async def delete_session_async(session_id: str):
+    await run_in_db_thread(delete_session, session_id)
+
+async def update_session_title_async(session_id: str, title: str):
+    await run_in_db_thread(update_session_title, session_id, title)
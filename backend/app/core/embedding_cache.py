@@ -0,0 +1,273 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+EMBEDDING_CACHE_PATH = "embedding_cache.db"
+# RAM kept for vectors in front of the SQLite file (float32: 12 KB per 3072-dim vector)
+EMBEDDING_CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+# Rows kept on disk; the oldest are pruned at startup
+EMBEDDING_CACHE_DISK_ENTRIES = 200_000
+
+Key = Tuple[str, str, str]
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _pack(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding store shared by the providers, memory and RAG.
+
+    Vectors are keyed by (provider, model, sha256(text)), so the same text
+    embedded by the same model is only sent to the API once. An in-memory
+    LRU, bounded in bytes, sits in front of an optional SQLite file; both
+    hold the vectors as float32 blobs. Thread-safe: the LRU and the SQLite
+    connection have separate locks, so RAM hits never wait on disk I/O.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_memory_bytes: int = EMBEDDING_CACHE_MEMORY_BYTES,
+                 max_disk_entries: int = EMBEDDING_CACHE_DISK_ENTRIES):
+        self.path = path
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[Key, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.requests_saved = 0
+        if path:
+            self._open_store()
+
+    def _open_store(self):
+        try:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('''
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    provider TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (provider, model, hash)
+                ) WITHOUT ROWID
+            ''')
+            self._db.execute('''
+                DELETE FROM embeddings WHERE created_at < (
+                    SELECT created_at FROM embeddings ORDER BY created_at DESC LIMIT 1 OFFSET ?
+                )
+            ''', (self.max_disk_entries - 1,))
+            self._db.commit()
+        except Exception as e:
+            logger.warning(f"Embedding cache persistence disabled: {e}")
+            self._db = None
+
+    def lookup(self, provider: str, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached vectors for `texts` (None where missing), checking RAM and then disk."""
+        keys = self._keys(provider, model, texts)
+        found = self._lookup_memory(keys)
+        missing = [i for i, vector in enumerate(found) if vector is None]
+        if missing:
+            self._fill_from_disk(keys, found, missing, self._load([keys[i] for i in missing]))
+        return found
+
+    def store(self, provider: str, model: str, texts: List[str], vectors: List[List[float]], persist: bool = True):
+        """
+        Remember freshly computed vectors; empty ones (failures) are skipped.
+        With persist=False the caller writes the returned rows with `persist` later.
+        """
+        rows = [((provider, model or "", text_hash(text)), _pack(vector))
+                for text, vector in zip(texts, vectors) if vector]
+        with self._lock:
+            for key, blob in rows:
+                self._remember(key, blob)
+        if persist:
+            self.persist(rows)
+        return rows
+
+    def persist(self, rows: List[Tuple[Key, bytes]]):
+        """Write (key, float32 blob) rows to the SQLite file."""
+        if not rows:
+            return
+        with self._db_lock:
+            if self._db is None:
+                return
+            try:
+                now = time.time()
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO embeddings (provider, model, hash, vector, created_at) VALUES (?, ?, ?, ?, ?)',
+                    [(*key, blob, now) for key, blob in rows])
+                self._db.commit()
+            except Exception as e:
+                logger.error(f"Error writing embedding cache: {e}")
+
+    def embed(self, provider: str, model: str, texts: List[str],
+              compute: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """Vectors for `texts`, calling `compute` (one call, in order) only for those not cached."""
+        found = self.lookup(provider, model, texts)
+        missing = self._missing(texts, found)
+        if missing:
+            self.persist(self._fill(provider, model, found, missing, compute(list(missing))))
+        return found
+
+    async def aembed(self, provider: str, model: str, texts: List[str],
+                     compute: Callable[[List[str]], Awaitable[List[List[float]]]]) -> List[List[float]]:
+        """
+        Async `embed`. RAM hits are answered on the event loop without touching
+        the disk; the SQLite read for RAM misses and the write of new vectors
+        run in threads.
+        """
+        keys = self._keys(provider, model, texts)
+        found = self._lookup_memory(keys)
+        missing_indices = [i for i, vector in enumerate(found) if vector is None]
+        loop = asyncio.get_running_loop()
+        if missing_indices:
+            if self._db is not None:
+                loaded = await loop.run_in_executor(None, self._load, [keys[i] for i in missing_indices])
+            else:
+                loaded = [None] * len(missing_indices)
+            self._fill_from_disk(keys, found, missing_indices, loaded)
+        missing = self._missing(texts, found)
+        if missing:
+            rows = self._fill(provider, model, found, missing, await compute(list(missing)))
+            if rows and self._db is not None:
+                loop.run_in_executor(None, self.persist, rows)
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                # Texts that weren't sent to an embedding API, and calls that weren't made at all
+                "texts_saved": hits,
+                "requests_saved": self.requests_saved,
+                "persistent": self._db is not None,
+            }
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @staticmethod
+    def _keys(provider: str, model: str, texts: List[str]) -> List[Key]:
+        return [(provider, model or "", text_hash(text)) for text in texts]
+
+    def _lookup_memory(self, keys: List[Key]) -> List[Optional[List[float]]]:
+        blobs: List[Optional[bytes]] = [None] * len(keys)
+        with self._lock:
+            for i, key in enumerate(keys):
+                blob = self._memory.get(key)
+                if blob is not None:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    blobs[i] = blob
+        return [_unpack(blob) if blob is not None else None for blob in blobs]
+
+    def _fill_from_disk(self, keys: List[Key], found: List[Optional[List[float]]],
+                        missing: List[int], loaded: List[Optional[bytes]]):
+        with self._lock:
+            for i, blob in zip(missing, loaded):
+                if blob is not None:
+                    self._remember(keys[i], blob)
+                    self.disk_hits += 1
+                    found[i] = _unpack(blob)
+                else:
+                    self.misses += 1
+
+    def _missing(self, texts: List[str], found: List[Optional[List[float]]]) -> "OrderedDict[str, List[int]]":
+        """Uncached texts (each once) and where they go in the result."""
+        missing: "OrderedDict[str, List[int]]" = OrderedDict()
+        for i, vector in enumerate(found):
+            if vector is None:
+                missing.setdefault(texts[i], []).append(i)
+        if texts and not missing:
+            with self._lock:
+                self.requests_saved += 1
+        return missing
+
+    def _fill(self, provider: str, model: str, found: List[Optional[List[float]]],
+              missing: "OrderedDict[str, List[int]]", vectors: List[List[float]]):
+        texts = list(missing)
+        if len(vectors) != len(texts):
+            logger.error(f"Expected {len(texts)} embeddings, got {len(vectors)}")
+            vectors = [[] for _ in texts]
+        rows = self.store(provider, model, texts, vectors, persist=False)
+        for text, vector in zip(texts, vectors):
+            for i in missing[text]:
+                found[i] = list(vector) if vector else []
+        return rows
+
+    def _remember(self, key: Key, blob: bytes):
+        # Caller holds self._lock
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = blob
+        self._memory_bytes += len(blob)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _load(self, keys: List[Key]) -> List[Optional[bytes]]:
+        """Float32 blobs for `keys` from the SQLite file (None where missing)."""
+        with self._db_lock:
+            if self._db is None:
+                return [None] * len(keys)
+            try:
+                blobs = []
+                for key in keys:
+                    row = self._db.execute('SELECT vector FROM embeddings WHERE provider = ? AND model = ? AND hash = ?',
+                                           key).fetchone()
+                    blobs.append(row[0] if row else None)
+                return blobs
+            except Exception as e:
+                logger.error(f"Error reading embedding cache: {e}")
+                return [None] * len(keys)
+
+
+_shared: Optional[EmbeddingCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """The process-wide cache, persisted to EMBEDDING_CACHE_PATH (opened on first use)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = EmbeddingCache(path=EMBEDDING_CACHE_PATH)
+        return _shared
@@ -0,0 +1,102 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+LOG_FILE = "assistant.log"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# Every module logger hangs off this one, so a single handler covers the app
+ROOT_LOGGER = "app"
+
+# Attributes every LogRecord has; anything else was passed via `extra=` and is logged as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, extra fields and exception."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _setup():
+    """Attach a QueueHandler to the app logger; a listener thread does the actual writing."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        handlers = []
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        handlers.append(console)
+        try:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                os.path.join(LOG_DIR, LOG_FILE), maxBytes=LOG_MAX_BYTES,
+                backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True)
+            file_handler.setFormatter(JsonFormatter())
+            handlers.append(file_handler)
+        except OSError as e:
+            console.handleError(logging.makeLogRecord({"msg": f"File logging disabled: {e}"}))
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger(ROOT_LOGGER)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        root.setLevel(LOG_LEVEL if LOG_LEVEL in logging._nameToLevel else logging.INFO)
+        # Uvicorn configures the root logger; don't print everything twice
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger for a module, e.g. get_logger(__name__). Calls only enqueue; a background thread writes."""
+    _setup()
+    if name != ROOT_LOGGER and not name.startswith(ROOT_LOGGER + "."):
+        name = f"{ROOT_LOGGER}.{name}"
+    return logging.getLogger(name)
+
+
+def set_level(level: str):
+    """Change the log level at runtime (e.g. "DEBUG" while investigating)."""
+    logging.getLogger(ROOT_LOGGER).setLevel(level.upper())
+
+
+def shutdown_logging():
+    """Write out everything still queued and stop the writer thread."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+            for handler in list(logging.getLogger(ROOT_LOGGER).handlers):
+                if isinstance(handler, logging.handlers.QueueHandler):
+                    logging.getLogger(ROOT_LOGGER).removeHandler(handler)
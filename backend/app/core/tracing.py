@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+try:
+    from opentelemetry import trace as otel_trace
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor, SpanExportResult
+except ImportError:
+    otel_trace = None
+
+# Finished spans kept in memory for /traces
+TRACE_BUFFER_SIZE = 2000
+
+
+class RecentSpanExporter:
+    """Span exporter that keeps the last `max_spans` finished spans in memory."""
+
+    def __init__(self, max_spans: int = TRACE_BUFFER_SIZE):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        with self._lock:
+            for span in spans:
+                self._spans.append({
+                    "name": span.name,
+                    "trace_id": format(span.context.trace_id, "032x"),
+                    "span_id": format(span.context.span_id, "016x"),
+                    "parent_id": format(span.parent.span_id, "016x") if span.parent else None,
+                    "start": span.start_time / 1e9,
+                    "duration_ms": round((span.end_time - span.start_time) / 1e6, 2),
+                    "attributes": dict(span.attributes or {}),
+                })
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+    def spans(self, trace_id: str = None, limit: int = 200) -> List[Dict[str, Any]]:
+        with self._lock:
+            spans = [s for s in self._spans if trace_id is None or s["trace_id"] == trace_id]
+        return spans[-limit:]
+
+
+recent_spans = RecentSpanExporter()
+_tracer = None
+if otel_trace is not None:
+    # A private provider: the spans stay in this process unless an exporter is added here
+    _provider = TracerProvider()
+    _provider.add_span_processor(SimpleSpanProcessor(recent_spans))
+    _tracer = _provider.get_tracer("project-k")
+
+
+def tracing_enabled() -> bool:
+    return _tracer is not None
+
+
+def _attributes(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v if isinstance(v, (str, bool, int, float)) else str(v) for k, v in attributes.items() if v is not None}
+
+
+class TurnTrace:
+    """
+    Timings of one chat turn, recorded as child spans of a root span.
+
+    Spans are parented explicitly instead of through the current context,
+    so they can be opened and closed across `yield`s of the streaming
+    generators. `breakdown()` gives the per-step durations in milliseconds;
+    it works whether or not the OpenTelemetry SDK is installed.
+    """
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.started = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._root = None
+        self._parent = None
+        if _tracer is not None:
+            self._root = _tracer.start_span(name, attributes=_attributes(attributes))
+            self._parent = otel_trace.set_span_in_context(self._root)
+
+    @property
+    def trace_id(self) -> Optional[str]:
+        return format(self._root.get_span_context().trace_id, "032x") if self._root is not None else None
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time a step; repeated steps (several provider calls or tools) add up."""
+        started = time.perf_counter()
+        span = None
+        if self._parent is not None:
+            span = _tracer.start_span(name, context=self._parent, attributes=_attributes(attributes))
+        try:
+            yield span
+        except BaseException as e:
+            if span is not None:
+                span.set_attribute("error", type(e).__name__)
+            raise
+        finally:
+            self._add(name, time.perf_counter() - started)
+            if span is not None:
+                span.end()
+
+    def record(self, name: str, seconds: float, started: float = None, **attributes):
+        """Add a step that was timed elsewhere (`started` is a perf_counter() value)."""
+        self._add(name, seconds)
+        if self._parent is not None:
+            ago = time.perf_counter() - started if started is not None else seconds
+            start_ns = time.time_ns() - int(ago * 1e9)
+            span = _tracer.start_span(name, context=self._parent, attributes=_attributes(attributes),
+                                      start_time=start_ns)
+            span.end(end_time=start_ns + int(seconds * 1e9))
+
+    def set_attribute(self, key: str, value: Any):
+        if self._root is not None and value is not None:
+            self._root.set_attribute(key, _attributes({key: value})[key])
+
+    def finish(self):
+        """End the root span; idempotent."""
+        if "total" in self.timings:
+            return
+        self._add("total", time.perf_counter() - self.started)
+        if self._root is not None:
+            self._root.end()
+
+    def breakdown(self) -> Dict[str, Any]:
+        with self._lock:
+            timings = {name: round(seconds * 1000, 1) for name, seconds in self.timings.items()}
+        if "total" not in timings:
+            timings["total"] = round((time.perf_counter() - self.started) * 1000, 1)
+        return {"trace_id": self.trace_id, "timings_ms": timings}
+
+    def _add(self, name: str, seconds: float):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def traced(trace: Optional[TurnTrace], name: str, **attributes):
+    """`trace.span(...)`, or nothing when the caller isn't tracing."""
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, **attributes) as span:
+        yield span
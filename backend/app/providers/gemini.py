@@ -3,15 +3,25 @@ from google.genai import types
 import os
 from typing import AsyncGenerator, List, Dict, Any
 from app.services.llm_provider import LLMProvider
+from app.services.embedding_batch import EmbeddingBatcher
 import PIL.Image
 import io
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
 
 class GeminiProvider(LLMProvider):
+    # The batch embedding endpoint takes at most 100 texts per request
+    max_embedding_batch = 100
+    embedding_cache_name = "gemini"
+
     def __init__(self):
         self.client = None
         self.model_name = "gemini-2.5-flash"
+        self.embedding_model = "gemini-embedding-2"
         self.system_instruction = None
         self.api_key = None
+        self._embedding_batcher = EmbeddingBatcher(self.embed_batch, self.max_embedding_batch)
 
     async def configure(self, settings: Dict[str, Any]):
         self.api_key = settings.get("api_key")
@@ -23,7 +33,7 @@ class GeminiProvider(LLMProvider):
             self.system_instruction = settings.get("system_instruction")
             self.model_name = settings.get("model", "gemini-2.5-flash")
         else:
-            print("Warning: No API key found for GeminiProvider")
+            logger.warning("No API key found for GeminiProvider")
 
     async def send_message_stream(
         self, 
@@ -48,16 +58,13 @@ class GeminiProvider(LLMProvider):
                     image = PIL.Image.open(io.BytesIO(img_bytes))
                     parts.append(types.Part.from_image(image=image))
                 except Exception as e:
-                    print(f"Error processing image: {e}")
+                    logger.error(f"Error processing image: {e}")
 
         gemini_history.append(types.Content(role="user", parts=parts))
 
-        def log_debug(msg):
-            with open("debug_gemini.log", "a", encoding="utf-8") as f:
-                f.write(f"{msg}\n")
-
+        response_stream = None
         try:
-            log_debug("DEBUG: GeminiProvider sending message via genai SDK")
+            logger.debug("GeminiProvider sending message via genai SDK")
             
             config = types.GenerateContentConfig()
             if self.system_instruction:
@@ -69,28 +76,38 @@ class GeminiProvider(LLMProvider):
                 config=config
             )
             
-            log_debug("DEBUG: GeminiProvider got response stream")
+            logger.debug("GeminiProvider got response stream")
             async for chunk in response_stream:
                 if chunk.text:
                     yield chunk.text
         except Exception as e:
-            log_debug(f"DEBUG: GeminiProvider Error: {e}")
+            logger.error(f"GeminiProvider Error: {e}")
             yield f"Error generating response: {str(e)}"
+        finally:
+            # If the caller stops early (tool call dispatched), stop the SDK stream too
+            if response_stream is not None and hasattr(response_stream, "aclose"):
+                await response_stream.aclose()
 
     async def get_embedding(self, text: str) -> List[float]:
+        # Cached vectors are reused; concurrent misses are sent together as one batch request
+        return (await self._cached_embeddings([text], self._embedding_batcher.embed_many))[0]
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
         if not self.api_key or not self.client:
-            print("GeminiProvider: No API key for embedding.")
-            return []
+            logger.warning("GeminiProvider: No API key for embedding.")
+            return [[] for _ in texts]
         try:
-            # google-genai specific synchronous embedding call
-            result = self.client.models.embed_content(
-                model="gemini-embedding-2",
-                contents=text,
+            # Async client, so concurrent lookups don't block the event loop
+            result = await self.client.aio.models.embed_content(
+                model=self.embedding_model,
+                contents=texts,
             )
-            # embeddings is a list of EmbedContentResponse, we need .embeddings[0].values
-            if result.embeddings:
-                return result.embeddings[0].values
-            return []
+            # One ContentEmbedding per text, in order; the vector is in .values
+            embeddings = result.embeddings or []
+            if len(embeddings) != len(texts):
+                logger.error(f"Gemini returned {len(embeddings)} embeddings for {len(texts)} texts")
+                return [[] for _ in texts]
+            return [e.values or [] for e in embeddings]
         except Exception as e:
-            print(f"Error generating embedding with Gemini: {e}")
-            return []
+            logger.error(f"Error generating embeddings with Gemini: {e}")
+            return [[] for _ in texts]
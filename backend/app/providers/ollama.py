@@ -1,18 +1,73 @@
-import requests
+import asyncio
+import httpx
 import json
-from typing import AsyncGenerator, List, Dict, Any
+from typing import AsyncGenerator, List, Dict, Any, Optional
 from app.services.llm_provider import LLMProvider
+from app.services.embedding_batch import EmbeddingBatcher, normalize_vector
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Seconds; a local model may take a while to load before its first token
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 300.0
+# Idle connections kept open to the Ollama server
+MAX_KEEPALIVE_CONNECTIONS = 4
+KEEPALIVE_EXPIRY = 60.0
 
 class OllamaProvider(LLMProvider):
+    # Texts per /api/embed request
+    max_embedding_batch = 32
+    # Vectors are unit length on every path; "ollama" held raw /api/embeddings vectors
+    embedding_cache_name = "ollama/unit"
+
     def __init__(self):
         self.base_url = "http://localhost:11434"
         self.model = "llama3"
+        self.num_ctx = 4096
+        self.embedding_model = self.model
+        self.connect_timeout = DEFAULT_CONNECT_TIMEOUT
+        self.read_timeout = DEFAULT_READ_TIMEOUT
+        self._client: Optional[httpx.AsyncClient] = None
+        self._closed = False
+        self._embedding_batcher = EmbeddingBatcher(self.embed_batch, self.max_embedding_batch)
+        # Servers older than /api/embed only embed one text per request
+        self._single_embeddings = False
 
     async def configure(self, settings: Dict[str, Any]):
         provider_settings = settings.get("providers", {}).get("ollama", {})
         self.base_url = provider_settings.get("base_url", "http://localhost:11434")
         self.model = provider_settings.get("model", "llama3")
+        self.num_ctx = int(provider_settings.get("num_ctx", 4096))
+        self.connect_timeout = float(provider_settings.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT))
+        self.read_timeout = float(provider_settings.get("read_timeout", DEFAULT_READ_TIMEOUT))
+        self.embedding_model = self.model
         self.system_instruction = settings.get("system_instruction")
+        # Settings may point at another server; connect lazily with the new ones
+        await self._close_client()
+
+    def _http(self) -> httpx.AsyncClient:
+        """The keep-alive client shared by every request of this provider."""
+        if self._closed:
+            # Don't open a client nobody will close; callers should use the registry's current provider
+            raise RuntimeError("Ollama provider is closed")
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                                    keepalive_expiry=KEEPALIVE_EXPIRY),
+            )
+        return self._client
+
+    async def aclose(self):
+        self._closed = True
+        await self._close_client()
+
+    async def _close_client(self):
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
 
     async def send_message_stream(
         self, 
@@ -46,55 +101,86 @@ class OllamaProvider(LLMProvider):
             
         messages.append(current_msg)
 
-        url = f"{self.base_url}/api/chat"
         payload = {
             "model": self.model,
             "messages": messages,
             "stream": True,
             "options": {
                 "temperature": 0.7,
-                "num_ctx": 4096,
+                "num_ctx": self.num_ctx,
                 "top_p": 0.9,
                 "repeat_penalty": 1.1
             }
         }
         
-        # DEBUG: Log the messages being sent
-        print(f"DEBUG: Sending messages to Ollama: {json.dumps(messages, indent=2)}")
+        logger.debug("Sending %d messages to Ollama", len(messages))
 
         try:
-            # Use requests with stream=True
-            with requests.post(url, json=payload, stream=True) as response:
-                response.raise_for_status()
-                for line in response.iter_lines():
-                    if line:
-                        try:
-                            json_response = json.loads(line.decode('utf-8'))
-                            if "message" in json_response and "content" in json_response["message"]:
-                                content = json_response["message"]["content"]
-                                yield content
-                            
-                            if json_response.get("done", False):
-                                break
-                        except json.JSONDecodeError:
-                            print(f"Failed to decode JSON from Ollama: {line}")
-                            continue
+            # One JSON object per line; the event loop keeps running between lines
+            async with self._http().stream("POST", "/api/chat", json=payload) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    raise httpx.HTTPStatusError(f"{response.status_code}: {_error_detail(response)}",
+                                                request=response.request, response=response)
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        json_response = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.error(f"Failed to decode JSON from Ollama: {line}")
+                        continue
+                    if "error" in json_response:
+                        raise RuntimeError(json_response["error"])
+                    content = json_response.get("message", {}).get("content")
+                    if content:
+                        yield content
+                    # After "done" the body ends; reading it to the end lets the connection be reused
         except Exception as e:
-            print(f"Error communicating with Ollama: {e}")
+            logger.error(f"Error communicating with Ollama: {e}")
             yield f"Error communicating with Ollama: {str(e)}"
 
     async def get_embedding(self, text: str) -> List[float]:
-        url = f"{self.base_url}/api/embeddings"
-        payload = {
-            "model": self.model, # Use the same model or a specific embedding model? 
-                                 # Ideally "nomic-embed-text" or "mxbai-embed-large" but "llama3" works too usually.
-            "prompt": text
-        }
+        # Cached vectors are reused; concurrent misses are sent together as one /api/embed request
+        return (await self._cached_embeddings([text], self._embedding_batcher.embed_many))[0]
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        # Use the same model or a specific embedding model?
+        # Ideally "nomic-embed-text" or "mxbai-embed-large" but "llama3" works too usually.
         try:
-            response = requests.post(url, json=payload)
+            if not self._single_embeddings:
+                response = await self._http().post("/api/embed", json={"model": self.model, "input": texts})
+                # A 404 without an Ollama error body means the endpoint itself is missing
+                if response.status_code == 404 and "model" not in _error_detail(response):
+                    logger.info("Ollama server has no /api/embed; embedding one text per request")
+                    self._single_embeddings = True
+                else:
+                    response.raise_for_status()
+                    embeddings = response.json().get("embeddings", [])
+                    if len(embeddings) == len(texts):
+                        # /api/embed normalizes already; this keeps both endpoints interchangeable
+                        return [normalize_vector(embedding) for embedding in embeddings]
+                    logger.error(f"Ollama returned {len(embeddings)} embeddings for {len(texts)} texts")
+                    return [[] for _ in texts]
+            return list(await asyncio.gather(*(self._single_embedding(text) for text in texts)))
+        except Exception as e:
+            logger.error(f"Error generating embeddings with Ollama: {e}")
+            return [[] for _ in texts]
+
+    async def _single_embedding(self, text: str) -> List[float]:
+        try:
+            response = await self._http().post("/api/embeddings", json={"model": self.model, "prompt": text})
             response.raise_for_status()
-            data = response.json()
-            return data.get("embedding", [])
+            # The legacy endpoint returns raw vectors; /api/embed returns unit ones
+            return normalize_vector(response.json().get("embedding", []))
         except Exception as e:
-            print(f"Error generating embedding with Ollama: {e}")
+            logger.error(f"Error generating embedding with Ollama: {e}")
             return []
+
+
+def _error_detail(response: httpx.Response) -> str:
+    """Ollama's {"error": ...} message, or the raw body."""
+    try:
+        return response.json().get("error") or response.text
+    except (ValueError, AttributeError):
+        return response.text
@@ -1,11 +1,31 @@
 import os
 import asyncio
+import time
 from typing import List, Dict, Any
-from dotenv import load_dotenv
-from app.core.db import add_message, get_session_messages
+from dotenv import load_dotenv, find_dotenv
+from app.core.db import (
+    add_message_async, get_session_messages_range_async, get_session_summary_async, save_session_summary_async,
+)
 from app.services.llm_provider import LLMProvider
 from app.providers.gemini import GeminiProvider
 from app.providers.ollama import OllamaProvider
+from app.services.provider_registry import ProviderRegistry
+from app.services.tool_parser import ToolCallParser
+from app.services.tools import ToolContext, build_tool_registry
+from app.services.tool_cache import ToolResultCache, TOOL_CACHE_PATH
+from app.services.preflight import run_preflight
+from app.services.response_cache import SemanticResponseCache, context_fingerprint, normalize_message, replay_chunks
+from app.services.context_budget import (
+    ContextBudget, SUMMARY_MIN_NEW_MESSAGES, build_summary_prompt, take_for_summary,
+)
+from app.core.logger import get_logger
+from app.core.tracing import TurnTrace, traced
+
+logger = get_logger(__name__)
+
+# Most recent messages considered for the conversation history; the context
+# budget decides how many of them are actually sent
+HISTORY_WINDOW = 100
 
 # System instruction for tool use
 SYSTEM_INSTRUCTION = """
@@ -51,6 +71,8 @@ TOOLS:
   Format: {"tool": "forget_file", "args": {"filename": "plan.pdf"}}
 - search_knowledge: Search your local knowledge base/second brain.
   Format: {"tool": "search_knowledge", "args": {"query": "summary of the plan"}}
+- recall_conversation: Search past conversations with the user. Use this when the user refers to something discussed before.
+  Format: {"tool": "recall_conversation", "args": {"query": "trip to Japan"}}
 
 CRITICAL RULES:
 1. To use a tool, you MUST output the JSON command.
@@ -69,6 +91,9 @@ CRITICAL RULES:
 8. WRITING RULE: If asked to write an essay or long text via `system_control` (type), generate the FULL text. Typing is instant. Do not summarize or output "Simulating writing...". Output the actual text in the `text` argument.
 9. MEDIA RULE: To open/play something on YouTube, use the `search_youtube` tool. This will find the direct video link.
    - Correct: {"tool": "search_youtube", "args": {"query": "song name", "action": "play"}}
+10. MULTIPLE TOOLS RULE: If the request needs several actions that do not depend on each other, output them together as ONE JSON list. They run at the same time and you get all results back at once.
+   - Correct: [{"tool": "system_control", "args": {"action": "open_app", "app_name": "code ."}}, {"tool": "system_control", "args": {"action": "set_volume", "level": 30}}]
+   - Do NOT put dependent steps in one list (e.g. open an app and then type into it); do those one turn at a time.
 """
 
 class AgentService:
@@ -76,34 +101,40 @@ class AgentService:
         self.last_error = None
         self.code_interpreter = None
         self.memory_service = None
+        self.system_control = None
         self.provider: LLMProvider = None
+        self.tools = build_tool_registry(cache=ToolResultCache(path=TOOL_CACHE_PATH))
+        self._summarizing = set()
+        # The loop only keeps weak references to tasks; these stay alive until they finish
+        self._background_tasks = set()
+        self.response_cache = SemanticResponseCache()
         
         try:
             from app.services.code_interpreter import CodeInterpreterService
             self.code_interpreter = CodeInterpreterService()
         except Exception as e:
-            print(f"Failed to init code interpreter: {e}")
+            logger.error(f"Failed to init code interpreter: {e}")
 
         try:
             from app.services.memory import MemoryService
             self.memory_service = MemoryService()
         except Exception as e:
-            print(f"Failed to init memory service: {e}")
+            logger.error(f"Failed to init memory service: {e}")
 
         try:
             from app.services.system_control import SystemControlService
             self.system_control = SystemControlService()
         except Exception as e:
-            print(f"Failed to init system control service: {e}")
+            logger.error(f"Failed to init system control service: {e}")
             
         except Exception as e:
-            print(f"Failed to init system control service: {e}")
+            logger.error(f"Failed to init system control service: {e}")
 
         try:
             from app.services.vision_service import VisionService
             self.vision_service = VisionService()
         except Exception as e:
-            print(f"Failed to init vision service: {e}")
+            logger.error(f"Failed to init vision service: {e}")
             self.vision_service = None
 
         try:
@@ -113,22 +144,52 @@ class AgentService:
             else:
                 self.workflow_service = None
         except Exception as e:
-            print(f"Failed to init workflow service: {e}")
+            logger.error(f"Failed to init workflow service: {e}")
             self.workflow_service = None
             
-        self._configure()
+        self._init_provider_state()
+        # Build the initial provider eagerly where possible
+        try:
+            loop = asyncio.get_event_loop()
+            if loop.is_running():
+                loop.create_task(self._configure())
+            else:
+                loop.run_until_complete(self._configure())
+        except RuntimeError:
+            # No loop available (e.g. during simple script execution); the first request configures it.
+            pass
+        except Exception as e:
+            logger.error(f"Error configuring provider: {e}")
+
+    def _init_provider_state(self):
+        from app.services.settings import SettingsService
+        self.settings_service = SettingsService()
+        self.provider_registry = ProviderRegistry({
+            "gemini": GeminiProvider,
+            "ollama": OllamaProvider,
+        })
+        self.settings: Dict[str, Any] = {}
+        self.provider_name = "gemini"
+        self._dotenv_path = find_dotenv()
+        self._settings_stamp = None
+
+    def _file_stamp(self, path: str):
+        try:
+            stat = os.stat(path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def _reload_settings(self):
+        """Re-read .env and user settings and rebuild the effective provider settings."""
+        load_dotenv(self._dotenv_path or None, override=True)
 
-    def _configure(self, session_id: str = None):
-        load_dotenv(override=True)
-        
         # Load settings
         settings = {}
         try:
-            from app.services.settings import SettingsService
-            settings_service = SettingsService()
-            settings = settings_service.load_settings()
+            settings = self.settings_service.load_settings()
         except Exception as e:
-            print(f"Error loading settings: {e}")
+            logger.error(f"Error loading settings: {e}")
 
         # Determine provider
         provider_name = settings.get("active_provider", "gemini")
@@ -153,11 +214,11 @@ class AgentService:
         # Update settings with the full system prompt so providers can use it
         settings["system_instruction"] = full_system_prompt
 
-        # Factory logic
-        if provider_name == "gemini":
-            self.provider = GeminiProvider()
-        elif provider_name == "ollama":
-            self.provider = OllamaProvider()
+        # Resolve the environment fallback here so a changed key shows up in the settings fingerprint
+        if not settings.get("api_key"):
+            settings["api_key"] = os.getenv("GEMINI_API_KEY")
+
+        if provider_name == "ollama":
             # Add specific instructions for local models to improve stability
             local_stability_prompt = """
             
@@ -171,33 +232,87 @@ class AgentService:
             7. To speak to the user, just output text. Do NOT use a tool like "say" or "speak".
             """
             settings["system_instruction"] += local_stability_prompt
-        else:
+        elif provider_name != "gemini":
             # Fallback to Gemini for now if unknown
-            print(f"Unknown provider {provider_name}, falling back to Gemini")
-            self.provider = GeminiProvider()
-            
-        # Configure provider
-        # We schedule the async configuration
-        try:
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                loop.create_task(self.provider.configure(settings))
-            else:
-                loop.run_until_complete(self.provider.configure(settings))
-        except RuntimeError:
-            # No loop running (e.g. during simple script execution), try to run sync if possible or just ignore
-            # For FastAPI, loop is usually running.
-            pass
-        except Exception as e:
-            print(f"Error configuring provider: {e}")
+            logger.warning(f"Unknown provider {provider_name}, falling back to Gemini")
+            provider_name = "gemini"
 
+        self.settings = settings
+        self.provider_name = provider_name
+        self.response_cache.configure(settings.get("semantic_cache"))
 
-        # Configure provider
-        # Pass system instruction in settings for the provider to use if it supports it
-        provider_settings = settings.copy()
-        provider_settings["system_instruction"] = SYSTEM_INSTRUCTION
-        
-        pass
+    async def _configure(self, hold: bool = False) -> LLMProvider:
+        """
+        Make sure self.provider reflects the current settings.
+
+        Settings and .env are only re-read when either file changed on disk,
+        and the provider registry only rebuilds the provider when the
+        effective settings differ, so an unchanged setup costs two stat calls.
+        With hold=True the returned provider stays open until it is released
+        with provider_registry.release, even if the settings change meanwhile.
+        """
+        stamp = (self._file_stamp(self.settings_service.settings_file), self._file_stamp(self._dotenv_path))
+        if stamp != self._settings_stamp or not self.settings:
+            self._reload_settings()
+            self._settings_stamp = stamp
+
+        provider = await self.provider_registry.get(self.provider_name, self.settings, hold=hold)
+        self.provider = provider
+        return provider
+
+    def _schedule_summary_update(self, session_id: str, target_count: int, provider: LLMProvider):
+        """Bring the session summary up to `target_count` messages in the background."""
+        if session_id in self._summarizing:
+            return
+        self._summarizing.add(session_id)
+        # Held by the task, so a settings change can't close it mid-summary
+        self.provider_registry.acquire(provider)
+        task = self._run_in_background(self._update_session_summary(session_id, target_count, provider))
+        task.add_done_callback(lambda _: self._summarizing.discard(session_id))
+
+    async def _update_session_summary(self, session_id: str, target_count: int, provider: LLMProvider):
+        try:
+            summary = await get_session_summary_async(session_id)
+            text = summary["summary"] if summary else ""
+            covered = summary["covered_count"] if summary else 0
+
+            # Fold in the uncovered messages a bounded slice at a time
+            while covered < target_count:
+                messages = await get_session_messages_range_async(session_id, covered, target_count)
+                batch = take_for_summary(messages)
+                if not batch:
+                    break
+                chunks = []
+                async for chunk in provider.send_message_stream([], build_summary_prompt(text, batch)):
+                    chunks.append(chunk)
+                new_text = "".join(chunks).strip()
+                if not new_text or new_text.startswith("Error"):
+                    logger.error(f"Session summary update failed for {session_id}: {new_text[:200]}")
+                    break
+                text = new_text
+                covered += len(batch)
+                await save_session_summary_async(session_id, text, covered)
+        except Exception as e:
+            logger.error(f"Error updating session summary: {e}")
+        finally:
+            await self.provider_registry.release(provider)
+
+    def _response_cache_scope(self, plan, provider: LLMProvider) -> tuple:
+        """Provider, models and a fingerprint of the prompt around the message (persona, context, last exchange)."""
+        recent = [m["content"] for m in plan.history[-2:]]
+        fingerprint = context_fingerprint([self.settings.get("system_instruction", "")]
+                                          + [text for _, text in plan.context_parts] + recent)
+        chat_model = getattr(provider, "model_name", None) or getattr(provider, "model", None)
+        return (self.provider_name, chat_model, provider.embedding_model, fingerprint)
+
+    def _knowledge_base(self):
+        """The RAG module, or None if it can't be loaded (e.g. Chroma unavailable)."""
+        try:
+            from app.services import rag
+            return rag
+        except Exception as e:
+            logger.warning(f"Knowledge base unavailable: {e}")
+            return None
 
     async def generate_response(self, message: str, session_id: str, image_data: bytes = None, mime_type: str = None, context: str = None, save_user_message: bool = True) -> dict:
         """
@@ -213,83 +328,135 @@ class AgentService:
         
         return {"text": full_text, "command": command}
 
-    async def generate_response_stream(self, message: str, session_id: str, image_data: bytes = None, mime_type: str = None, context: str = None, save_user_message: bool = True):
+    async def generate_response_stream(self, message: str, session_id: str, image_data: bytes = None, mime_type: str = None, context: str = None, save_user_message: bool = True, retrieve_knowledge: bool = False, trace: TurnTrace = None):
         """
         Yields chunks of text. Handles ReAct loop for tools.
+        With retrieve_knowledge, the knowledge base is searched for the message alongside memories.
+        With a trace, the time spent in each step is recorded on it.
         """
-        # Re-configure to ensure fresh settings/provider
-        self._configure(session_id)
-        
-        # Configure provider (async)
-        settings = {}
-        try:
-            from app.services.settings import SettingsService
-            settings = SettingsService().load_settings()
-        except: 
-            pass
-        settings["system_instruction"] = SYSTEM_INSTRUCTION
-        await self.provider.configure(settings)
+        # Pick up settings changes; reuses the live provider when nothing changed.
+        # The turn holds its provider, so a settings change can't close it mid-stream.
+        with traced(trace, "configure"):
+            provider = await self._configure(hold=True)
+        settings = self.settings
+        accumulated_response = ""
+        response_stream = None
+        closed = False
 
         try:
             # Save user message to DB
             if save_user_message:
-                add_message(session_id, "user", message)
+                with traced(trace, "db.save_user_message"):
+                    await add_message_async(session_id, "user", message)
             
-            # Retrieve memories
-            memories = []
-            if self.memory_service:
-                try:
-                    memories = await self.memory_service.search_memory(message, self.provider)
-                except Exception as e:
-                    print(f"Error searching memory: {e}")
-
-            # Prepare initial message
-            msg_content = message
-            
-            # Inject context and memories
+            # The response cache key is embedded while the pre-flight runs
+            cache_embedding = None
+            if self.response_cache.enabled and not image_data:
+                cache_embedding = asyncio.create_task(provider.get_embedding(normalize_message(message)))
+
+            # Memories, knowledge base and history are fetched concurrently
+            knowledge = self._knowledge_base() if retrieve_knowledge else None
+            preflight_started = time.perf_counter()
+            preflight = await run_preflight(message, session_id, provider, self.memory_service,
+                                            knowledge, history_limit=HISTORY_WINDOW)
+            if trace:
+                # The steps ran concurrently; each is recorded with its own duration
+                for name, seconds in preflight.timings.items():
+                    trace.record("preflight" if name == "total" else f"preflight.{name}", seconds,
+                                 started=preflight_started, shared_embedding=preflight.shared_embedding)
+            memories = preflight.memories
+            if preflight.knowledge:
+                context = f"{context}\n\n{preflight.knowledge}" if context else preflight.knowledge
+
+            # Inject context and memories, highest priority first
             context_parts = []
             
             # User Profile Context
             user_profile = settings.get("user_profile", {})
             if user_profile.get("name") or user_profile.get("about_me"):
                 profile_text = f"User Profile:\nName: {user_profile.get('name', 'User')}\nAbout Me: {user_profile.get('about_me', '')}"
-                context_parts.append(profile_text)
+                context_parts.append(("profile", profile_text))
 
-            if context:
-                context_parts.append(f"Context from uploaded documents:\n{context}")
             if memories:
                 memory_text = "\n".join([f"- {m}" for m in memories])
-                context_parts.append(f"Memory Context:\n{memory_text}")
-                
-            if context_parts:
+                context_parts.append(("memories", f"Memory Context:\n{memory_text}"))
+            if context:
+                context_parts.append(("documents", f"Context from uploaded documents:\n{context}"))
+
+            logger.debug(f"Preflight timings: {preflight.timings} (shared embedding: {preflight.shared_embedding})")
+
+            # Fit history and context into the model's context window
+            history = preflight.history
+            total_messages = preflight.total_messages
+            if save_user_message and history and history[-1]["role"] == "user" and history[-1]["content"] == message:
+                # The message just saved is sent separately below
+                history = history[:-1]
+                total_messages -= 1
+
+            budget = ContextBudget.from_settings(settings, self.provider_name)
+            plan = budget.plan(settings.get("system_instruction", ""), message, context_parts, history)
+            older_messages = total_messages - len(plan.history)
+            if older_messages > 0:
+                # Turns that no longer fit are replaced by the session's rolling summary
+                summary = preflight.summary
+                covered = summary["covered_count"] if summary else 0
+                if summary:
+                    summary_part = ("summary", f"Summary of the earlier conversation:\n{summary['summary']}")
+                    # Right after the profile: it matters more than memories or documents
+                    position = 1 if context_parts and context_parts[0][0] == "profile" else 0
+                    context_parts = context_parts[:position] + [summary_part] + context_parts[position:]
+                    plan = budget.plan(settings.get("system_instruction", ""), message, context_parts, history)
+                    older_messages = total_messages - len(plan.history)
+                if older_messages - covered >= SUMMARY_MIN_NEW_MESSAGES or (covered == 0 and older_messages > 0):
+                    self._schedule_summary_update(session_id, older_messages, provider)
+            logger.debug(f"Context budget {budget.context_window}: {plan.usage}, {len(plan.history)} recent messages, {older_messages} summarized/dropped")
+
+            # Prepare initial message
+            msg_content = message
+            if plan.context_parts:
                 # Use a clear separator to distinguish context from user message
-                context_block = "\n\n".join(context_parts)
+                context_block = "\n\n".join(text for _, text in plan.context_parts)
                 msg_content = f"System Context:\n{context_block}\n\nUser Message:\n{message}"
 
             # images = [image_data] if image_data else None
             images = None # DEBUG: Disable images to test if they are causing the error
 
+            # Near-identical message under the same persona and context: replay the earlier answer
+            cache_scope = None
+            if cache_embedding is not None:
+                waited = time.perf_counter()
+                try:
+                    cache_embedding = await cache_embedding
+                except Exception as e:
+                    logger.error(f"Error embedding message for response cache: {e}")
+                    cache_embedding = None
+                if cache_embedding:
+                    cache_scope = self._response_cache_scope(plan, provider)
+                    cached = self.response_cache.lookup(cache_embedding, cache_scope, time.perf_counter() - waited)
+                    if trace:
+                        trace.record("response_cache.lookup", time.perf_counter() - waited, started=waited)
+                        trace.set_attribute("response_cache", "hit" if cached is not None else "miss")
+                    if cached is not None:
+                        logger.debug("Response cache hit")
+                        for chunk in replay_chunks(cached):
+                            yield {"text": chunk}
+                        with traced(trace, "db.save_response"):
+                            await add_message_async(session_id, "model", cached)
+                        return
+            generation_started = time.perf_counter()
+
             # ReAct Loop (Max 5 turns)
-            accumulated_response = ""
-            
-            def log_debug(msg):
-                with open("debug_agent.log", "a") as f:
-                    f.write(f"{msg}\n")
 
             # RETRY LOGIC
             max_retries = 2
             for attempt in range(max_retries):
                 has_yielded_content = False
-                
-                # Load history once per attempt
-                history = []
-                if session_id:
-                    history = get_session_messages(session_id)
+                history = plan.history
 
                 # If this is a retry (attempt > 0), strip context to avoid safety filters
                 current_msg_content = msg_content
                 if attempt > 0:
-                    log_debug(f"DEBUG: Retry attempt {attempt}. Stripping context.")
+                    logger.debug(f"Retry attempt {attempt}. Stripping context.")
                     current_msg_content = message # Reset to just the user message
                     if memories: 
                          memory_text = "\n".join([f"- {m}" for m in memories])
@@ -301,432 +468,141 @@ class AgentService:
 
                 for turn in range(5):
                     # Send to provider
-                    log_debug(f"Turn {turn}: Sending message to provider...")
-                    response_stream = self.provider.send_message_stream(session_history, current_msg_content, images)
+                    logger.debug(f"Turn {turn}: Sending message to provider...")
+                    response_stream = provider.send_message_stream(session_history, current_msg_content, images)
+                    provider_started = time.perf_counter()
+                    first_chunk = True
+                    
+                    turn_chunks = []
+                    tool_parser = ToolCallParser()
                     
-                    current_turn_text = ""
+                    dispatched_early = False
                     
                     async for text_chunk in response_stream:
-                        log_debug(f"DEBUG: Received chunk: {text_chunk!r}")
-                        current_turn_text += text_chunk
+                        logger.debug("Received chunk: %r", text_chunk)
+                        if first_chunk and trace:
+                            trace.record("provider.ttft", time.perf_counter() - provider_started,
+                                         started=provider_started, provider=self.provider_name, turn=turn)
+                        first_chunk = False
+                        chunk_offset = tool_parser.position
+                        if tool_parser.feed(text_chunk):
+                            # A complete tool call: run it now instead of waiting for the stream to end.
+                            # Rule 6 forbids output after the JSON, so whatever follows is dropped.
+                            text_chunk = text_chunk[:tool_parser.calls[0].end - chunk_offset]
+                            dispatched_early = True
+                        turn_chunks.append(text_chunk)
                         
                         # We yield text as it comes
-                        yield {"text": text_chunk}
-                        accumulated_response += text_chunk
-                        has_yielded_content = True
+                        if text_chunk:
+                            # Counted before the yield: a client that closes the stream there has seen it
+                            accumulated_response += text_chunk
+                            has_yielded_content = True
+                            yield {"text": text_chunk}
+                        if dispatched_early:
+                            break
+
+                    if dispatched_early:
+                        # Cancel the rest of the generation (closes the HTTP stream)
+                        await self._close_stream(response_stream)
+                        logger.debug("Tool call complete mid-stream, dispatching early")
+                    if trace:
+                        trace.record("provider.stream", time.perf_counter() - provider_started,
+                                     started=provider_started, provider=self.provider_name, turn=turn)
 
-                    # End of stream. Check for tool.
                     # End of stream. Check for tool.
                     import json
-                    command = None
-                    
-                    # Robust JSON extraction
-                    try:
-                        # Find the first '{' that might start a tool JSON
-                        # We scan for "tool" to check validity
-                        start_indices = [i for i, char in enumerate(current_turn_text) if char == '{']
-                        
-                        for start in start_indices:
-                            # Simple optimization: check if "tool" is somewhat near
-                            # snippet = current_turn_text[start:start+100]
-                            # if '"tool"' not in snippet and "'tool'" not in snippet: continue
-
-                            # Stack-based brace counting
-                            balance = 0
-                            found_end = False
-                            for i in range(start, len(current_turn_text)):
-                                char = current_turn_text[i]
-                                if char == '{':
-                                    balance += 1
-                                elif char == '}':
-                                    balance -= 1
-                                    if balance == 0:
-                                        # Potential end of JSON
-                                        candidate = current_turn_text[start:i+1]
-                                        try:
-                                            parsed = json.loads(candidate)
-                                            if "tool" in parsed:
-                                                command = parsed
-                                                found_end = True
-                                                
-                                                # Correct the log logic to capture just this block
-                                                # Re-assign json_match logic for history appending later
-                                                class MockMatch:
-                                                    def end(self): return i+1
-                                                json_match = MockMatch()
-                                                break
-                                        except json.JSONDecodeError:
-                                            # Keep trying, maybe we found an inner brace set
-                                            pass
-                            if found_end:
-                                break
-                                
-                        if command:
-                            log_debug(f"DEBUG: Extracted tool command: {command}")
-                        else:
-                            # Fallback to regex if brace counting fails (e.g. malformed)
-                            # but usually brace counting is superior.
-                            pass
-
-                    except Exception as e:
-                        log_debug(f"Failed to extract JSON: {e}")
-                        command = None
-
-                    if command and "tool" in command:
-                        if not command["tool"]:
-                            log_debug("DEBUG: Ignoring empty tool name.")
-                            command = None
-                        else:
-                            # Check for duplicate execution
-                            tool_signature = f"{command['tool']}:{json.dumps(command['args'], sort_keys=True)}"
+                    current_turn_text = "".join(turn_chunks)
+                    if not dispatched_early:
+                        tool_parser.finish()
+                    tool_call = tool_parser.calls[0] if tool_parser.calls else None
+                    if tool_call:
+                        logger.debug(f"Extracted tool commands: {tool_call.commands}")
+
+                    # A turn may carry one command or a list of independent ones
+                    commands = [c for c in tool_call.commands if c.get("tool")] if tool_call else []
+                    if tool_call and not commands:
+                        logger.debug("Ignoring empty tool name.")
+
+                    if commands:
+                        # Check for duplicate execution
+                        pending = []
+                        for command in commands:
+                            tool_signature = f"{command['tool']}:{json.dumps(command.get('args', {}), sort_keys=True)}"
                             if tool_signature in executed_tools:
-                                log_debug(f"DEBUG: Skipping duplicate tool execution: {tool_signature}")
-                                # Do not yield anything to user.
-                                # Feed back to model to stop it.
-                                current_msg_content = "Tool already executed. Do not repeat. Provide final answer."
-                                images = None
+                                logger.debug(f"Skipping duplicate tool execution: {tool_signature}")
                                 continue
-                            
                             executed_tools.add(tool_signature)
+                            pending.append(command)
 
-                            # Append the assistant's tool call to history so it knows what it did
-                            # We truncate content after the JSON to prevent the model from learning to hallucinate tool outputs
-                            if json_match:
-                                end_index = json_match.end()
-                                clean_content = current_turn_text[:end_index]
-                                session_history.append({"role": "model", "content": clean_content})
-                            else:
-                                session_history.append({"role": "model", "content": current_turn_text})
-                            
-                            # Also append the user message that triggered this (if it was the first turn)
-                            if turn == 0:
-                                 session_history.append({"role": "user", "content": current_msg_content})
+                        if not pending:
+                            # Do not yield anything to user.
+                            # Feed back to model to stop it.
+                            current_msg_content = "Tool already executed. Do not repeat. Provide final answer."
+                            images = None
+                            continue
 
+                        # Append the assistant's tool call to history so it knows what it did
+                        # We truncate content after the JSON to prevent the model from learning to hallucinate tool outputs
+                        clean_content = current_turn_text[:tool_call.end]
+                        session_history.append({"role": "model", "content": clean_content})
+                        
+                        # Also append the user message that triggered this (if it was the first turn)
+                        if turn == 0:
+                             session_history.append({"role": "user", "content": current_msg_content})
+
+                        if len(pending) == 1 and self.tools.get(pending[0]["tool"]) is None:
+                            # Unknown tool, just finish
+                            yield {"command": pending[0]}
+                            await add_message_async(session_id, "model", accumulated_response)
+                            return
+
+                        tool_context = ToolContext(agent=self, session_id=session_id, provider=provider, memories=memories,
+                                                   trace=trace)
+                        calls = []
+                        for command in pending:
                             tool_name = command["tool"]
-                            log_debug(f"DEBUG: Executing tool: {tool_name}")
+                            logger.debug(f"Executing tool: {tool_name}")
                             
                             # Safely get args
                             tool_args = command.get("args", {})
-                        
-                            output_str = ""
-                            if tool_name == "execute_python":
-                                code = tool_args.get("code")
-                                yield {"text": f"\n\n*Executing Code...*\n```python\n{code}\n```\n\n"}
-                                accumulated_response += f"\n\n*Executing Code...*\n```python\n{code}\n```\n\n"
-                                
-                                if self.code_interpreter:
-                                    result = self.code_interpreter.execute_code(code)
-                                    output_str = f"Output:\n{result.get('output', '')}\nResult: {result.get('result', '')}"
-                                    if result.get("error"):
-                                        output_str += f"\nError: {result.get('error')}"
-                                else:
-                                    output_str = "Error: Code Interpreter not available."
-                                    
-                                yield {"text": f"*Result:*\n```\n{output_str}\n```\n\n"}
-                                accumulated_response += f"*Result:*\n```\n{output_str}\n```\n\n"
-                            
-                            elif tool_name == "remember":
-                                text_to_remember = tool_args.get("text")
-                                
-                                # Check if this fact is already in the retrieved memories to prevent hallucinations
-                                # We do a fuzzy check or exact check against the 'memories' list we retrieved earlier
-                                is_duplicate_intent = False
-                                if memories:
-                                    for mem in memories:
-                                        # Simple check: if the new text is contained in an existing memory or vice versa
-                                        # This handles "Color is blue" vs "My favorite color is blue"
-                                        if text_to_remember and (text_to_remember.lower() in mem.lower() or mem.lower() in text_to_remember.lower()):
-                                            is_duplicate_intent = True
-                                            break
-                                
-                                if is_duplicate_intent:
-                                    log_debug(f"DEBUG: Skipping duplicate memory save (hallucination prevention): {text_to_remember}")
-                                    output_str = "Memory already exists. Do not re-save."
-                                    # Do not yield UI message
-                                else:
-                                    yield {"text": f"\n\n*Saving to memory...*\n> {text_to_remember}\n\n"}
-                                    accumulated_response += f"\n\n*Saving to memory...*\n> {text_to_remember}\n\n"
-                                    
-                                    if self.memory_service:
-                                        success = await self.memory_service.add_memory(text_to_remember, self.provider)
-                                        if success:
-                                            output_str = "Memory saved successfully."
-                                        else:
-                                            output_str = "Error: Failed to save memory."
-                                            yield {"text": f"\n\n*Failed to save memory.*\n\n"}
-                                            accumulated_response += f"\n\n*Failed to save memory.*\n\n"
-                                    else:
-                                        output_str = "Error: Memory Service not available."
-
-                            elif tool_name == "system_control":
-                                action = tool_args.get("action")
-                                
-                                if self.system_control:
-                                    if action == "open_app":
-                                        app_name = tool_args.get("app_name")
-                                        yield {"text": f"\n\n*Opening {app_name}...*\n\n"}
-                                        accumulated_response += f"\n\n*Opening {app_name}...*\n\n"
-                                        output_str = self.system_control.open_application(app_name)
-                                    
-                                    elif action == "set_volume":
-                                        level = tool_args.get("level")
-                                        yield {"text": f"\n\n*Setting volume to {level}%...*\n\n"}
-                                        accumulated_response += f"\n\n*Setting volume to {level}%...*\n\n"
-                                        output_str = self.system_control.set_volume(int(level))
-                                    
-                                    elif action == "mute":
-                                        yield {"text": f"\n\n*Muting volume...*\n\n"}
-                                        accumulated_response += f"\n\n*Muting volume...*\n\n"
-                                        output_str = self.system_control.set_mute(True)
-
-                                    elif action == "unmute":
-                                        yield {"text": f"\n\n*Unmuting volume...*\n\n"}
-                                        accumulated_response += f"\n\n*Unmuting volume...*\n\n"
-                                        self.system_control.set_mute(False)
-                                        output_str = "Success: Volume has been unmuted."
-
-                                    elif action == "write_file":
-                                        path = tool_args.get("path")
-                                        content = tool_args.get("content")
-                                        yield {"text": f"\n\n*Writing file {path}...*\n\n"}
-                                        accumulated_response += f"\n\n*Writing file {path}...*\n\n"
-                                        output_str = self.system_control.write_file(path, content)
-
-                                    elif action == "read_file":
-                                        path = tool_args.get("path")
-                                        yield {"text": f"\n\n*Reading file {path}...*\n\n"}
-                                        accumulated_response += f"\n\n*Reading file {path}...*\n\n"
-                                        output_str = self.system_control.read_file(path)
-                                    
-                                    elif action == "list_files":
-                                        path = tool_args.get("path", ".")
-                                        yield {"text": f"\n\n*Listing files in {path}...*\n\n"}
-                                        accumulated_response += f"\n\n*Listing files in {path}...*\n\n"
-                                        output_str = self.system_control.list_files(path)
-
-                                    elif action == "replace_text":
-                                        path = tool_args.get("path")
-                                        search_text = tool_args.get("search_text")
-                                        replace_text = tool_args.get("replace_text")
-                                        yield {"text": f"\n\n*Patching file {path}...*\n\n"}
-                                        accumulated_response += f"\n\n*Patching file {path}...*\n\n"
-                                        output_str = self.system_control.replace_text(path, search_text, replace_text)
-                                    
-                                    elif action == "screenshot":
-                                        yield {"text": f"\n\n*Taking screenshot...*\n\n"}
-                                        accumulated_response += f"\n\n*Taking screenshot...*\n\n"
-                                        screenshot = self.system_control.take_screenshot()
-                                        if screenshot:
-                                            output_str = "Screenshot taken successfully."
-                                        else:
-                                            output_str = "Failed to take screenshot."
-
-                                    elif action == "media":
-                                        sub_action = tool_args.get("action_type") # e.g. "play_pause"
-                                        yield {"text": f"\n\n*Media Control: {sub_action}*\n\n"}
-                                        accumulated_response += f"\n\n*Media Control: {sub_action}*\n\n"
-                                        output_str = self.system_control.media_control(sub_action)
-
-                                    elif action == "power":
-                                        sub_action = tool_args.get("action_type")
-                                        yield {"text": f"\n\n*System Power: {sub_action}*\n\n"}
-                                        accumulated_response += f"\n\n*System Power: {sub_action}*\n\n"
-                                        output_str = self.system_control.system_power(sub_action)
-
-                                    elif action == "brightness":
-                                        level = tool_args.get("level")
-                                        yield {"text": f"\n\n*Setting brightness to {level}%...*\n\n"}
-                                        accumulated_response += f"\n\n*Setting brightness to {level}%...*\n\n"
-                                        output_str = self.system_control.set_brightness(int(level))
-
-                                    elif action == "window":
-                                        sub_action = tool_args.get("action_type")
-                                        yield {"text": f"\n\n*Window Control: {sub_action}*\n\n"}
-                                        accumulated_response += f"\n\n*Window Control: {sub_action}*\n\n"
-                                        output_str = self.system_control.window_control(sub_action)
-
-                                    elif action == "interact":
-                                        sub_action = tool_args.get("action_type") # type, press, hotkey
-                                        yield {"text": f"\n\n*Simulating: {sub_action}*\n\n"}
-                                        accumulated_response += f"\n\n*Simulating: {sub_action}*\n\n"
-                                        
-                                        # Filter out keys that might conflict or aren't needed
-                                        interact_kwargs = {k: v for k, v in tool_args.items() if k not in ["action", "action_type"]}
-                                        output_str = self.system_control.interact(sub_action, **interact_kwargs)
-
-                                    else:
-                                        output_str = f"Error: Unknown system control action '{action}'"
-                                else:
-                                    output_str = "Error: System Control Service not available."
-
-                            elif tool_name == "google_search":
-                                query = tool_args.get("query")
-                                yield {"text": f"\n\n*Searching Google for '{query}'...*\n\n"}
-                                accumulated_response += f"\n\n*Searching Google for '{query}'...*\n\n"
-                                
-                                try:
-                                    from app.services.search import search_web
-                                    results = search_web(query)
-                                    output_str = f"Search Results:\n{results}"
-                                except Exception as e:
-                                    output_str = f"Error performing search: {e}"
-
-                            elif tool_name == "execute_workflow":
-                                name = tool_args.get("name")
-                                yield {"text": f"\n\n*Activating Protocol: {name}...*\n\n"}
-                                accumulated_response += f"\n\n*Activating Protocol: {name}...*\n\n"
-                                
-                                if self.workflow_service:
-                                    try:
-                                        output_str = await self.workflow_service.execute_workflow(name)
-                                    except Exception as e:
-                                        output_str = f"Error executing workflow: {e}"
-                                else:
-                                    output_str = "Error: Workflow Service not available (System Control might be down)."
-
-                            elif tool_name == "ingest_file":
-                                path = tool_args.get("path")
-                                yield {"text": f"\n\n*Ingesting file {path}...*\n\n"}
-                                accumulated_response += f"\n\n*Ingesting file {path}...*\n\n"
-                                
-                                try:
-                                    from app.services.rag import ingest_document
-                                    import os
-                                    if os.path.exists(path):
-                                        filename = os.path.basename(path)
-                                        output_str = ingest_document(path, filename)
-                                    else:
-                                        output_str = f"Error: File not found at {path}"
-                                except Exception as e:
-                                    output_str = f"Error ingesting file: {e}"
-
-                            elif tool_name == "forget_file":
-                                filename = tool_args.get("filename")
-                                # Use basename if full path provided
-                                import os
-                                filename = os.path.basename(filename)
-                                yield {"text": f"\n\n*Removing {filename} from memory...*\n\n"}
-                                accumulated_response += f"\n\n*Removing {filename} from memory...*\n\n"
-                                
-                                try:
-                                    from app.services.rag import remove_document
-                                    output_str = remove_document(filename)
-                                except Exception as e:
-                                    output_str = f"Error removing file: {e}"
-
-                            elif tool_name == "search_knowledge":
-                                query = tool_args.get("query")
-                                yield {"text": f"\n\n*Searching Brain for '{query}'...*\n\n"}
-                                accumulated_response += f"\n\n*Searching Brain for '{query}'...*\n\n"
-                                
-                                try:
-                                    from app.services.rag import retrieve_context
-                                    results = retrieve_context(query)
-                                    if results:
-                                        output_str = f"Knowledge Base Results:\n{results}"
-                                    else:
-                                        output_str = "No relevant information found in knowledge base."
-                                except Exception as e:
-                                    output_str = f"Error searching knowledge base: {e}"
-
-                            elif tool_name == "search_youtube":
-                                query = tool_args.get("query")
-                                action = tool_args.get("action", "play")
-                                yield {"text": f"\n\n*Searching YouTube for '{query}'...*\n\n"}
-                                accumulated_response += f"\n\n*Searching YouTube for '{query}'...*\n\n"
-                                
-                                try:
-                                    from app.services.search import get_first_youtube_video
-                                    video_url = get_first_youtube_video(query)
-                                    
-                                    if video_url:
-                                        # Directly open it using system control
-                                        if self.system_control:
-                                            self.system_control.open_application(video_url)
-                                            output_str = f"Found and opening video: {video_url}"
-                                        else:
-                                            output_str = f"Found video: {video_url} (System control unavailable to open)"
-                                    else:
-                                        output_str = "No video found."
-                                except Exception as e:
-                                    output_str = f"Error searching YouTube: {e}"
-
-                            elif tool_name == "read_url":
-                                url = tool_args.get("url")
-                                yield {"text": f"\n\n*Reading URL {url}...*\n\n"}
-                                accumulated_response += f"\n\n*Reading URL {url}...*\n\n"
-                                
-                                try:
-                                    # Fallback: simple requests or browser read
-                                    # For now, let's use a simple scrape or system_control read if available
-                                    # But since search_web is simple, let's assume we might need a scraper service
-                                    # Let's check imports in main.py, it uses app.services.search.search_web
-                                    # Does main.py have a read_url? No.
-                                    # Let's try requests
-                                    import requests
-                                    from bs4 import BeautifulSoup
-                                    
-                                    try:
-                                        resp = requests.get(url, timeout=10)
-                                        soup = BeautifulSoup(resp.content, 'html.parser')
-                                        
-                                        # Remove script and style elements
-                                        for script in soup(["script", "style"]):
-                                            script.extract()
-                                            
-                                        text = soup.get_text()
-                                        
-                                        # Break into lines and remove leading and trailing space on each
-                                        lines = (line.strip() for line in text.splitlines())
-                                        # Break multi-headlines into a line each
-                                        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                                        # Drop blank lines
-                                        text = '\n'.join(chunk for chunk in chunks if chunk)
-                                        
-                                        output_str = f"URL Content ({url}):\n{text[:2000]}..." # Truncate
-                                    except Exception as e:
-                                        output_str = f"Error reading URL: {e}"
-                                        
-                                except ImportError:
-                                    output_str = "Error: requests or beautifulsoup4 not installed."
-
-                            elif tool_name == "click_on_ui":
-                                description = tool_args.get("description")
-                                yield {"text": f"\n\n*Looking for '{description}'...*\n\n"}
-                                accumulated_response += f"\n\n*Looking for '{description}'...*\n\n"
-                                
-                                if self.vision_service:
-                                    coords = self.vision_service.get_click_coordinates(description)
-                                    if coords:
-                                        x, y = coords
-                                        yield {"text": f"\n\n*Clicking at ({x}, {y})...*\n\n"}
-                                        accumulated_response += f"\n\n*Clicking at ({x}, {y})...*\n\n"
-                                        
-                                        if self.system_control:
-                                            # Use the new click capability
-                                            self.system_control.interact("click", x=x, y=y)
-                                            output_str = f"Clicked description '{description}' at ({x}, {y})."
-                                        else:
-                                            output_str = "Error: Vision found coordinates, but System Control unavailable for clicking."
-                                    else:
-                                        output_str = f"Could not find UI element matching '{description}'."
-                                else:
-                                    output_str = "Error: Vision Service not available."
-
-                            else:
-                                # Unknown tool, just finish
-                                yield {"command": command}
-                                add_message(session_id, "model", accumulated_response)
-                                return
-
-                            # Prepare for next turn
-                            # The new "message" is the tool result
-                            current_msg_content = f"Tool Result: {output_str}\n(Action completed. Do not call this tool again. Provide final answer.)"
-                            images = None # Don't send images again
-                            continue
+                            if not isinstance(tool_args, dict):
+                                tool_args = {}
+                            calls.append((tool_name, tool_args))
+
+                            tool = self.tools.get(tool_name)
+                            announcement = tool.announce(tool_context, tool_args) if tool and tool.announce else None
+                            if announcement:
+                                accumulated_response += announcement
+                                yield {"text": announcement}
+
+                        # Independent calls run concurrently; blocking ones on the tool thread pool
+                        results = await self.tools.run_many(calls, tool_context)
+                        for result in results:
+                            for text in result.display:
+                                accumulated_response += text
+                                yield {"text": text}
+
+                        # Prepare for next turn
+                        # The new "message" is the tool result(s), all in one follow-up
+                        if len(results) == 1:
+                            current_msg_content = f"Tool Result: {results[0].output}\n(Action completed. Do not call this tool again. Provide final answer.)"
+                        else:
+                            lines = [f"[{i}] {name}: {result.output}" for i, ((name, _), result) in enumerate(zip(calls, results), 1)]
+                            current_msg_content = "Tool Results:\n" + "\n".join(lines) + "\n(Actions completed. Do not call these tools again. Provide final answer.)"
+                        images = None # Don't send images again
+                        continue
 
                     # No tool called, we are done
-                    add_message(session_id, "model", accumulated_response)
+                    with traced(trace, "db.save_response"):
+                        await add_message_async(session_id, "model", accumulated_response)
+                    if cache_scope is not None:
+                        # Only plain answers are reusable; tool turns depend on the world at the time,
+                        # and providers stream their errors as text
+                        if attempt == 0 and turn == 0 and not accumulated_response.startswith("Error"):
+                            self.response_cache.store(cache_embedding, cache_scope, accumulated_response,
+                                                      time.perf_counter() - generation_started)
+                        else:
+                            self.response_cache.skip()
                     return 
 
                 # End of turns loop
@@ -740,9 +616,52 @@ class AgentService:
                     else:
                         yield {"text": "I'm sorry, I couldn't generate a response."}
 
+        except asyncio.CancelledError:
+            # The client went away: stop generating, but keep what it was already shown
+            await self._close_stream(response_stream)
+            if accumulated_response:
+                await add_message_async(session_id, "model", accumulated_response)
+            logger.info(f"Response for session {session_id} cancelled")
+            raise
+        except GeneratorExit:
+            closed = True
+            raise
         except Exception as e:
-            print(f"Error generating response stream: {e}")
+            logger.error(f"Error generating response stream: {e}")
             yield {"text": f"I'm sorry, I encountered an error: {str(e)}"}
+        finally:
+            if closed:
+                # The consumer closed this generator, so nothing can be awaited here:
+                # the same cleanup runs as a background task
+                self._run_in_background(
+                    self._finish_closed_response(session_id, provider, response_stream, accumulated_response))
+                logger.info(f"Response for session {session_id} closed by the client")
+            else:
+                await self.provider_registry.release(provider)
+
+    async def _finish_closed_response(self, session_id: str, provider: LLMProvider, response_stream,
+                                      accumulated_response: str):
+        try:
+            await self._close_stream(response_stream)
+            if accumulated_response:
+                await add_message_async(session_id, "model", accumulated_response)
+        finally:
+            await self.provider_registry.release(provider)
+
+    @staticmethod
+    async def _close_stream(response_stream):
+        if response_stream is None:
+            return
+        try:
+            await response_stream.aclose()
+        except Exception as e:
+            logger.debug(f"Error closing provider stream: {e}")
+
+    def _run_in_background(self, coro) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
 
     def get_history(self) -> List[Dict[str, Any]]:
         return []
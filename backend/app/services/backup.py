@@ -0,0 +1,234 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from app.core import db
+from app.services.settings import SETTINGS_FILE
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+BACKUP_DIR = "backups"
+BACKUP_RETENTION = 7
+BACKUP_INTERVAL_HOURS = 12
+CHROMA_DIR = "chroma_db"
+
+# Online backup API stepping: copy this many pages, then yield to writers
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.005
+
+# Held by code that writes to the Chroma persistent directory, so a snapshot
+# never sees a half-written collection.
+chroma_write_lock = threading.RLock()
+
+
+def _is_sqlite_file(path: str) -> bool:
+    return path.endswith((".sqlite3", ".sqlite", ".db"))
+
+
+class BackupService:
+    """
+    Online backups of the assistant's state: history.db, the Chroma
+    persistent directory and user_settings.json.
+
+    SQLite files are copied with the online backup API in small page steps
+    so writers keep going. The Chroma directory is snapshotted under
+    chroma_write_lock; files unchanged since the previous backup are
+    hard-linked instead of copied, so each backup is incremental on disk.
+    Only the newest `retention` backups are kept.
+    """
+
+    def __init__(self, backup_dir: str = BACKUP_DIR, retention: int = BACKUP_RETENTION,
+                 chroma_dir: str = CHROMA_DIR, settings_file: str = SETTINGS_FILE, db_path: str = None):
+        self.backup_dir = backup_dir
+        self.retention = retention
+        self.chroma_dir = chroma_dir
+        self.settings_file = settings_file
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.last_backup: Optional[Dict[str, Any]] = None
+        self.backups_taken = 0
+        self.failures = 0
+
+    def create_backup(self) -> Dict[str, Any]:
+        """Take a backup and return its manifest. Raises RuntimeError if one is already running."""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A backup is already in progress")
+        try:
+            manifest = self._create_backup()
+            self.backups_taken += 1
+            self.last_backup = manifest
+            return manifest
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self._lock.release()
+
+    def _create_backup(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        name = datetime.now().strftime("backup-%Y%m%d-%H%M%S-%f")
+        os.makedirs(self.backup_dir, exist_ok=True)
+        # Build in a temp directory and rename at the end, so a crash never leaves a half backup behind
+        staging = os.path.join(self.backup_dir, f".tmp-{name}")
+        os.makedirs(staging)
+
+        previous = self._latest_backup_path()
+        manifest = {"name": name, "created_at": datetime.now().isoformat(timespec="seconds"), "components": {}}
+        try:
+            db_path = self.db_path or db.DB_PATH
+            if os.path.exists(db_path):
+                # Get queued chat messages on disk first
+                db.flush_messages()
+                manifest["components"]["history"] = self._backup_sqlite(
+                    db_path, os.path.join(staging, os.path.basename(db_path)))
+
+            if os.path.isdir(self.chroma_dir):
+                previous_chroma = os.path.join(previous, "chroma_db") if previous else None
+                manifest["components"]["chroma"] = self._snapshot_chroma(
+                    os.path.join(staging, "chroma_db"), previous_chroma)
+
+            if os.path.exists(self.settings_file):
+                step_start = time.perf_counter()
+                shutil.copy2(self.settings_file, os.path.join(staging, os.path.basename(self.settings_file)))
+                manifest["components"]["settings"] = {
+                    "bytes": os.path.getsize(self.settings_file),
+                    "seconds": time.perf_counter() - step_start,
+                }
+
+            manifest["total_bytes"] = sum(c.get("bytes", 0) for c in manifest["components"].values())
+            manifest["seconds"] = time.perf_counter() - started
+            with open(os.path.join(staging, "manifest.json"), "w") as f:
+                json.dump(manifest, f, indent=4)
+
+            os.rename(staging, os.path.join(self.backup_dir, name))
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        manifest["removed"] = self._rotate()
+        logger.info(f"Backup {name} completed in {manifest['seconds']:.2f}s ({manifest['total_bytes']} bytes)")
+        return manifest
+
+    def _backup_sqlite(self, src_path: str, dest_path: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        steps = 0
+
+        def progress(status, remaining, total):
+            nonlocal steps
+            steps += 1
+
+        src = sqlite3.connect(src_path, timeout=db.BUSY_TIMEOUT_MS / 1000)
+        dest = sqlite3.connect(dest_path)
+        try:
+            src.backup(dest, pages=BACKUP_PAGES_PER_STEP, progress=progress, sleep=BACKUP_STEP_SLEEP)
+        finally:
+            dest.close()
+            src.close()
+
+        return {
+            "bytes": os.path.getsize(dest_path),
+            "steps": steps,
+            "seconds": time.perf_counter() - started,
+        }
+
+    def _snapshot_chroma(self, dest_dir: str, previous_dir: Optional[str]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        stats = {"files": 0, "copied_files": 0, "linked_files": 0, "bytes": 0, "copied_bytes": 0}
+
+        with chroma_write_lock:
+            for root, _, files in os.walk(self.chroma_dir):
+                rel_root = os.path.relpath(root, self.chroma_dir)
+                os.makedirs(os.path.join(dest_dir, rel_root), exist_ok=True)
+                for filename in files:
+                    if filename.endswith(("-wal", "-shm", "-journal")):
+                        continue
+                    src = os.path.join(root, filename)
+                    dest = os.path.join(dest_dir, rel_root, filename)
+                    stats["files"] += 1
+
+                    if _is_sqlite_file(filename):
+                        size = self._backup_sqlite(src, dest)["bytes"]
+                        stats["copied_files"] += 1
+                        stats["copied_bytes"] += size
+                        stats["bytes"] += size
+                        continue
+
+                    size = os.path.getsize(src)
+                    stats["bytes"] += size
+                    if previous_dir and self._link_if_unchanged(src, os.path.join(previous_dir, rel_root, filename), dest):
+                        stats["linked_files"] += 1
+                        continue
+                    shutil.copy2(src, dest)
+                    stats["copied_files"] += 1
+                    stats["copied_bytes"] += size
+
+        stats["seconds"] = time.perf_counter() - started
+        return stats
+
+    @staticmethod
+    def _link_if_unchanged(src: str, previous: str, dest: str) -> bool:
+        try:
+            current, old = os.stat(src), os.stat(previous)
+        except OSError:
+            return False
+        # copy2 preserves mtime, so an unchanged file matches its previous copy exactly
+        if current.st_size != old.st_size or current.st_mtime_ns != old.st_mtime_ns:
+            return False
+        try:
+            os.link(previous, dest)
+            return True
+        except OSError:
+            return False
+
+    def list_backups(self) -> List[Dict[str, Any]]:
+        """Manifests of the retained backups, newest first."""
+        manifests = []
+        for name in self._backup_names():
+            try:
+                with open(os.path.join(self.backup_dir, name, "manifest.json")) as f:
+                    manifests.append(json.load(f))
+            except (OSError, json.JSONDecodeError):
+                manifests.append({"name": name})
+        return list(reversed(manifests))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backups_taken": self.backups_taken,
+            "failures": self.failures,
+            "retained": len(self._backup_names()),
+            "last_backup": self.last_backup,
+        }
+
+    def _backup_names(self) -> List[str]:
+        if not os.path.isdir(self.backup_dir):
+            return []
+        return sorted(n for n in os.listdir(self.backup_dir)
+                      if n.startswith("backup-") and os.path.isdir(os.path.join(self.backup_dir, n)))
+
+    def _latest_backup_path(self) -> Optional[str]:
+        names = self._backup_names()
+        return os.path.join(self.backup_dir, names[-1]) if names else None
+
+    def _rotate(self) -> List[str]:
+        names = self._backup_names()
+        removed = names[:-self.retention] if self.retention > 0 else []
+        for name in removed:
+            shutil.rmtree(os.path.join(self.backup_dir, name), ignore_errors=True)
+        return removed
+
+
+async def backup_loop(service: BackupService, interval_hours: float = BACKUP_INTERVAL_HOURS):
+    """Background task that takes a backup every interval_hours."""
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            await asyncio.to_thread(service.create_backup)
+        except Exception as e:
+            logger.error(f"Scheduled backup failed: {e}")
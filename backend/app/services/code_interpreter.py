@@ -2,6 +2,9 @@ import queue
 import time
 import jupyter_client
 from typing import Dict, Any
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
 
 class CodeInterpreterService:
     def __init__(self):
@@ -18,9 +21,9 @@ class CodeInterpreterService:
             self.kc.start_channels()
             # Wait for kernel to be ready
             self.kc.wait_for_ready(timeout=10)
-            print("Code Interpreter Kernel started.")
+            logger.info("Code Interpreter Kernel started.")
         except Exception as e:
-            print(f"Failed to start Code Interpreter Kernel: {e}")
+            logger.error(f"Failed to start Code Interpreter Kernel: {e}")
             self.km = None
             self.kc = None
 
@@ -73,6 +76,12 @@ class CodeInterpreterService:
         except Exception as e:
             return {"error": f"Execution failed: {str(e)}"}
 
+    def interrupt(self):
+        """Interrupt the running cell (like Ctrl+C); execute_code then returns the KeyboardInterrupt."""
+        if self.km:
+            self.km.interrupt_kernel()
+            logger.info("Code Interpreter Kernel interrupted.")
+
     def restart_kernel(self):
         """Restarts the kernel."""
         if self.km:
@@ -80,10 +89,10 @@ class CodeInterpreterService:
             self.kc = self.km.client()
             self.kc.start_channels()
             self.kc.wait_for_ready()
-            print("Code Interpreter Kernel restarted.")
+            logger.info("Code Interpreter Kernel restarted.")
 
     def shutdown(self):
         """Shuts down the kernel."""
         if self.km:
             self.km.shutdown_kernel()
-            print("Code Interpreter Kernel shutdown.")
+            logger.info("Code Interpreter Kernel shutdown.")
@@ -0,0 +1,147 @@
+import math
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+# Rough tokenizer-free estimate; close enough for English text on both Gemini and Llama tokenizers
+CHARS_PER_TOKEN = 4
+# Role markers / separators each message costs on top of its text
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Context windows used when the settings don't say otherwise. Gemini accepts
+# far more, but every extra token costs latency and money.
+DEFAULT_CONTEXT_WINDOWS = {"ollama": 4096, "gemini": 32768}
+# Tokens kept free for the model's answer
+MAX_OUTPUT_RESERVE = 2048
+# Share of the remaining budget that injected context (profile, summary, memories, documents) may use
+CONTEXT_SHARE = 0.35
+
+# Re-summarize once this many messages have fallen out of the verbatim window since the last summary
+SUMMARY_MIN_NEW_MESSAGES = 6
+# Upper bound on the transcript sent in one summarization call
+SUMMARY_MAX_INPUT_TOKENS = 3000
+SUMMARY_MAX_WORDS = 250
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    return estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, marking the cut."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    return text[:max_tokens * CHARS_PER_TOKEN].rstrip() + " [...]"
+
+
+def context_window_for(settings: Dict[str, Any], provider_name: str) -> int:
+    """The context size to budget for: providers.<name>.num_ctx / context_window, else the default."""
+    provider_settings = settings.get("providers", {}).get(provider_name, {})
+    window = provider_settings.get("num_ctx") or provider_settings.get("context_window")
+    try:
+        return int(window) if window else DEFAULT_CONTEXT_WINDOWS.get(provider_name, 8192)
+    except (TypeError, ValueError):
+        return DEFAULT_CONTEXT_WINDOWS.get(provider_name, 8192)
+
+
+@dataclass
+class ContextPlan:
+    """What fits: trimmed context parts, the recent history sent verbatim, and token counts per part."""
+    context_parts: List[Tuple[str, str]]
+    history: List[Dict[str, Any]]
+    dropped_messages: int
+    usage: Dict[str, int] = field(default_factory=dict)
+
+
+class ContextBudget:
+    """
+    Splits a model's context window between the fixed parts of a request
+    (system prompt, the user's message, room for the answer), injected
+    context and conversation history.
+
+    Context parts are trimmed in priority order to their share of the
+    budget; history gets everything left and keeps the newest turns
+    verbatim. How many older messages were dropped is reported so the
+    caller can stand in a summary for them.
+    """
+
+    def __init__(self, context_window: int, output_reserve: int = None, context_share: float = CONTEXT_SHARE):
+        self.context_window = context_window
+        self.output_reserve = output_reserve if output_reserve is not None else min(MAX_OUTPUT_RESERVE, context_window // 4)
+        self.context_share = context_share
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any], provider_name: str) -> "ContextBudget":
+        return cls(context_window_for(settings, provider_name))
+
+    def plan(self, system_prompt: str, message: str, context_parts: List[Tuple[str, str]],
+             history: List[Dict[str, Any]]) -> ContextPlan:
+        usage = {
+            "system": estimate_tokens(system_prompt),
+            "message": estimate_tokens(message) + MESSAGE_OVERHEAD_TOKENS,
+            "output_reserve": self.output_reserve,
+        }
+        available = max(0, self.context_window - sum(usage.values()))
+
+        # Injected context, highest priority first
+        context_budget = int(available * self.context_share)
+        kept_parts = []
+        for label, text in context_parts:
+            part = truncate_to_tokens(text, context_budget)
+            if not part:
+                continue
+            tokens = estimate_tokens(part)
+            context_budget -= tokens
+            available -= tokens
+            usage[label] = tokens
+            kept_parts.append((label, part))
+
+        # Newest history first, until the budget runs out
+        history_tokens = 0
+        kept = 0
+        for msg in reversed(history):
+            tokens = message_tokens(msg)
+            if history_tokens + tokens > available:
+                break
+            history_tokens += tokens
+            kept += 1
+        usage["history"] = history_tokens
+
+        recent = history[len(history) - kept:] if kept else []
+        return ContextPlan(kept_parts, recent, len(history) - kept, usage)
+
+
+def build_summary_prompt(previous_summary: str, messages: List[Dict[str, Any]]) -> str:
+    """Prompt asking the model to fold new transcript lines into the running summary."""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    previous = previous_summary or "(none yet)"
+    return (
+        "You are maintaining a running summary of an older part of a conversation between the user and an AI assistant.\n"
+        "Do NOT use any tools and do NOT output JSON. Only write the summary.\n\n"
+        f"Current summary:\n{previous}\n\n"
+        f"New messages to fold in:\n{transcript}\n\n"
+        f"Write the updated summary in at most {SUMMARY_MAX_WORDS} words. Keep facts about the user, decisions, "
+        "open tasks, names, numbers and file paths; drop greetings and small talk."
+    )
+
+
+def take_for_summary(messages: List[Dict[str, Any]], max_tokens: int = SUMMARY_MAX_INPUT_TOKENS) -> List[Dict[str, Any]]:
+    """The oldest messages whose transcript fits in max_tokens (always at least one, truncated if needed)."""
+    taken = []
+    total = 0
+    for msg in messages:
+        tokens = message_tokens(msg)
+        if taken and total + tokens > max_tokens:
+            break
+        if not taken and tokens > max_tokens:
+            msg = dict(msg, content=truncate_to_tokens(msg["content"], max_tokens))
+        taken.append(msg)
+        total += tokens
+    return taken
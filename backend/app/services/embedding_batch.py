@@ -0,0 +1,108 @@
+import asyncio
+import math
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Batched requests of one get_embeddings call that may be in flight at once
+EMBEDDING_CONCURRENCY = 4
+
+EmbedBatch = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+
+def normalize_vector(vector: List[float]) -> List[float]:
+    """`vector` scaled to unit length (empty and zero vectors are returned as they are)."""
+    norm = math.sqrt(sum(x * x for x in vector))
+    if not norm:
+        return list(vector)
+    return [x / norm for x in vector]
+
+
+def split_batches(texts: List[str], size: int) -> List[List[str]]:
+    size = max(1, size)
+    return [texts[i:i + size] for i in range(0, len(texts), size)]
+
+
+async def embed_in_batches(embed_batch: EmbedBatch, texts: List[str], max_batch: int,
+                           concurrency: int = EMBEDDING_CONCURRENCY) -> List[List[float]]:
+    """
+    Embed `texts` with requests of at most `max_batch` texts, a few in flight
+    at a time. Results are in input order; a failed batch gives [] for each
+    of its texts.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(batch: List[str]) -> List[List[float]]:
+        async with semaphore:
+            try:
+                vectors = await embed_batch(batch)
+            except Exception as e:
+                logger.error(f"Error embedding a batch of {len(batch)} texts: {e}")
+                vectors = None
+        if not vectors or len(vectors) != len(batch):
+            return [[] for _ in batch]
+        return [list(v) if v else [] for v in vectors]
+
+    results = await asyncio.gather(*(run(batch) for batch in split_batches(texts, max_batch)))
+    return [vector for batch in results for vector in batch]
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batches single-text embedding requests.
+
+    Requests made in the same event loop iteration (e.g. the concurrent
+    lookups of the chat pre-flight) go out as one batched request, so
+    coalescing adds no delay. Identical texts in a batch are embedded once.
+    """
+
+    def __init__(self, embed_batch: EmbedBatch, max_batch: int):
+        self.embed_batch = embed_batch
+        self.max_batch = max(1, max_batch)
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_scheduled = False
+        # Sends in flight; the event loop alone wouldn't keep them from being garbage-collected
+        self._sending: Set[asyncio.Task] = set()
+        self.requests = 0
+        self.batches = 0
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self.requests += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            loop.call_soon(self._flush)
+        return await future
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*(self.embed(text) for text in texts)))
+
+    def _flush(self):
+        self._flush_scheduled = False
+        pending, self._pending = self._pending, []
+        if pending:
+            self.batches += 1
+            task = asyncio.ensure_future(self._send(pending))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, pending: List[Tuple[str, asyncio.Future]]):
+        unique: Dict[str, int] = {}
+        for text, _ in pending:
+            unique.setdefault(text, len(unique))
+        try:
+            vectors = await embed_in_batches(self.embed_batch, list(unique), self.max_batch)
+        except BaseException:
+            # Cancelled (e.g. at shutdown): don't leave the callers waiting
+            for _, future in pending:
+                if not future.done():
+                    future.cancel()
+            raise
+        for text, future in pending:
+            if not future.done():
+                future.set_result(vectors[unique[text]])
@@ -1,7 +1,17 @@
+import asyncio
 from abc import ABC, abstractmethod
 from typing import AsyncGenerator, List, Dict, Any
+from app.services.embedding_batch import embed_in_batches
+from app.core.embedding_cache import get_embedding_cache
 
 class LLMProvider(ABC):
+    # Model behind get_embedding; callers use it to tell whether vectors are interchangeable
+    embedding_model: str = None
+    # Most texts a single embedding request may carry
+    max_embedding_batch: int = 1
+    # Provider part of the embedding cache key; None leaves the vectors uncached
+    embedding_cache_name: str = None
+
     @abstractmethod
     async def configure(self, settings: Dict[str, Any]):
         """
@@ -35,3 +45,30 @@ class LLMProvider(ABC):
         Generates an embedding vector for the given text.
         """
         pass
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds up to `max_embedding_batch` texts in one request.
+        Providers with a batch endpoint override this; the default makes one call per text.
+        """
+        return list(await asyncio.gather(*(self.get_embedding(text) for text in texts)))
+
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generates embeddings for many texts, in order, with as few requests as
+        the provider allows. Texts that failed get an empty list.
+        """
+        return await self._cached_embeddings(
+            texts, lambda missing: embed_in_batches(self.embed_batch, missing, self.max_embedding_batch))
+
+    async def _cached_embeddings(self, texts: List[str], compute) -> List[List[float]]:
+        """Vectors from the shared embedding cache; `compute(missing_texts)` embeds the rest."""
+        if not self.embedding_cache_name:
+            return await compute(texts)
+        return await get_embedding_cache().aembed(self.embedding_cache_name, self.embedding_model, texts, compute)
+
+    async def aclose(self):
+        """
+        Releases any resources (e.g. HTTP clients) held by the provider.
+        """
+        pass
@@ -1,93 +1,160 @@
+import asyncio
 import chromadb
+import hashlib
+import math
 import uuid
 from typing import List, Dict, Any, Optional
 from app.services.llm_provider import LLMProvider
+from app.services.backup import chroma_write_lock
+from app.services.embedding_batch import normalize_vector
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Collection metadata key set once every stored vector is unit length
+NORMALIZED_MARKER = "embeddings_normalized"
+# Memories read per page by the normalization migration
+MIGRATION_PAGE_SIZE = 500
 
 class MemoryService:
     def __init__(self, persist_directory: str = "chroma_db"):
         self.client = chromadb.PersistentClient(path=persist_directory)
         self.collection = self.client.get_or_create_collection(name="user_memories")
+        self._normalize_stored_embeddings()
+
+    def _normalize_stored_embeddings(self):
+        """
+        One-time migration to unit-length vectors.
+
+        Memories embedded through Ollama's legacy /api/embeddings were stored
+        as raw vectors, while its /api/embed (and so every query now) returns
+        them normalized, which skews L2 ranking. Scaling keeps each vector's
+        direction, so no text has to be embedded again.
+        """
+        metadata = self.collection.metadata or {}
+        if metadata.get(NORMALIZED_MARKER):
+            return
+        try:
+            fixed = 0
+            offset = 0
+            while True:
+                page = self.collection.get(include=["embeddings"], limit=MIGRATION_PAGE_SIZE, offset=offset)
+                ids = page["ids"]
+                if not ids:
+                    break
+                updates = [(memory_id, [float(x) for x in embedding])
+                           for memory_id, embedding in zip(ids, page["embeddings"])]
+                updates = [(memory_id, normalize_vector(embedding)) for memory_id, embedding in updates
+                           if abs(math.sqrt(sum(x * x for x in embedding)) - 1.0) > 1e-3]
+                if updates:
+                    with chroma_write_lock:
+                        self.collection.update(ids=[memory_id for memory_id, _ in updates],
+                                               embeddings=[embedding for _, embedding in updates])
+                    fixed += len(updates)
+                offset += len(ids)
+            self.collection.modify(metadata={**metadata, NORMALIZED_MARKER: 1})
+            if fixed:
+                logger.info(f"Normalized {fixed} stored memory embeddings")
+        except Exception as e:
+            logger.error(f"Error normalizing stored memory embeddings: {e}")
 
     async def add_memory(self, text: str, provider: LLMProvider, metadata: Dict[str, Any] = None) -> bool:
         """
         Adds a new memory to the vector store.
         """
-        print(f"DEBUG: Attempting to add memory: '{text}'")
+        logger.debug(f"Attempting to add memory: '{text}'")
         if not text:
-            print("DEBUG: Memory text is empty.")
+            logger.debug("Memory text is empty.")
             return
+        return (await self.add_memories([text], provider, metadata))[0]
 
-        # Generate embedding
-        embedding = await provider.get_embedding(text)
-        if not embedding:
-            print("DEBUG: Failed to generate embedding for memory.")
-            return False
-
-        # Generate hash for deduplication
-        import hashlib
-        text_hash = hashlib.sha256(text.encode()).hexdigest()
+    async def add_memories(self, texts: List[str], provider: LLMProvider, metadata: Dict[str, Any] = None) -> List[bool]:
+        """
+        Adds several memories with one batched embedding call and one write.
+        Returns, per text, whether it is stored (now or already before).
+        """
+        # Generate hash for deduplication; repeated texts are stored once
+        hashes = [hashlib.sha256(text.encode()).hexdigest() if text else None for text in texts]
+        first_index = {}
+        for i, text_hash in enumerate(hashes):
+            if text_hash and text_hash not in first_index:
+                first_index[text_hash] = i
+        if not first_index:
+            return [False] * len(texts)
 
-        # Check for duplicates using metadata
+        # Check for duplicates using metadata, before paying for embeddings
+        stored = set()
         try:
-            existing = self.collection.get(where={"text_hash": text_hash})
-            if existing and existing['ids']:
-                print(f"DEBUG: Memory already exists (hash match): {text}")
-                return True
+            existing = await asyncio.to_thread(
+                self.collection.get, where={"text_hash": {"$in": list(first_index)}}, include=["metadatas"])
+            stored.update(m.get("text_hash") for m in existing.get("metadatas") or [] if m)
+            if stored:
+                logger.debug(f"{len(stored)} memories already exist (hash match)")
         except Exception as e:
-            print(f"DEBUG: Error checking for duplicates: {e}")
+            logger.error(f"Error checking for duplicates: {e}")
+
+        new = [(text_hash, i) for text_hash, i in first_index.items() if text_hash not in stored]
+        if new:
+            embeddings = await provider.get_embeddings([texts[i] for _, i in new])
+            rows = [(text_hash, i, normalize_vector(embedding))
+                    for (text_hash, i), embedding in zip(new, embeddings) if embedding]
+            if len(rows) < len(new):
+                logger.warning(f"Failed to generate embedding for {len(new) - len(rows)} memories.")
 
-        # Add to ChromaDB
-        try:
-            print(f"DEBUG: Adding to ChromaDB collection: {self.collection.name}")
-            
             # Ensure metadata is not empty (ChromaDB requires non-empty dict if provided)
-            final_metadata = metadata or {}
-            if not final_metadata:
-                final_metadata = {"type": "memory"}
-            
-            # Add hash to metadata
-            final_metadata["text_hash"] = text_hash
-                
-            self.collection.add(
-                documents=[text],
-                embeddings=[embedding],
-                metadatas=[final_metadata],
-                ids=[str(uuid.uuid4())]
-            )
-            print(f"DEBUG: Memory added successfully: {text}")
-            print(f"DEBUG: Current collection count: {self.collection.count()}")
-            return True
-        except Exception as e:
-            print(f"DEBUG: Failed to add memory to ChromaDB: {e}")
-            return False
+            base_metadata = metadata or {"type": "memory"}
 
-    async def search_memory(self, query: str, provider: LLMProvider, limit: int = 3) -> List[str]:
+            def write():
+                with chroma_write_lock:
+                    self.collection.add(
+                        documents=[texts[i] for _, i, _ in rows],
+                        embeddings=[embedding for _, _, embedding in rows],
+                        metadatas=[{**base_metadata, "text_hash": text_hash} for text_hash, _, _ in rows],
+                        ids=[str(uuid.uuid4()) for _ in rows]
+                    )
+
+            if rows:
+                try:
+                    logger.debug(f"Adding {len(rows)} memories to ChromaDB collection: {self.collection.name}")
+                    await asyncio.to_thread(write)
+                    stored.update(text_hash for text_hash, _, _ in rows)
+                except Exception as e:
+                    logger.error(f"Failed to add memory to ChromaDB: {e}")
+
+        return [text_hash in stored for text_hash in hashes]
+
+    async def search_memory(self, query: str, provider: LLMProvider, limit: int = 3, embedding: List[float] = None) -> List[str]:
         """
-        Searches for relevant memories.
+        Searches for relevant memories. Pass `embedding` to reuse an already computed query vector.
         """
         if not query:
             return []
 
-        print(f"DEBUG: Searching memory for query: '{query}'")
+        logger.debug(f"Searching memory for query: '{query}'")
 
         # Generate embedding for query
-        embedding = await provider.get_embedding(query)
         if not embedding:
-            print("DEBUG: Failed to generate embedding for query.")
+            embedding = await provider.get_embedding(query)
+        if not embedding:
+            logger.warning("Failed to generate embedding for query.")
             return []
+        # Stored vectors are unit length, whichever provider embedded them
+        embedding = normalize_vector(embedding)
 
         # Query ChromaDB
         try:
-            results = self.collection.query(
+            # Chroma is synchronous; keep the event loop free while it searches
+            results = await asyncio.to_thread(
+                self.collection.query,
                 query_embeddings=[embedding],
                 n_results=limit
             )
-            print(f"DEBUG: ChromaDB results: {results}")
+            logger.debug("ChromaDB results: %s", results)
 
             if results and results['documents']:
                 return results['documents'][0]
         except Exception as e:
-            print(f"DEBUG: Error querying ChromaDB: {e}")
+            logger.error(f"Error querying ChromaDB: {e}")
         
         return []
 
@@ -106,5 +173,7 @@ class MemoryService:
         """
         Clears all memories.
         """
-        self.client.delete_collection("user_memories")
-        self.collection = self.client.get_or_create_collection(name="user_memories")
+        with chroma_write_lock:
+            self.client.delete_collection("user_memories")
+            self.collection = self.client.get_or_create_collection(name="user_memories",
+                                                                   metadata={NORMALIZED_MARKER: 1})
@@ -0,0 +1,84 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.core.db import count_session_messages_async, get_session_messages_async, get_session_summary_async
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class PreflightResult:
+    """Everything the agent gathers before the first provider call."""
+    memories: List[str] = field(default_factory=list)
+    knowledge: str = ""
+    history: List[Dict[str, Any]] = field(default_factory=list)
+    total_messages: int = 0
+    summary: Optional[Dict[str, Any]] = None
+    shared_embedding: bool = False
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+async def _timed(timings: Dict[str, float], name: str, coro, default):
+    started = time.perf_counter()
+    try:
+        return await coro
+    except Exception as e:
+        logger.error(f"Error during {name}: {e}")
+        return default
+    finally:
+        timings[name] = time.perf_counter() - started
+
+
+async def run_preflight(message: str, session_id: Optional[str], provider, memory_service=None,
+                        knowledge=None, history_limit: int = None) -> PreflightResult:
+    """
+    Fetch memories, knowledge-base context and session history concurrently.
+
+    `knowledge` is the RAG module (or anything with `retrieve_context(query,
+    embedding=None)` and `EMBEDDING_MODEL`). When the provider embeds with
+    the same model as the knowledge base, the query is embedded once and
+    the vector is used for both the memory and the knowledge collections.
+    """
+    result = PreflightResult()
+    timings = result.timings
+    started = time.perf_counter()
+
+    result.shared_embedding = (
+        memory_service is not None and knowledge is not None
+        and getattr(provider, "embedding_model", None) is not None
+        and getattr(provider, "embedding_model", None) == getattr(knowledge, "EMBEDDING_MODEL", None)
+    )
+
+    async def recall():
+        embedding = None
+        if result.shared_embedding:
+            embedding = await _timed(timings, "embedding", provider.get_embedding(message), None) or None
+
+        lookups = []
+        if memory_service is not None:
+            lookups.append(_timed(timings, "memories",
+                                  memory_service.search_memory(message, provider, embedding=embedding), []))
+        if knowledge is not None:
+            lookups.append(_timed(timings, "knowledge",
+                                  asyncio.to_thread(knowledge.retrieve_context, message, embedding=embedding), ""))
+        found = await asyncio.gather(*lookups)
+        if memory_service is not None:
+            result.memories = found.pop(0) or []
+        if knowledge is not None:
+            result.knowledge = found.pop(0) or ""
+
+    async def load_history():
+        if not session_id:
+            return
+        result.history, result.total_messages, result.summary = await asyncio.gather(
+            _timed(timings, "history", get_session_messages_async(session_id, limit=history_limit), []),
+            _timed(timings, "message_count", count_session_messages_async(session_id), 0),
+            _timed(timings, "summary", get_session_summary_async(session_id), None),
+        )
+
+    await asyncio.gather(recall(), load_history())
+    timings["total"] = time.perf_counter() - started
+    return result
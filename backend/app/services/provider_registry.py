@@ -0,0 +1,112 @@
+import asyncio
+import hashlib
+import json
+from typing import Callable, Dict, Any, Tuple
+from app.services.llm_provider import LLMProvider
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class ProviderRegistry:
+    """
+    Keeps one live, configured provider per provider name and reuses it
+    (together with its HTTP client) until the effective settings change.
+
+    Settings are identified by a fingerprint, a hash of the canonical JSON
+    of everything that goes into `configure`, so a request with unchanged
+    settings gets the existing instance without any setup work.
+
+    Callers that keep using a provider across awaits (a chat turn, a
+    background summary) hold it with `get(..., hold=True)` or `acquire`,
+    and `release` it when done. A
+    provider replaced by new settings is closed once its last holder
+    releases it, not while it is still streaming.
+    """
+
+    def __init__(self, factories: Dict[str, Callable[[], LLMProvider]]):
+        self.factories = factories
+        self._entries: Dict[str, Tuple[str, LLMProvider]] = {}
+        self._lock = asyncio.Lock()
+        # Holders per provider (by id), and replaced providers waiting for their holders
+        self._holders: Dict[int, int] = {}
+        self._retired: Dict[int, LLMProvider] = {}
+        self.hits = 0
+        self.builds = 0
+
+    @staticmethod
+    def fingerprint(provider_name: str, settings: Dict[str, Any]) -> str:
+        canonical = json.dumps([provider_name, settings], sort_keys=True, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    async def get(self, provider_name: str, settings: Dict[str, Any], hold: bool = False) -> LLMProvider:
+        """
+        Return a provider configured with `settings`, building one only if they
+        changed. With hold=True it is acquired before anything can retire it,
+        and the caller must `release` it.
+        """
+        fingerprint = self.fingerprint(provider_name, settings)
+        entry = self._entries.get(provider_name)
+        if entry is not None and entry[0] == fingerprint:
+            self.hits += 1
+            return self.acquire(entry[1]) if hold else entry[1]
+
+        # One rebuild at a time; a caller that waited here usually finds it done
+        async with self._lock:
+            entry = self._entries.get(provider_name)
+            if entry is not None and entry[0] == fingerprint:
+                self.hits += 1
+                return self.acquire(entry[1]) if hold else entry[1]
+
+            provider = self.factories[provider_name]()
+            await provider.configure(settings)
+            self._entries[provider_name] = (fingerprint, provider)
+            self.builds += 1
+            if hold:
+                self.acquire(provider)
+
+        if entry is not None:
+            await self._retire(entry[1])
+        return provider
+
+    def acquire(self, provider: LLMProvider) -> LLMProvider:
+        """Keep `provider` open until the matching `release`, even if settings change meanwhile."""
+        self._holders[id(provider)] = self._holders.get(id(provider), 0) + 1
+        return provider
+
+    async def release(self, provider: LLMProvider):
+        remaining = self._holders.get(id(provider), 0) - 1
+        if remaining > 0:
+            self._holders[id(provider)] = remaining
+            return
+        self._holders.pop(id(provider), None)
+        if self._retired.pop(id(provider), None) is not None:
+            await self._close(provider)
+
+    async def _retire(self, provider: LLMProvider):
+        if self._holders.get(id(provider)):
+            self._retired[id(provider)] = provider
+        else:
+            await self._close(provider)
+
+    @staticmethod
+    async def _close(provider: LLMProvider):
+        try:
+            await provider.aclose()
+        except Exception as e:
+            logger.error(f"Error closing {type(provider).__name__}: {e}")
+
+    async def aclose(self):
+        """Close every cached provider (e.g. on shutdown)."""
+        entries, self._entries = self._entries, {}
+        retired, self._retired = self._retired, {}
+        for provider in [provider for _, provider in entries.values()] + list(retired.values()):
+            await self._close(provider)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "builds": self.builds,
+            "providers": sorted(self._entries),
+            "retiring": len(self._retired),
+        }
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import chromadb
 from chromadb.utils import embedding_functions
@@ -5,6 +6,12 @@ from google import genai
 from pypdf import PdfReader
 from docx import Document
 from dotenv import load_dotenv
+from app.services.backup import chroma_write_lock
+from app.services.embedding_batch import embed_in_batches, split_batches
+from app.core.embedding_cache import get_embedding_cache
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
 
 load_dotenv()
 
@@ -16,30 +23,46 @@ chroma_client = chromadb.PersistentClient(path="./chroma_db")
 google_api_key = os.getenv("GEMINI_API_KEY")
 gemini_client = None
 if not google_api_key:
-    print("Warning: GEMINI_API_KEY not found. RAG will not work.")
+    logger.warning("GEMINI_API_KEY not found. RAG will not work.")
 else:
     gemini_client = genai.Client(api_key=google_api_key)
 
+# Embedding model of the knowledge collection; a provider embedding with the
+# same model can share its query vector (see app.services.preflight)
+EMBEDDING_MODEL = "gemini-embedding-2"
+# Texts per embedding request (the API limit)
+EMBEDDING_BATCH_SIZE = 100
+CHUNK_SIZE = 1000
+
 # Custom embedding function using Gemini
 class GeminiEmbeddingFunction(chromadb.EmbeddingFunction):
     def __call__(self, input: list[str]) -> list[list[float]]:
         if not gemini_client:
-            print("Warning: gemini_client is None.")
-            return [[0.0] * 768 for _ in input]
-            
-        try:
-            # We use the recommended standard embedding model
-            result = gemini_client.models.embed_content(
-                model="gemini-embedding-2", 
-                contents=input
-            )
-            # result.embeddings is a list of EmbedContentResponse objects
-            # each object has a 'values' attribute which is the float array
-            return [e.values for e in result.embeddings]
-        except Exception as e:
-            print(f"Error during embedding generation: {e}")
+            logger.warning("gemini_client is None.")
             return [[0.0] * 768 for _ in input]
 
+        # Same cache key as GeminiProvider, so a message it embedded isn't embedded again here
+        embeddings = get_embedding_cache().embed("gemini", EMBEDDING_MODEL, list(input), self._embed)
+        return [e if e else [0.0] * 768 for e in embeddings]
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        """Uncached texts, in batches the API accepts; [] for failures (kept out of the cache)."""
+        embeddings = []
+        for batch in split_batches(texts, EMBEDDING_BATCH_SIZE):
+            try:
+                # We use the recommended standard embedding model
+                result = gemini_client.models.embed_content(
+                    model=EMBEDDING_MODEL, 
+                    contents=batch
+                )
+                # result.embeddings is a list of EmbedContentResponse objects
+                # each object has a 'values' attribute which is the float array
+                embeddings.extend(e.values for e in result.embeddings)
+            except Exception as e:
+                logger.error(f"Error during embedding generation: {e}")
+                embeddings.extend([] for _ in batch)
+        return embeddings
+
 # Create or get collection
 # We use a custom embedding function to ensure compatibility with Gemini
 embedding_fn = GeminiEmbeddingFunction()
@@ -48,8 +71,21 @@ collection = chroma_client.get_or_create_collection(
     embedding_function=embedding_fn
 )
 
-def ingest_document(file_path: str, filename: str):
-    """Reads a file, chunks it, and stores it in ChromaDB."""
+async def embed_documents_async(texts: list[str]) -> list[list[float]]:
+    """Embeddings for knowledge-base chunks, in order, via batched async requests ([] for failures)."""
+    if not gemini_client:
+        logger.warning("gemini_client is None.")
+        return [[] for _ in texts]
+
+    async def embed_batch(batch: list[str]) -> list[list[float]]:
+        result = await gemini_client.aio.models.embed_content(model=EMBEDDING_MODEL, contents=batch)
+        return [e.values for e in result.embeddings]
+
+    return await get_embedding_cache().aembed(
+        "gemini", EMBEDDING_MODEL, texts, lambda missing: embed_in_batches(embed_batch, missing, EMBEDDING_BATCH_SIZE))
+
+def _read_document(file_path: str, filename: str):
+    """The text of a supported file, or None."""
     text = ""
     if filename.endswith(".pdf"):
         reader = PdfReader(file_path)
@@ -63,28 +99,61 @@ def ingest_document(file_path: str, filename: str):
         with open(file_path, "r", encoding="utf-8") as f:
             text = f.read()
     else:
-        return "Unsupported file format."
+        return None
+    return text
 
+def _chunk(text: str) -> list[str]:
     # Simple chunking (can be improved)
-    chunk_size = 1000
-    chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
-    
+    return [text[i:i+CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE)]
+
+def _add_chunks(filename: str, chunks: list[str], embeddings: list[list[float]] = None):
     ids = [f"{filename}_{i}" for i in range(len(chunks))]
     metadatas = [{"source": filename, "chunk_id": i} for i in range(len(chunks))]
 
-    collection.add(
-        documents=chunks,
-        ids=ids,
-        metadatas=metadatas
-    )
+    with chroma_write_lock:
+        collection.add(
+            documents=chunks,
+            embeddings=embeddings,
+            ids=ids,
+            metadatas=metadatas
+        )
+
+def ingest_document(file_path: str, filename: str):
+    """Reads a file, chunks it, and stores it in ChromaDB."""
+    text = _read_document(file_path, filename)
+    if text is None:
+        return "Unsupported file format."
+
+    chunks = _chunk(text)
+    _add_chunks(filename, chunks)
     return f"Successfully ingested {filename} with {len(chunks)} chunks."
 
-def retrieve_context(query: str, n_results: int = 3) -> str:
-    """Searches the vector DB for relevant context."""
-    results = collection.query(
-        query_texts=[query],
-        n_results=n_results
-    )
+async def ingest_document_async(file_path: str, filename: str):
+    """
+    Like ingest_document, without blocking the event loop: the chunks are
+    embedded with concurrent batched requests, parsing and writing run in a thread.
+    """
+    text = await asyncio.to_thread(_read_document, file_path, filename)
+    if text is None:
+        return "Unsupported file format."
+
+    chunks = _chunk(text)
+    embeddings = await embed_documents_async(chunks)
+    failed = sum(1 for embedding in embeddings if not embedding)
+    if failed:
+        return f"Error ingesting {filename}: could not embed {failed} of {len(chunks)} chunks."
+    await asyncio.to_thread(_add_chunks, filename, chunks, embeddings)
+    return f"Successfully ingested {filename} with {len(chunks)} chunks."
+
+def retrieve_context(query: str, n_results: int = 3, embedding: list[float] = None) -> str:
+    """Searches the vector DB for relevant context. Pass `embedding` to reuse an existing query vector."""
+    if embedding:
+        results = collection.query(query_embeddings=[embedding], n_results=n_results)
+    else:
+        results = collection.query(
+            query_texts=[query],
+            n_results=n_results
+        )
     
     if not results["documents"]:
         return ""
@@ -96,25 +165,27 @@ def retrieve_context(query: str, n_results: int = 3) -> str:
 def clear_knowledge_base():
     """Clears all uploaded documents from the vector store."""
     try:
-        chroma_client.delete_collection("jarvis_knowledge")
-        # Re-create it immediately
         global collection
-        collection = chroma_client.get_or_create_collection(
-            name="jarvis_knowledge",
-            embedding_function=embedding_fn
-        )
+        with chroma_write_lock:
+            chroma_client.delete_collection("jarvis_knowledge")
+            # Re-create it immediately
+            collection = chroma_client.get_or_create_collection(
+                name="jarvis_knowledge",
+                embedding_function=embedding_fn
+            )
         return True
     except Exception as e:
-        print(f"Error clearing knowledge base: {e}")
+        logger.error(f"Error clearing knowledge base: {e}")
         return False
 
 def remove_document(filename: str) -> str:
     """Removes all chunks associated with a specific filename."""
     try:
         # Delete using metadata filter
-        collection.delete(
-            where={"source": filename}
-        )
+        with chroma_write_lock:
+            collection.delete(
+                where={"source": filename}
+            )
         return f"Successfully removed all memories related to {filename}."
     except Exception as e:
         return f"Error removing document: {e}"
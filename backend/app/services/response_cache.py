@@ -0,0 +1,163 @@
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Opt-in via settings["semantic_cache"]; answers depend on the model, so it is off by default
+SEMANTIC_CACHE_DEFAULTS = {
+    "enabled": False,
+    # Cosine similarity a new message needs to reuse a cached answer
+    "threshold": 0.95,
+    "ttl_seconds": 24 * 60 * 60,
+    "max_entries": 256,
+}
+
+REPLAY_CHUNK_CHARS = 48
+
+
+def normalize_message(text: str) -> str:
+    """Lower-cased message with collapsed whitespace and no trailing punctuation."""
+    return re.sub(r"[\s?!.]+$", "", " ".join(text.lower().split()))
+
+
+def context_fingerprint(parts: Iterable[str]) -> str:
+    """Stable hash of everything besides the message that shapes the answer."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def replay_chunks(text: str, size: int = REPLAY_CHUNK_CHARS) -> Iterator[str]:
+    """Split a cached answer into stream-sized chunks, breaking after whitespace where possible."""
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            space = text.rfind(" ", start, end)
+            if space > start:
+                end = space + 1
+        yield text[start:end]
+        start = end
+
+
+def _unit(vector: List[float]) -> Optional[Tuple[float, ...]]:
+    norm = math.sqrt(sum(x * x for x in vector))
+    if not norm:
+        return None
+    return tuple(x / norm for x in vector)
+
+
+class SemanticResponseCache:
+    """
+    Answers to earlier messages, reused when a new message is close enough.
+
+    Entries are grouped by scope (provider, model, context fingerprint), so an
+    answer is only reused under the same persona, memories and documents. A
+    message matches the most similar entry of its scope whose cosine similarity
+    reaches `threshold`. Vectors are stored unit-length, so similarity is a dot
+    product over at most `max_entries` candidates.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_DEFAULTS["threshold"],
+                 ttl_seconds: float = SEMANTIC_CACHE_DEFAULTS["ttl_seconds"],
+                 max_entries: int = SEMANTIC_CACHE_DEFAULTS["max_entries"], enabled: bool = False):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # key -> (scope, unit embedding, response, expires_at, generation seconds)
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+        self.skipped = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+        self.lookup_seconds = 0.0
+
+    def configure(self, config: Optional[Dict[str, Any]]):
+        """Apply settings["semantic_cache"]; missing keys keep their defaults."""
+        config = {**SEMANTIC_CACHE_DEFAULTS, **(config or {})}
+        with self._lock:
+            self.enabled = bool(config["enabled"])
+            self.threshold = float(config["threshold"])
+            self.ttl_seconds = float(config["ttl_seconds"])
+            self.max_entries = int(config["max_entries"])
+            self._trim()
+
+    def lookup(self, embedding: List[float], scope: tuple, lookup_seconds: float = 0.0) -> Optional[str]:
+        """The cached answer for the closest message in `scope`, or None."""
+        started = time.perf_counter()
+        vector = _unit(embedding) if embedding else None
+        now = time.monotonic()
+        with self._lock:
+            self.lookups += 1
+            best_key, best_score = None, self.threshold
+            for key, entry in list(self._entries.items()):
+                if entry[3] <= now:
+                    del self._entries[key]
+                    continue
+                if vector is None or entry[0] != scope or len(entry[1]) != len(vector):
+                    continue
+                score = sum(a * b for a, b in zip(vector, entry[1]))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            lookup_seconds += time.perf_counter() - started
+            self.lookup_seconds += lookup_seconds
+            if best_key is None:
+                return None
+            entry = self._entries[best_key]
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            self.saved_seconds += max(entry[4] - lookup_seconds, 0.0)
+            return entry[2]
+
+    def store(self, embedding: List[float], scope: tuple, response: str, generation_seconds: float):
+        """Remember the answer to a message that was answered without tools."""
+        vector = _unit(embedding) if embedding else None
+        if vector is None or not response.strip():
+            return
+        with self._lock:
+            self._entries[self._next_key] = (scope, vector, response,
+                                             time.monotonic() + self.ttl_seconds, generation_seconds)
+            self._next_key += 1
+            self.stores += 1
+            self._trim()
+
+    def skip(self):
+        """Count a turn that wasn't cached (it called tools or needed a retry)."""
+        with self._lock:
+            self.skipped += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "stores": self.stores,
+                "skipped": self.skipped,
+                "evictions": self.evictions,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "avg_lookup_ms": round(self.lookup_seconds / self.lookups * 1000, 2) if self.lookups else 0.0,
+            }
+
+    # Callers hold self._lock
+
+    def _trim(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
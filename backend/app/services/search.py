@@ -1,6 +1,15 @@
 from duckduckgo_search import DDGS
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class SearchError(Exception):
+    """The search backend failed (network error, rate limit, ...)."""
+
 
 def search_web(query: str, max_results: int = 3) -> str:
+    """Formatted top results for `query`. Raises SearchError when the search fails."""
     try:
         with DDGS() as ddgs:
             results = list(ddgs.text(query, max_results=max_results))
@@ -13,8 +22,8 @@ def search_web(query: str, max_results: int = 3) -> str:
             
             return "\n\n".join(formatted_results)
     except Exception as e:
-        print(f"Search error: {e}")
-        return f"Error performing search: {str(e)}"
+        logger.error(f"Search error: {e}")
+        raise SearchError(str(e)) from e
 
 def get_first_youtube_video(query: str) -> str:
     """
@@ -28,5 +37,5 @@ def get_first_youtube_video(query: str) -> str:
                 return results[0]['content'] # 'content' is the URL in DDGS video results
             return None
     except Exception as e:
-        print(f"YouTube search error: {e}")
+        logger.error(f"YouTube search error: {e}")
         return None
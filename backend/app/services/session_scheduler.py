@@ -0,0 +1,116 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict
+
+# Turns that may wait behind the running one in the same session; further ones are rejected
+SESSION_QUEUE_LIMIT = 1
+# How long a queued turn waits before giving up
+SESSION_QUEUE_TIMEOUT = 60.0
+# How often a streaming response checks whether the client is still there
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class SessionBusyError(Exception):
+    """The session already has a turn running and no room to queue another."""
+
+
+class _SessionSlot:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+
+
+class SessionScheduler:
+    """
+    Runs the chat turns of one session one at a time.
+
+    Turns of different sessions are independent. A turn that arrives while
+    its session is busy waits its turn, up to `queue_limit` waiting turns
+    and `queue_timeout` seconds; past that it gets SessionBusyError. This
+    keeps two turns from interleaving their history reads and writes.
+    """
+
+    def __init__(self, queue_limit: int = SESSION_QUEUE_LIMIT, queue_timeout: float = SESSION_QUEUE_TIMEOUT):
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self._slots: Dict[str, _SessionSlot] = {}
+        self.turns = 0
+        self.queued = 0
+        self.rejected = 0
+        self.disconnects = 0
+
+    def has_room(self, session_id: str) -> bool:
+        """Whether a new turn would run or queue (rather than be rejected) right now."""
+        slot = self._slots.get(session_id)
+        return slot is None or not self._busy(slot) or slot.waiting < self.queue_limit
+
+    @staticmethod
+    def _busy(slot: _SessionSlot) -> bool:
+        return slot.lock.locked() or slot.waiting > 0
+
+    @asynccontextmanager
+    async def turn(self, session_id: str):
+        slot = self._slots.setdefault(session_id, _SessionSlot())
+        if self._busy(slot):
+            if slot.waiting >= self.queue_limit:
+                self.rejected += 1
+                raise SessionBusyError("A response is already being generated for this session.")
+            self.queued += 1
+            slot.waiting += 1
+            try:
+                await asyncio.wait_for(slot.lock.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise SessionBusyError("Timed out waiting for the previous response in this session.")
+            finally:
+                slot.waiting -= 1
+        else:
+            # Free: acquired without suspending
+            await slot.lock.acquire()
+        self.turns += 1
+        try:
+            yield
+        finally:
+            slot.lock.release()
+            if not slot.lock.locked() and not slot.waiting:
+                self._slots.pop(session_id, None)
+
+    async def stream_until_disconnect(self, chunks: AsyncIterator[Any], is_disconnected: Callable[[], Awaitable[bool]],
+                                      poll_interval: float = DISCONNECT_POLL_SECONDS) -> AsyncIterator[Any]:
+        """
+        Yield from `chunks` while the client is connected.
+
+        When `is_disconnected()` turns true, the pending step of `chunks` is
+        cancelled (reaching the provider stream or the running tools) and the
+        generator is closed.
+        """
+        pending = None
+        try:
+            while True:
+                pending = asyncio.ensure_future(chunks.__anext__())
+                while not pending.done():
+                    await asyncio.wait({pending}, timeout=poll_interval)
+                    if not pending.done() and await is_disconnected():
+                        self.disconnects += 1
+                        return
+                try:
+                    chunk = pending.result()
+                except StopAsyncIteration:
+                    return
+                pending = None
+                yield chunk
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
+                await asyncio.gather(pending, return_exceptions=True)
+            await chunks.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_sessions": sum(1 for slot in self._slots.values() if slot.lock.locked()),
+            "waiting_turns": sum(slot.waiting for slot in self._slots.values()),
+            "turns": self.turns,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "disconnects": self.disconnects,
+        }
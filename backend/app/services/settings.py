@@ -1,6 +1,9 @@
 import json
 import os
 from typing import Dict, Any
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
 
 SETTINGS_FILE = "user_settings.json"
 
@@ -17,7 +20,10 @@ DEFAULT_SETTINGS = {
         },
         "ollama": {
             "base_url": "http://localhost:11434", 
-            "model": "llama3"
+            "model": "llama3",
+            "num_ctx": 4096,
+            "connect_timeout": 5,
+            "read_timeout": 300
         }
     },
     "active_persona_id": "default",
@@ -43,6 +49,13 @@ DEFAULT_SETTINGS = {
     ],
     "theme": "dark",
     "voice": "default",
+    # Reuse answers to near-identical messages (see app/services/response_cache.py)
+    "semantic_cache": {
+        "enabled": False,
+        "threshold": 0.95,
+        "ttl_seconds": 86400,
+        "max_entries": 256
+    },
     "user_profile": {
         "name": "User",
         "about_me": ""
@@ -94,7 +107,7 @@ class SettingsService:
             # if limits are reached (e.g., switching to gemini-2.0-flash or pro)
             pass
         except Exception as e:
-            print(f"Error sanitizing settings: {e}")
+            logger.error(f"Error sanitizing settings: {e}")
 
         with open(self.settings_file, "w") as f:
             json.dump(current, f, indent=4)
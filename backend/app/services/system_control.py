@@ -4,6 +4,9 @@ import platform
 from ctypes import cast, POINTER
 from comtypes import CLSCTX_ALL
 from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
 
 class SystemControlService:
     def __init__(self):
@@ -31,7 +34,7 @@ class SystemControlService:
             else:
                 return "Volume control only supported on Windows for now."
         except Exception as e:
-            print(f"Error setting volume: {e}")
+            logger.error(f"Error setting volume: {e}")
             return f"Error setting volume: {str(e)}"
 
     def set_mute(self, mute: bool):
@@ -48,7 +51,7 @@ class SystemControlService:
             else:
                 return "Mute control only supported on Windows for now."
         except Exception as e:
-            print(f"Error setting mute: {e}")
+            logger.error(f"Error setting mute: {e}")
             return f"Error setting mute: {str(e)}"
 
     def open_application(self, app_name: str):
@@ -105,11 +108,11 @@ class SystemControlService:
                 pyautogui.press('enter')
                 return f"Attempting to open {app_name} via Start Menu"
             except Exception as e2:
-                print(f"Error opening app: {e2}")
+                logger.error(f"Error opening app: {e2}")
                 return f"Error opening app: {str(e2)}"
 
         except Exception as e:
-            print(f"Error taking screenshot: {e}")
+            logger.error(f"Error taking screenshot: {e}")
             return None
 
     def media_control(self, action: str):
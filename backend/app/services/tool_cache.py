@@ -0,0 +1,227 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+TOOL_CACHE_PATH = "tool_cache.db"
+TOOL_CACHE_MAX_ENTRIES = 512
+
+# String arguments compared case-insensitively (search queries, not URLs or paths)
+CASE_INSENSITIVE_ARGS = {"query"}
+
+
+def normalize_args(args: Dict[str, Any]) -> Dict[str, Any]:
+    """Arguments with surrounding/repeated whitespace removed, so equivalent calls share an entry."""
+    normalized = {}
+    for name, value in args.items():
+        if isinstance(value, str):
+            value = " ".join(value.split())
+            if name in CASE_INSENSITIVE_ARGS:
+                value = value.lower()
+        normalized[name] = value
+    return normalized
+
+
+def cache_key(tool_name: str, args: Dict[str, Any]) -> str:
+    return tool_name + ":" + json.dumps(normalize_args(args), sort_keys=True, ensure_ascii=False, default=str)
+
+
+class ToolResultCache:
+    """
+    TTL cache for results of idempotent tools, shared by every chat.
+
+    Entries live in a size-bounded in-memory LRU and, when `path` is set,
+    in a small SQLite file so they survive restarts. Identical calls that
+    arrive while one is already running wait for that single flight instead
+    of hitting the network again. Thread-safe: blocking tools call it from
+    the tool thread pool. The LRU and the SQLite connection have separate
+    locks, so memory hits never wait on disk I/O.
+    """
+
+    def __init__(self, max_entries: int = TOOL_CACHE_MAX_ENTRIES, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.path = path
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.tool_hits: Dict[str, int] = {}
+        # Bumped by invalidate(), so a flight that started before it doesn't store a stale result
+        self._generation = 0
+        if path:
+            self._open_store()
+
+    def _open_store(self):
+        try:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('''
+                CREATE TABLE IF NOT EXISTS tool_results (
+                    key TEXT PRIMARY KEY,
+                    tool TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            self._db.execute('DELETE FROM tool_results WHERE expires_at <= ?', (time.time(),))
+            self._db.commit()
+        except Exception as e:
+            logger.warning(f"Tool cache persistence disabled: {e}")
+            self._db = None
+
+    def get_or_compute(self, tool_name: str, args: Dict[str, Any], ttl: float, compute: Callable[[], Any],
+                       should_cache: Callable[[Any], bool] = None) -> Any:
+        """
+        Return the cached value for (tool_name, args), or run `compute` once
+        and cache its result for `ttl` seconds. Values must be JSON-serializable
+        to be persisted. `should_cache` can veto caching (e.g. error results).
+        """
+        key = cache_key(tool_name, args)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._count_hit(tool_name)
+                return entry[1]
+
+            flight = self._inflight.get(key)
+            if flight is None:
+                flight = Future()
+                self._inflight[key] = flight
+                generation = self._generation
+                owner = True
+            else:
+                owner = False
+                self.coalesced += 1
+
+        if not owner:
+            return flight.result()
+
+        # Identical calls wait on the flight while its owner checks the disk
+        stored = self._load(key, now)
+        with self._lock:
+            if stored is not None and generation == self._generation:
+                self._inflight.pop(key, None)
+                self._remember(key, stored)
+                self._count_hit(tool_name)
+                self.disk_hits += 1
+            else:
+                stored = None
+                self.misses += 1
+        if stored is not None:
+            flight.set_result(stored[1])
+            return stored[1]
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.set_exception(e)
+            raise
+
+        entry = None
+        with self._lock:
+            self._inflight.pop(key, None)
+            if generation == self._generation and (should_cache is None or should_cache(value)):
+                entry = (time.time() + ttl, value)
+                self._remember(key, entry)
+        flight.set_result(value)
+        if entry is not None:
+            self._store(key, tool_name, entry, generation)
+        return value
+
+    def invalidate(self, tool_name: str = None):
+        """Drop all entries of one tool (or everything), e.g. after the knowledge base changed."""
+        prefix = f"{tool_name}:" if tool_name else ""
+        with self._lock:
+            self._generation += 1
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+        with self._db_lock:
+            if self._db is None:
+                return
+            try:
+                if tool_name:
+                    self._db.execute('DELETE FROM tool_results WHERE tool = ?', (tool_name,))
+                else:
+                    self._db.execute('DELETE FROM tool_results')
+                self._db.commit()
+            except Exception as e:
+                logger.error(f"Error invalidating tool cache: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                # Coalesced waiters were served without a call of their own too
+                "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+                "tool_hits": dict(self.tool_hits),
+                "persistent": self._db is not None,
+            }
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # Callers hold self._lock for these two
+
+    def _count_hit(self, tool_name: str):
+        self.hits += 1
+        self.tool_hits[tool_name] = self.tool_hits.get(tool_name, 0) + 1
+
+    def _remember(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load(self, key: str, now: float) -> Optional[tuple]:
+        with self._db_lock:
+            if self._db is None:
+                return None
+            try:
+                row = self._db.execute('SELECT value, expires_at FROM tool_results WHERE key = ? AND expires_at > ?',
+                                       (key, now)).fetchone()
+                return (row[1], json.loads(row[0])) if row else None
+            except Exception as e:
+                logger.error(f"Error reading tool cache: {e}")
+                return None
+
+    def _store(self, key: str, tool_name: str, entry: tuple, generation: int):
+        with self._db_lock:
+            # An invalidate() since the flight started bumped the generation; its DELETE waits for this lock
+            if self._db is None or generation != self._generation:
+                return
+            try:
+                self._db.execute('INSERT OR REPLACE INTO tool_results (key, tool, value, expires_at) VALUES (?, ?, ?, ?)',
+                                 (key, tool_name, json.dumps(entry[1]), entry[0]))
+                self._db.commit()
+            except (TypeError, ValueError):
+                pass  # Not JSON-serializable; kept in memory only
+            except Exception as e:
+                logger.error(f"Error writing tool cache: {e}")
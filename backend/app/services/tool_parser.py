@@ -0,0 +1,175 @@
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+# Characters that open a candidate / matter inside one / matter inside a JSON string
+_OPENERS = re.compile(r'[{\[]')
+_OBJECT_TOKENS = re.compile(r'[{}\[\]"]')
+_STRING_TOKENS = re.compile(r'["\\]')
+_DECODER = json.JSONDecoder()
+# Values nested deeper than this are never tool calls; not decoding them keeps the work linear
+MAX_NESTING = 32
+
+
+@dataclass
+class ToolCall:
+    """
+    A tool command found in the model's output, with its [start, end) offsets
+    in the turn's text. A JSON array of commands is a single ToolCall whose
+    `commands` holds all of them; `command` is always the first.
+    """
+    command: Dict[str, Any]
+    start: int
+    end: int
+    commands: List[Dict[str, Any]] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.commands:
+            self.commands = [self.command]
+
+
+class ToolCallParser:
+    """
+    Incremental extractor of {"tool": ...} JSON objects (or arrays of them)
+    from streamed model output.
+
+    Chunks are fed as they arrive; the parser keeps a stack of open brackets
+    while skipping over JSON strings (and escapes inside them), so braces in
+    string values don't confuse it. When the outermost bracket closes, the
+    brackets it contained are checked in one forward pass: a value nested in
+    an invalid outer one (e.g. a call inside prose in braces) is still found,
+    without ever rescanning the text. Text outside candidates (the model's
+    prose) is skipped with a regex search rather than scanned character by
+    character.
+    """
+
+    def __init__(self, offset: int = 0):
+        self.position = offset
+        self._in_string = False
+        self._escape = False
+        self._start: Optional[int] = None
+        self._candidate: List[str] = []
+        # [offset, nesting inside] of the brackets still open, and the (start, end, nesting) spans closed so far
+        self._open: List[List[int]] = []
+        self._closed: List[Tuple[int, int, int]] = []
+        self.calls: List[ToolCall] = []
+
+    def feed(self, chunk: str) -> List[ToolCall]:
+        """Consume the next chunk of text and return any tool calls completed by it."""
+        found = []
+        base = self.position
+        i = 0
+        n = len(chunk)
+
+        while i < n:
+            if not self._open:
+                match = _OPENERS.search(chunk, i)
+                if match is None:
+                    break
+                i = match.start()
+                self._start = base + i
+                self._candidate = []
+                self._open.append([base + i, 0])
+                segment_start = i
+                i += 1
+            else:
+                # Continuing an object left open by the previous chunk
+                segment_start = i
+
+            # Walk the significant characters of the current object
+            while i < n and self._open:
+                if self._in_string:
+                    if self._escape:
+                        self._escape = False
+                        i += 1
+                        continue
+                    match = _STRING_TOKENS.search(chunk, i)
+                    if match is None:
+                        i = n
+                        break
+                    i = match.end()
+                    if match.group() == "\\":
+                        self._escape = True
+                    else:
+                        self._in_string = False
+                    continue
+
+                match = _OBJECT_TOKENS.search(chunk, i)
+                if match is None:
+                    i = n
+                    break
+                i = match.end()
+                token = match.group()
+                if token == '"':
+                    self._in_string = True
+                elif token in "{[":
+                    self._open.append([base + i - 1, 0])
+                else:
+                    start, nesting = self._open.pop()
+                    self._closed.append((start, base + i, nesting))
+                    if self._open and self._open[-1][1] <= nesting:
+                        self._open[-1][1] = nesting + 1
+
+            self._candidate.append(chunk[segment_start:i])
+            if not self._open:
+                found.extend(self._complete())
+
+        self.position = base + n
+        self.calls.extend(found)
+        return found
+
+    def finish(self) -> List[ToolCall]:
+        """
+        Signal the end of the stream. If an object is still open (e.g. a stray
+        brace in prose), the values closed after it are checked so a tool call
+        inside isn't lost.
+        """
+        if self._start is None:
+            return []
+        found = self._complete()
+        self.calls.extend(found)
+        return found
+
+    def _complete(self) -> List[ToolCall]:
+        text = "".join(self._candidate)
+        offset = self._start
+        spans = self._closed
+        self._reset_object()
+
+        found = []
+        # Sorted by start, the spans are in document order with every value before the ones inside it
+        skip_until = offset
+        for start, end, nesting in sorted(spans):
+            if start < skip_until or nesting > MAX_NESTING:
+                continue
+            try:
+                parsed, stop = _DECODER.raw_decode(text, start - offset)
+            except (json.JSONDecodeError, RecursionError):
+                # Not valid JSON as a whole (e.g. prose in braces); a tool call may be nested inside
+                continue
+            if stop != end - offset:
+                continue
+            skip_until = end
+            if isinstance(parsed, dict) and "tool" in parsed:
+                found.append(ToolCall(parsed, start, end))
+            elif isinstance(parsed, list):
+                commands = [item for item in parsed if isinstance(item, dict) and "tool" in item]
+                if commands:
+                    found.append(ToolCall(commands[0], start, end, commands))
+        return found
+
+    def _reset_object(self):
+        self._in_string = False
+        self._escape = False
+        self._start = None
+        self._candidate = []
+        self._open = []
+        self._closed = []
+
+
+def extract_tool_call(text: str) -> Optional[ToolCall]:
+    """Return the first tool call in a complete piece of text, if any."""
+    parser = ToolCallParser()
+    calls = parser.feed(text) + parser.finish()
+    return calls[0] if calls else None
@@ -0,0 +1,478 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from app.core.db import search_messages_async
+from app.services.tool_cache import ToolResultCache
+from app.core.logger import get_logger
+from app.core.tracing import TurnTrace, traced
+
+logger = get_logger(__name__)
+
+# Blocking tools (HTTP, pyautogui, the Jupyter kernel, Chroma) run here, never on the event loop
+TOOL_WORKERS = 8
+DEFAULT_TOOL_TIMEOUT = 30.0
+
+# How long the video found for a query is reused (the video is still opened every time)
+YOUTUBE_LOOKUP_TTL = 6 * 3600
+
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+
+@dataclass
+class ToolContext:
+    """What a tool handler may use besides its arguments."""
+    agent: Any
+    session_id: Optional[str] = None
+    # The provider the turn holds; agent.provider may have been replaced since
+    provider: Any = None
+    memories: List[str] = field(default_factory=list)
+    cache: Optional[ToolResultCache] = None
+    trace: Optional[TurnTrace] = None
+
+
+@dataclass
+class ToolResult:
+    """Tool output for the model, plus extra text to show the user after it ran."""
+    output: str
+    display: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Tool:
+    """
+    A tool the model can call.
+
+    `handler(ctx, args)` returns the output string or a ToolResult. Blocking
+    handlers are plain functions run on the tool thread pool; the others are
+    coroutines awaited on the event loop. `announce(ctx, args)` returns the
+    progress text shown before the tool runs (or None).
+
+    `resource` names something the tool can't share with a concurrent call
+    (the GUI, the Python kernel); calls on the same resource run one at a
+    time. It may be a function of the arguments.
+
+    Idempotent blocking tools set `cache_ttl` so results are reused across
+    turns and sessions; `invalidates` lists tools whose cached results a
+    successful call makes stale.
+
+    A worker thread can't be stopped, so blocking tools that can be
+    interrupted set `on_cancel(ctx, args)`; it is called when the call times
+    out or the turn is cancelled (e.g. the client disconnected).
+    """
+    name: str
+    handler: Callable
+    blocking: bool = True
+    timeout: float = DEFAULT_TOOL_TIMEOUT
+    required: Tuple[str, ...] = ()
+    announce: Optional[Callable[[ToolContext, Dict[str, Any]], Optional[str]]] = None
+    resource: Union[None, str, Callable[[Dict[str, Any]], Optional[str]]] = None
+    cache_ttl: Optional[float] = None
+    invalidates: Tuple[str, ...] = ()
+    on_cancel: Optional[Callable[[ToolContext, Dict[str, Any]], None]] = None
+
+    def resource_for(self, args: Dict[str, Any]) -> Optional[str]:
+        return self.resource(args) if callable(self.resource) else self.resource
+
+
+class ToolRegistry:
+    def __init__(self, tools: List[Tool] = None, executor: ThreadPoolExecutor = None, cache: ToolResultCache = None):
+        self._tools: Dict[str, Tool] = {}
+        self.executor = executor or _tool_executor
+        self.cache = cache
+        self._resource_locks: Dict[str, asyncio.Lock] = {}
+        for tool in tools or []:
+            self.register(tool)
+
+    def register(self, tool: Tool):
+        self._tools[tool.name] = tool
+
+    def get(self, name: str) -> Optional[Tool]:
+        return self._tools.get(name)
+
+    def names(self) -> List[str]:
+        return list(self._tools)
+
+    def invalidate(self, tool_name: str):
+        """Forget cached results of a tool."""
+        if self.cache is not None:
+            self.cache.invalidate(tool_name)
+
+    async def invalidate_async(self, tool_name: str):
+        """`invalidate` for the event loop; deleting the persisted rows runs in the tool pool."""
+        if self.cache is not None:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.cache.invalidate, tool_name)
+
+    async def run(self, tool: Tool, args: Dict[str, Any], ctx: ToolContext) -> ToolResult:
+        """Validate the arguments and run the tool within its timeout. Errors come back as output."""
+        resource = tool.resource_for(args)
+        if resource is None:
+            with traced(ctx.trace, f"tool.{tool.name}", tool=tool.name):
+                return await self._run(tool, args, ctx)
+        lock = self._resource_locks.setdefault(resource, asyncio.Lock())
+        async with lock:
+            with traced(ctx.trace, f"tool.{tool.name}", tool=tool.name, resource=resource):
+                return await self._run(tool, args, ctx)
+
+    async def run_many(self, calls: List[Tuple[str, Dict[str, Any]]], ctx: ToolContext) -> List[ToolResult]:
+        """Run independent (tool name, args) calls concurrently; results are in call order."""
+        async def run_one(name, args):
+            tool = self.get(name)
+            if tool is None:
+                return ToolResult(f"Error: Unknown tool '{name}'.")
+            return await self.run(tool, args, ctx)
+
+        return list(await asyncio.gather(*(run_one(name, args) for name, args in calls)))
+
+    async def _run(self, tool: Tool, args: Dict[str, Any], ctx: ToolContext) -> ToolResult:
+        missing = [name for name in tool.required if args.get(name) in (None, "")]
+        if missing:
+            return ToolResult(f"Error: Missing required argument(s) for {tool.name}: {', '.join(missing)}")
+
+        if ctx.cache is None:
+            ctx.cache = self.cache
+
+        try:
+            if tool.blocking:
+                loop = asyncio.get_running_loop()
+                call = functools.partial(self._call_blocking, tool, args, ctx)
+                result = await asyncio.wait_for(loop.run_in_executor(self.executor, call), tool.timeout)
+            else:
+                result = await asyncio.wait_for(tool.handler(ctx, args), tool.timeout)
+        except asyncio.TimeoutError:
+            self._cancel(tool, args, ctx)
+            return ToolResult(f"Error: Tool '{tool.name}' timed out after {tool.timeout:g} seconds.")
+        except asyncio.CancelledError:
+            self._cancel(tool, args, ctx)
+            raise
+        except Exception as e:
+            return ToolResult(f"Error running tool '{tool.name}': {e}")
+
+        result = _as_result(result)
+        if tool.invalidates and not result.output.startswith("Error"):
+            for name in tool.invalidates:
+                await self.invalidate_async(name)
+        return result
+
+    def _cancel(self, tool: Tool, args: Dict[str, Any], ctx: ToolContext):
+        if tool.on_cancel is None:
+            return
+        try:
+            tool.on_cancel(ctx, args)
+        except Exception as e:
+            logger.error(f"Error cancelling tool '{tool.name}': {e}")
+
+    def _call_blocking(self, tool: Tool, args: Dict[str, Any], ctx: ToolContext) -> ToolResult:
+        if self.cache is None or not tool.cache_ttl:
+            return tool.handler(ctx, args)
+        # Stored as a plain dict so it can be persisted; errors are not cached
+        value = self.cache.get_or_compute(
+            tool.name, args, tool.cache_ttl,
+            lambda: _as_result(tool.handler(ctx, args)).__dict__,
+            should_cache=lambda v: not v["output"].startswith("Error"),
+        )
+        return ToolResult(value["output"], list(value["display"]))
+
+
+def _as_result(result) -> ToolResult:
+    if isinstance(result, ToolResult):
+        return result
+    return ToolResult(str(result))
+
+
+# --- execute_python ---
+
+def _execute_python(ctx: ToolContext, args):
+    code_interpreter = ctx.agent.code_interpreter
+    if not code_interpreter:
+        output_str = "Error: Code Interpreter not available."
+    else:
+        result = code_interpreter.execute_code(args.get("code"))
+        output_str = f"Output:\n{result.get('output', '')}\nResult: {result.get('result', '')}"
+        if result.get("error"):
+            output_str += f"\nError: {result.get('error')}"
+    return ToolResult(output_str, [f"*Result:*\n```\n{output_str}\n```\n\n"])
+
+
+def _interrupt_python(ctx: ToolContext, args):
+    if ctx.agent.code_interpreter:
+        ctx.agent.code_interpreter.interrupt()
+
+
+# --- remember ---
+
+def _is_known_memory(ctx: ToolContext, text: str) -> bool:
+    # Simple check: if the new text is contained in an existing memory or vice versa
+    # This handles "Color is blue" vs "My favorite color is blue"
+    if not text:
+        return False
+    return any(text.lower() in mem.lower() or mem.lower() in text.lower() for mem in ctx.memories)
+
+
+def _announce_remember(ctx: ToolContext, args):
+    text = args.get("text")
+    if _is_known_memory(ctx, text):
+        return None
+    return f"\n\n*Saving to memory...*\n> {text}\n\n"
+
+
+async def _remember(ctx: ToolContext, args):
+    text = args.get("text")
+    # Check against the memories retrieved for this message to prevent hallucinated re-saves
+    if _is_known_memory(ctx, text):
+        return "Memory already exists. Do not re-save."
+    memory_service = ctx.agent.memory_service
+    if not memory_service:
+        return "Error: Memory Service not available."
+    if await memory_service.add_memory(text, ctx.provider or ctx.agent.provider):
+        return "Memory saved successfully."
+    return ToolResult("Error: Failed to save memory.", ["\n\n*Failed to save memory.*\n\n"])
+
+
+# --- system_control ---
+
+# Actions that drive the mouse/keyboard or read the screen must not interleave
+_GUI_ACTIONS = {"interact", "window", "screenshot"}
+
+_SYSTEM_ANNOUNCEMENTS = {
+    "open_app": lambda a: f"Opening {a.get('app_name')}...",
+    "set_volume": lambda a: f"Setting volume to {a.get('level')}%...",
+    "mute": lambda a: "Muting volume...",
+    "unmute": lambda a: "Unmuting volume...",
+    "write_file": lambda a: f"Writing file {a.get('path')}...",
+    "read_file": lambda a: f"Reading file {a.get('path')}...",
+    "list_files": lambda a: f"Listing files in {a.get('path', '.')}...",
+    "replace_text": lambda a: f"Patching file {a.get('path')}...",
+    "screenshot": lambda a: "Taking screenshot...",
+    "media": lambda a: f"Media Control: {a.get('action_type')}",
+    "power": lambda a: f"System Power: {a.get('action_type')}",
+    "brightness": lambda a: f"Setting brightness to {a.get('level')}%...",
+    "window": lambda a: f"Window Control: {a.get('action_type')}",
+    "interact": lambda a: f"Simulating: {a.get('action_type')}",
+}
+
+
+def _announce_system_control(ctx: ToolContext, args):
+    if not ctx.agent.system_control:
+        return None
+    announce = _SYSTEM_ANNOUNCEMENTS.get(args.get("action"))
+    return f"\n\n*{announce(args)}*\n\n" if announce else None
+
+
+def _system_control(ctx: ToolContext, args):
+    system_control = ctx.agent.system_control
+    if not system_control:
+        return "Error: System Control Service not available."
+
+    action = args.get("action")
+    if action == "open_app":
+        return system_control.open_application(args.get("app_name"))
+    elif action == "set_volume":
+        return system_control.set_volume(int(args.get("level")))
+    elif action == "mute":
+        return system_control.set_mute(True)
+    elif action == "unmute":
+        system_control.set_mute(False)
+        return "Success: Volume has been unmuted."
+    elif action == "write_file":
+        return system_control.write_file(args.get("path"), args.get("content"))
+    elif action == "read_file":
+        return system_control.read_file(args.get("path"))
+    elif action == "list_files":
+        return system_control.list_files(args.get("path", "."))
+    elif action == "replace_text":
+        return system_control.replace_text(args.get("path"), args.get("search_text"), args.get("replace_text"))
+    elif action == "screenshot":
+        if system_control.take_screenshot():
+            return "Screenshot taken successfully."
+        return "Failed to take screenshot."
+    elif action == "media":
+        return system_control.media_control(args.get("action_type"))
+    elif action == "power":
+        return system_control.system_power(args.get("action_type"))
+    elif action == "brightness":
+        return system_control.set_brightness(int(args.get("level")))
+    elif action == "window":
+        return system_control.window_control(args.get("action_type"))
+    elif action == "interact":
+        # Filter out keys that might conflict or aren't needed
+        interact_kwargs = {k: v for k, v in args.items() if k not in ["action", "action_type"]}
+        return system_control.interact(args.get("action_type"), **interact_kwargs)
+    return f"Error: Unknown system control action '{action}'"
+
+
+# --- web ---
+
+def _google_search(ctx: ToolContext, args):
+    try:
+        from app.services.search import search_web
+        return f"Search Results:\n{search_web(args.get('query'))}"
+    except Exception as e:
+        return f"Error performing search: {e}"
+
+
+def _search_youtube(ctx: ToolContext, args):
+    query = args.get("query")
+    try:
+        from app.services.search import get_first_youtube_video
+        if ctx.cache is not None:
+            # Only the lookup is cached; opening the video happens on every call
+            video_url = ctx.cache.get_or_compute("youtube_lookup", {"query": query}, YOUTUBE_LOOKUP_TTL,
+                                                 lambda: get_first_youtube_video(query),
+                                                 should_cache=lambda url: bool(url))
+        else:
+            video_url = get_first_youtube_video(query)
+    except Exception as e:
+        return f"Error searching YouTube: {e}"
+
+    if not video_url:
+        return "No video found."
+    # Directly open it using system control
+    if ctx.agent.system_control:
+        ctx.agent.system_control.open_application(video_url)
+        return f"Found and opening video: {video_url}"
+    return f"Found video: {video_url} (System control unavailable to open)"
+
+
+def _read_url(ctx: ToolContext, args):
+    url = args.get("url")
+    try:
+        import requests
+        from bs4 import BeautifulSoup
+    except ImportError:
+        return "Error: requests or beautifulsoup4 not installed."
+
+    try:
+        resp = requests.get(url, timeout=10)
+        soup = BeautifulSoup(resp.content, 'html.parser')
+
+        # Remove script and style elements
+        for script in soup(["script", "style"]):
+            script.extract()
+
+        text = soup.get_text()
+
+        # Break into lines and remove leading and trailing space on each
+        lines = (line.strip() for line in text.splitlines())
+        # Break multi-headlines into a line each
+        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+        # Drop blank lines
+        text = '\n'.join(chunk for chunk in chunks if chunk)
+
+        return f"URL Content ({url}):\n{text[:2000]}..." # Truncate
+    except Exception as e:
+        return f"Error reading URL: {e}"
+
+
+# --- workflows, knowledge base, history ---
+
+async def _execute_workflow(ctx: ToolContext, args):
+    workflow_service = ctx.agent.workflow_service
+    if not workflow_service:
+        return "Error: Workflow Service not available (System Control might be down)."
+    try:
+        return await workflow_service.execute_workflow(args.get("name"))
+    except Exception as e:
+        return f"Error executing workflow: {e}"
+
+
+def _ingest_file(ctx: ToolContext, args):
+    path = args.get("path")
+    try:
+        from app.services.rag import ingest_document
+        if os.path.exists(path):
+            return ingest_document(path, os.path.basename(path))
+        return f"Error: File not found at {path}"
+    except Exception as e:
+        return f"Error ingesting file: {e}"
+
+
+def _forget_file(ctx: ToolContext, args):
+    try:
+        from app.services.rag import remove_document
+        return remove_document(os.path.basename(args.get("filename")))
+    except Exception as e:
+        return f"Error removing file: {e}"
+
+
+def _search_knowledge(ctx: ToolContext, args):
+    try:
+        from app.services.rag import retrieve_context
+        results = retrieve_context(args.get("query"))
+        if results:
+            return f"Knowledge Base Results:\n{results}"
+        return "No relevant information found in knowledge base."
+    except Exception as e:
+        return f"Error searching knowledge base: {e}"
+
+
+async def _recall_conversation(ctx: ToolContext, args):
+    try:
+        results = await search_messages_async(args.get("query"), limit=5, highlight=("**", "**"))
+    except Exception as e:
+        return f"Error searching past conversations: {e}"
+    if not results:
+        return "No matching past conversations found."
+    lines = [f"- [{r['timestamp']}] ({r['session_title']}) {r['role']}: {r['snippet']}" for r in results]
+    return "Past Conversation Results:\n" + "\n".join(lines)
+
+
+# --- vision ---
+
+def _click_on_ui(ctx: ToolContext, args):
+    description = args.get("description")
+    vision_service = ctx.agent.vision_service
+    if not vision_service:
+        return "Error: Vision Service not available."
+
+    coords = vision_service.get_click_coordinates(description)
+    if not coords:
+        return f"Could not find UI element matching '{description}'."
+    x, y = coords
+    display = [f"\n\n*Clicking at ({x}, {y})...*\n\n"]
+    if not ctx.agent.system_control:
+        return ToolResult("Error: Vision found coordinates, but System Control unavailable for clicking.", display)
+    ctx.agent.system_control.interact("click", x=x, y=y)
+    return ToolResult(f"Clicked description '{description}' at ({x}, {y}).", display)
+
+
+def _says(template: str):
+    """Announcement formatted from the tool's arguments."""
+    return lambda ctx, args: "\n\n*" + template.format_map(_ArgDefaults(args)) + "*\n\n"
+
+
+class _ArgDefaults(dict):
+    def __missing__(self, key):
+        return None
+
+
+def build_tool_registry(cache: ToolResultCache = None) -> ToolRegistry:
+    """The agent's tools, as described in SYSTEM_INSTRUCTION."""
+    return ToolRegistry(cache=cache, tools=[
+        Tool("execute_python", _execute_python, required=("code",), timeout=60, resource="kernel",
+             on_cancel=_interrupt_python,
+             announce=lambda ctx, args: f"\n\n*Executing Code...*\n```python\n{args.get('code')}\n```\n\n"),
+        Tool("remember", _remember, blocking=False, required=("text",), announce=_announce_remember),
+        Tool("system_control", _system_control, required=("action",), announce=_announce_system_control,
+             resource=lambda args: "gui" if args.get("action") in _GUI_ACTIONS else None),
+        Tool("google_search", _google_search, required=("query",), timeout=20, cache_ttl=15 * 60,
+             announce=_says("Searching Google for '{query}'...")),
+        Tool("search_youtube", _search_youtube, required=("query",), timeout=20,
+             announce=_says("Searching YouTube for '{query}'...")),
+        Tool("read_url", _read_url, required=("url",), timeout=20, cache_ttl=30 * 60, announce=_says("Reading URL {url}...")),
+        Tool("click_on_ui", _click_on_ui, required=("description",), timeout=60, resource="gui",
+             announce=_says("Looking for '{description}'...")),
+        Tool("execute_workflow", _execute_workflow, blocking=False, required=("name",), timeout=60,
+             announce=_says("Activating Protocol: {name}...")),
+        Tool("ingest_file", _ingest_file, required=("path",), timeout=300, invalidates=("search_knowledge",),
+             announce=_says("Ingesting file {path}...")),
+        Tool("forget_file", _forget_file, required=("filename",), invalidates=("search_knowledge",),
+             announce=lambda ctx, args: f"\n\n*Removing {os.path.basename(args.get('filename') or '')} from memory...*\n\n"),
+        Tool("search_knowledge", _search_knowledge, required=("query",), cache_ttl=10 * 60,
+             announce=_says("Searching Brain for '{query}'...")),
+        Tool("recall_conversation", _recall_conversation, blocking=False, required=("query",),
+             announce=_says("Recalling past conversations about '{query}'...")),
+    ])
@@ -6,6 +6,9 @@ import os
 from PIL import Image, ImageDraw
 from google import genai
 from app.services.settings import SettingsService
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
 
 class VisionService:
     def __init__(self):
@@ -30,7 +33,7 @@ class VisionService:
         if api_key:
             self.client = genai.Client(api_key=api_key)
         else:
-            print("Gemini API key not configured in settings or environment.")
+            logger.info("Gemini API key not configured in settings or environment.")
 
     def capture_screen(self):
         """
@@ -39,7 +42,7 @@ class VisionService:
         try:
             return pyautogui.screenshot()
         except Exception as e:
-            print(f"Error capturing screen: {e}")
+            logger.error(f"Error capturing screen: {e}")
             return None
 
     def get_click_coordinates(self, description: str):
@@ -50,7 +53,7 @@ class VisionService:
         if not self.client:
             self._configure_genai()
             if not self.client:
-                print("Gemini API key not configured.")
+                logger.info("Gemini API key not configured.")
                 return None
 
         screenshot = self.capture_screen()
@@ -86,9 +89,9 @@ class VisionService:
                 coords = json.loads(json_str)
                 return (int(coords['x']), int(coords['y']))
             else:
-                print(f"Could not parse coordinates from: {text}")
+                logger.error(f"Could not parse coordinates from: {text}")
                 return None
                 
         except Exception as e:
-            print(f"Error analyzing screen: {e}")
+            logger.error(f"Error analyzing screen: {e}")
             return None
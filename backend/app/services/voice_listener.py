@@ -4,6 +4,9 @@ import pyaudio
 import asyncio
 from vosk import Model, KaldiRecognizer
 from typing import Callable, Optional
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
 
 class VoiceListenerService:
     def __init__(self, model_path: str = "model", wake_word: str = "karan"):
@@ -15,16 +18,16 @@ class VoiceListenerService:
         
     def initialize(self):
         if not os.path.exists(self.model_path):
-            print(f"VOSK Model not found at {self.model_path}. Voice listener disabled.")
+            logger.info(f"VOSK Model not found at {self.model_path}. Voice listener disabled.")
             return False
             
         try:
-            print("Loading VOSK Model...")
+            logger.info("Loading VOSK Model...")
             self.model = Model(self.model_path)
-            print("VOSK Model loaded.")
+            logger.info("VOSK Model loaded.")
             return True
         except Exception as e:
-            print(f"Failed to load VOSK model: {e}")
+            logger.error(f"Failed to load VOSK model: {e}")
             return False
 
     def on_wake_word(self, callback: Callable):
@@ -42,7 +45,7 @@ class VoiceListenerService:
         import threading
         self.thread = threading.Thread(target=self._listen_loop, daemon=True)
         self.thread.start()
-        print("Voice Listener Thread Started.")
+        logger.info("Voice Listener Thread Started.")
 
     def stop(self):
         self.is_running = False
@@ -55,7 +58,7 @@ class VoiceListenerService:
             
             rec = KaldiRecognizer(self.model, 16000)
             
-            print(f"Listening for wake word: '{self.wake_word}'...")
+            logger.info(f"Listening for wake word: '{self.wake_word}'...")
             
             while self.is_running:
                 data = stream.read(4000, exception_on_overflow=False)
@@ -67,7 +70,7 @@ class VoiceListenerService:
                     text = result.get("text", "").lower()
                     
                     if text:
-                        print(f"[DEBUG] VOSK Heard: '{text}'")
+                        logger.debug(f"VOSK Heard: '{text}'")
                     
                     # Phonetic variations and High-Fidelity Names
                     # "Jarvis", "Computer", "Nova" are recognized very clearly by VOSK.
@@ -80,14 +83,14 @@ class VoiceListenerService:
                         "hey k", "okay k"                           # Short commands
                     ]
                     if any(trigger in text for trigger in triggers):
-                        print(f"WAKE WORD DETECTED: {text}")
+                        logger.info(f"WAKE WORD DETECTED: {text}")
                         if self.callback:
                             # Run callback (careful with async/sync bridge)
                             # Ideally callback schedules something on the main loop
                             self.callback()
                             
         except Exception as e:
-            print(f"Voice Listener Error: {e}")
+            logger.error(f"Voice Listener Error: {e}")
         finally:
             try:
                 if 'stream' in locals():
@@ -95,7 +98,7 @@ class VoiceListenerService:
                     stream.close()
                 if 'p' in locals():
                     p.terminate()
-                print("Voice Listener Thread Stopped/Cleaned up.")
+                logger.info("Voice Listener Thread Stopped/Cleaned up.")
             except Exception as e:
-                print(f"Error closing voice listener resources: {e}")
+                logger.error(f"Error closing voice listener resources: {e}")
             
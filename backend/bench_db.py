@@ -0,0 +1,85 @@
+"""
+Benchmark chat message persistence throughput.
+
+Compares the legacy connect-per-call pattern against the pooled WAL
+connection layer in app.core.db, with and without the write-behind group
+commit queue, using several writer threads to mimic concurrent /chat streams.
+
+Usage: python bench_db.py [--sessions 8] [--messages 200]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from app.core import db
+
+
+def legacy_add_message(session_id: str, role: str, content: str):
+    conn = sqlite3.connect(db.DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)',
+                   (session_id, role, content))
+    conn.commit()
+    conn.close()
+
+
+def run(add_message, session_ids, messages: int) -> float:
+    def writer(session_id):
+        for i in range(messages):
+            add_message(session_id, "user", f"benchmark message {i} " + "x" * 200)
+
+    threads = [threading.Thread(target=writer, args=(s,)) for s in session_ids]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    db.flush_messages()
+    elapsed = time.perf_counter() - start
+    return (len(session_ids) * messages) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "legacy.db")
+        db.init_db()
+        session_ids = [db.create_session(f"Bench {i}") for i in range(args.sessions)]
+        # The legacy layer ran in the default rollback journal mode
+        with db.get_connection() as conn:
+            conn.execute("PRAGMA journal_mode = DELETE")
+        db.close_pool()
+        legacy = run(legacy_add_message, session_ids, args.messages)
+
+        db.WRITE_BEHIND = False
+        db.DB_PATH = os.path.join(tmp, "pooled.db")
+        db.init_db()
+        session_ids = [db.create_session(f"Bench {i}") for i in range(args.sessions)]
+        pooled = run(db.add_message, session_ids, args.messages)
+        db.close_pool()
+
+        db.WRITE_BEHIND = True
+        db.DB_PATH = os.path.join(tmp, "write_behind.db")
+        db.init_db()
+        session_ids = [db.create_session(f"Bench {i}") for i in range(args.sessions)]
+        commits_before = db._writer.batches
+        write_behind = run(db.add_message, session_ids, args.messages)
+        commits = db._writer.batches - commits_before
+        db.shutdown_db()
+
+    print(f"Writers: {args.sessions} x {args.messages} messages")
+    print(f"connect-per-call : {legacy:10.1f} msg/s")
+    print(f"pooled WAL       : {pooled:10.1f} msg/s  ({pooled / legacy:.2f}x)")
+    print(f"write-behind     : {write_behind:10.1f} msg/s  ({write_behind / legacy:.2f}x)")
+    print(f"group commits    : {commits} transactions for {args.sessions * args.messages} messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark time-to-first-token of the chat pre-flight with a mocked provider.
+
+The mock provider, memory store and knowledge base sleep for configurable
+latencies (embedding API call, Chroma query, first streamed token). The
+legacy path runs the old sequence: blocking retrieve_context on the event
+loop, then search_memory with its own embedding call, then the history load.
+The new path is app.services.preflight.run_preflight: one shared embedding,
+both vector queries and the history load concurrently.
+
+Usage: python bench_preflight.py [--embed-ms 80] [--query-ms 15] [--first-token-ms 250] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from app.core import db
+from app.services.preflight import run_preflight
+
+EMBED = 0.08
+QUERY = 0.015
+FIRST_TOKEN = 0.25
+
+
+class MockProvider:
+    embedding_model = "gemini-embedding-2"
+
+    async def get_embedding(self, text):
+        await asyncio.sleep(EMBED)
+        return [0.1] * 8
+
+    async def send_message_stream(self, history, message, images=None):
+        await asyncio.sleep(FIRST_TOKEN)
+        yield "Hello"
+
+
+class MockMemory:
+    async def search_memory(self, query, provider, limit=3, embedding=None):
+        if not embedding:
+            embedding = await provider.get_embedding(query)
+        await asyncio.to_thread(time.sleep, QUERY)
+        return ["User likes tea"]
+
+
+class MockKnowledge:
+    EMBEDDING_MODEL = "gemini-embedding-2"
+
+    @staticmethod
+    def retrieve_context(query, n_results=3, embedding=None):
+        if not embedding:
+            time.sleep(EMBED)  # synchronous Gemini embed call inside Chroma's embedding function
+        time.sleep(QUERY)
+        return "Plan: ship on Friday"
+
+
+async def first_token(provider):
+    async for _ in provider.send_message_stream([], "hi"):
+        return
+
+
+async def legacy_ttft(session_id, provider, memory, knowledge):
+    started = time.perf_counter()
+    knowledge.retrieve_context("what is the plan?")
+    await memory.search_memory("what is the plan?", provider)
+    await db.get_session_messages_async(session_id, limit=100)
+    await first_token(provider)
+    return time.perf_counter() - started
+
+
+async def preflight_ttft(session_id, provider, memory, knowledge):
+    started = time.perf_counter()
+    await run_preflight("what is the plan?", session_id, provider, memory, knowledge, history_limit=100)
+    await first_token(provider)
+    return time.perf_counter() - started
+
+
+async def measure(fn, session_ids, concurrency, rounds=5):
+    provider, memory, knowledge = MockProvider(), MockMemory(), MockKnowledge()
+    samples = []
+    for _ in range(rounds):
+        results = await asyncio.gather(*(fn(session_ids[i], provider, memory, knowledge) for i in range(concurrency)))
+        samples.extend(results)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    global EMBED, QUERY, FIRST_TOKEN
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embed-ms", type=float, default=80)
+    parser.add_argument("--query-ms", type=float, default=15)
+    parser.add_argument("--first-token-ms", type=float, default=250)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    EMBED, QUERY, FIRST_TOKEN = args.embed_ms / 1000, args.query_ms / 1000, args.first_token_ms / 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "history.db")
+        db.init_db()
+        session_ids = [db.create_session(f"Bench {i}") for i in range(args.concurrency)]
+        for session_id in session_ids:
+            for i in range(60):
+                db.add_message(session_id, "user" if i % 2 == 0 else "model", f"message {i} " + "x" * 300)
+        db.flush_messages()
+
+        for concurrency in sorted({1, args.concurrency}):
+            legacy = asyncio.run(measure(legacy_ttft, session_ids, concurrency))
+            new = asyncio.run(measure(preflight_ttft, session_ids, concurrency))
+            print(f"{concurrency} concurrent chat(s):")
+            print(f"  legacy     TTFT median {legacy[0] * 1000:7.1f} ms  max {legacy[1] * 1000:7.1f} ms")
+            print(f"  concurrent TTFT median {new[0] * 1000:7.1f} ms  max {new[1] * 1000:7.1f} ms")
+        db.shutdown_db()
+
+
+if __name__ == "__main__":
+    main()
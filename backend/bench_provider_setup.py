@@ -0,0 +1,63 @@
+"""
+Microbenchmark of per-request provider setup cost.
+
+"before" replays what generate_response_stream used to do on every message:
+load_dotenv(override=True), re-read user_settings.json, build a new provider
+(and genai.Client) and configure it twice. "after" is AgentService._configure
+with the settings-fingerprinted provider registry.
+
+Usage: python bench_provider_setup.py [--requests 200]
+"""
+import argparse
+import asyncio
+import time
+
+from dotenv import load_dotenv
+from app.services.agent import AgentService, SYSTEM_INSTRUCTION
+from app.services.settings import SettingsService
+from app.providers.gemini import GeminiProvider
+from app.providers.ollama import OllamaProvider
+
+
+async def legacy_setup():
+    load_dotenv(override=True)
+    settings = SettingsService().load_settings()
+    settings["system_instruction"] = SYSTEM_INSTRUCTION
+    provider = OllamaProvider() if settings.get("active_provider") == "ollama" else GeminiProvider()
+    await provider.configure(settings)
+
+    load_dotenv(override=True)
+    settings = SettingsService().load_settings()
+    settings["system_instruction"] = SYSTEM_INSTRUCTION
+    await provider.configure(settings)
+    return provider
+
+
+async def main(requests: int):
+    # Skip AgentService.__init__, which also starts the kernel, Chroma, etc.
+    agent = AgentService.__new__(AgentService)
+    agent._init_provider_state()
+    await agent._configure()
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await legacy_setup()
+    before = (time.perf_counter() - start) / requests
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await agent._configure()
+    after = (time.perf_counter() - start) / requests
+
+    print(f"Requests: {requests}")
+    print(f"before (reconfigure every request): {before * 1e6:10.1f} us/request")
+    print(f"after  (fingerprinted registry)   : {after * 1e6:10.1f} us/request")
+    print(f"speedup                           : {before / after:10.1f}x")
+    print(f"registry: {agent.provider_registry.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
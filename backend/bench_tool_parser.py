@@ -0,0 +1,74 @@
+"""
+Benchmark tool-call extraction on long streamed responses.
+
+Compares the previous end-of-turn extraction (try every '{' as a start and
+brace-count forward, json.loads at each balance point) against the
+incremental ToolCallParser fed chunk by chunk, on responses full of code
+with braces and ending in a tool call.
+
+Usage: python bench_tool_parser.py [--kb 100] [--chunk 40]
+(the legacy pass takes a couple of minutes at 100 KB; use --kb 20 for a quick run)
+"""
+import argparse
+import json
+import time
+
+from app.services.tool_parser import ToolCallParser
+
+
+def legacy_extract(text: str):
+    start_indices = [i for i, char in enumerate(text) if char == '{']
+    for start in start_indices:
+        balance = 0
+        for i in range(start, len(text)):
+            char = text[i]
+            if char == '{':
+                balance += 1
+            elif char == '}':
+                balance -= 1
+                if balance == 0:
+                    try:
+                        parsed = json.loads(text[start:i + 1])
+                        if "tool" in parsed:
+                            return parsed, i + 1
+                    except json.JSONDecodeError:
+                        pass
+    return None, None
+
+
+def build_response(kb: int) -> str:
+    snippet = "function f(x) { if (x) { return {a: x}; } else { return g({b: 1}); } }\n"
+    body = snippet * (kb * 1024 // len(snippet))
+    tool = json.dumps({"tool": "execute_python", "args": {"code": "print({'done': True})"}})
+    return "Here is the code:\n" + body + "Let me run it. " + tool
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--kb", type=int, default=100)
+    parser.add_argument("--chunk", type=int, default=40)
+    args = parser.parse_args()
+
+    text = build_response(args.kb)
+    chunks = [text[i:i + args.chunk] for i in range(0, len(text), args.chunk)]
+    print(f"Response: {len(text)} chars, {text.count('{')} braces, {len(chunks)} chunks")
+
+    start = time.perf_counter()
+    command, end = legacy_extract("".join(chunks))
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tool_parser = ToolCallParser()
+    for chunk in chunks:
+        tool_parser.feed(chunk)
+    tool_parser.finish()
+    parser_time = time.perf_counter() - start
+
+    call = tool_parser.calls[0]
+    assert (call.command, call.end) == (command, end), "extractors disagree"
+    print(f"legacy:      {legacy_time * 1000:9.1f} ms")
+    print(f"incremental: {parser_time * 1000:9.1f} ms  ({legacy_time / parser_time:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ if sys.platform.startswith("win"):
     except Exception as e:
         print(f"Failed to enforce UTF-8: {e}")
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
@@ -16,17 +16,29 @@ import uvicorn
 import os
 import json
 import asyncio
-from typing import List
+import time
+from typing import List, Optional
 from dotenv import load_dotenv
 from app.services.agent import AgentService
-from app.services.search import search_web
+from app.services.search import SearchError, search_web
 from app.services.tts import generate_audio
-from app.core.db import init_db, create_session, get_sessions, get_session_messages, delete_session, update_session_title
+from app.core.db import (
+    init_db, shutdown_db, create_session_async, session_exists_async, get_sessions_async, get_sessions_page_async, get_session_messages_page_async,
+    delete_session_async, update_session_title_async, add_message_async, search_messages_async,
+    get_history_cache_stats, run_maintenance_async, maintenance_loop, export_ndjson, import_ndjson_async
+)
 from app.services.system_control import SystemControlService
-from app.services.rag import ingest_document, retrieve_context
+from app.services.rag import ingest_document_async
 from app.services.research import generate_research_report
 from app.services.voice_listener import VoiceListenerService
+from app.services.backup import BackupService, backup_loop
+from app.services.session_scheduler import SessionScheduler, SessionBusyError
+from app.core.tracing import TurnTrace, recent_spans, tracing_enabled
+from app.core.embedding_cache import get_embedding_cache
 import shutil
+from app.core.logger import get_logger, shutdown_logging
+
+logger = get_logger(__name__)
 
 load_dotenv()
 
@@ -56,6 +68,9 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Globals
 voice_listener = None
 main_event_loop = None
+maintenance_task = None
+backup_task = None
+backup_service = BackupService()
 active_websockets: List[WebSocket] = []
 
 async def broadcast_wake_word():
@@ -63,13 +78,13 @@ async def broadcast_wake_word():
     if not active_websockets:
         return
     
-    print("Broadcasting WAKE WORD to clients...")
+    logger.info("Broadcasting WAKE WORD to clients...")
     to_remove = []
     for ws in active_websockets:
         try:
             await ws.send_json({"type": "WAKE_WORD_DETECTED", "text": "karan"})
         except Exception as e:
-            print(f"Failed to send to websocket: {e}")
+            logger.error(f"Failed to send to websocket: {e}")
             to_remove.append(ws)
     
     for ws in to_remove:
@@ -83,42 +98,57 @@ def on_wake_word_detected():
 
 @app.on_event("startup")
 async def startup_event():
-    global voice_listener, main_event_loop
+    global voice_listener, main_event_loop, maintenance_task, backup_task
     main_event_loop = asyncio.get_running_loop()
+    maintenance_task = asyncio.create_task(maintenance_loop())
+    backup_task = asyncio.create_task(backup_loop(backup_service))
     
-    print("Initializing Voice Listener...")
+    logger.info("Initializing Voice Listener...")
     try:
         voice_listener = VoiceListenerService(wake_word="karan")
         if voice_listener.initialize():
             voice_listener.on_wake_word(on_wake_word_detected)
             # voice_listener.start() # Wait for frontend to request start
         else:
-            print("Voice Listener failed to initialize.")
+            logger.error("Voice Listener failed to initialize.")
     except Exception as e:
-         print(f"Error starting Voice Listener: {e}")
+         logger.error(f"Error starting Voice Listener: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in (maintenance_task, backup_task):
+        if task:
+            task.cancel()
+    if llm_service:
+        await llm_service.provider_registry.aclose()
+        if llm_service.tools.cache:
+            llm_service.tools.cache.close()
+    get_embedding_cache().close()
+    shutdown_db()
+    shutdown_logging()
 
 # Initialize services
 try:
-    print("Initializing AgentService...")
+    logger.info("Initializing AgentService...")
     llm_service = AgentService()
     if llm_service and llm_service.code_interpreter:
-        print("Code Interpreter initialized successfully.")
+        logger.info("Code Interpreter initialized successfully.")
     else:
-        print("Code Interpreter NOT initialized.")
+        logger.info("Code Interpreter NOT initialized.")
 except Exception as e:
-    print(f"Failed to initialize Agent Service: {e}")
+    logger.error(f"Failed to initialize Agent Service: {e}")
     llm_service = None
 
 try:
     system_control_service = SystemControlService()
 except Exception as e:
-    print(f"Failed to initialize System Control Service: {e}")
+    logger.error(f"Failed to initialize System Control Service: {e}")
     system_control_service = None
 try:
     from app.services.settings import SettingsService
     settings_service = SettingsService()
 except Exception as e:
-    print(f"Failed to initialize Settings Service: {e}")
+    logger.error(f"Failed to initialize Settings Service: {e}")
     settings_service = None
 
 @app.post("/voice/start")
@@ -151,7 +181,7 @@ async def websocket_endpoint(websocket: WebSocket):
         if websocket in active_websockets:
             active_websockets.remove(websocket)
     except Exception as e:
-        print(f"WebSocket error: {e}")
+        logger.error(f"WebSocket error: {e}")
         if websocket in active_websockets:
             active_websockets.remove(websocket)
 
@@ -159,6 +189,23 @@ async def websocket_endpoint(websocket: WebSocket):
 async def root():
     return {"message": "AI Assistant Backend is running"}
 
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        "history_cache": get_history_cache_stats(),
+        "backup": backup_service.stats(),
+        "providers": llm_service.provider_registry.stats() if llm_service else None,
+        "tool_cache": llm_service.tools.cache.stats() if llm_service and llm_service.tools.cache else None,
+        "response_cache": llm_service.response_cache.stats() if llm_service else None,
+        "sessions": session_scheduler.stats(),
+        "embedding_cache": get_embedding_cache().stats(),
+    }
+
+@app.get("/traces")
+async def get_traces(trace_id: Optional[str] = None, limit: int = 200):
+    """Recently finished spans (kept in memory), optionally of one trace."""
+    return {"enabled": tracing_enabled(), "spans": recent_spans.spans(trace_id, limit)}
+
 # Settings Endpoints
 @app.get("/settings")
 async def get_settings():
@@ -190,38 +237,86 @@ async def clear_memories():
 # Session Endpoints
 @app.post("/sessions")
 async def create_new_session(title: str = Form("New Chat")):
-    session_id = create_session(title)
+    session_id = await create_session_async(title)
     return {"id": session_id, "title": title}
 
 @app.get("/sessions")
-async def list_sessions():
-    return get_sessions()
+async def list_sessions(limit: Optional[int] = None, cursor: Optional[str] = None):
+    # Without a limit the full list is returned, as the frontend expects.
+    # With a limit, pages come back as {"sessions": [...], "next_cursor": ...}.
+    if limit is None:
+        return await get_sessions_async()
+    if limit <= 0:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    return await get_sessions_page_async(cursor=cursor, limit=limit)
+
+@app.get("/sessions/export")
+async def export_sessions():
+    # export_ndjson is a plain generator, so Starlette drains it on its threadpool
+    return StreamingResponse(
+        export_ndjson(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="history.ndjson"'}
+    )
+
+@app.post("/sessions/import")
+async def import_sessions(file: UploadFile = File(...)):
+    # The upload is spooled to disk by Starlette; lines are streamed from it
+    return await import_ndjson_async(file.file)
 
 @app.get("/sessions/{session_id}")
-async def get_session(session_id: str):
-    messages = get_session_messages(session_id)
-    return {"messages": messages}
+async def get_session(session_id: str, before_id: Optional[int] = None, limit: Optional[int] = None):
+    # Without a limit the whole history is returned, as the frontend expects.
+    # Pass limit (and next_before_id as before_id) to page backwards.
+    if limit is not None and limit <= 0:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    return await get_session_messages_page_async(session_id, before_id=before_id, limit=limit)
 
 @app.delete("/sessions/{session_id}")
 async def delete_chat_session(session_id: str):
-    delete_session(session_id)
+    await delete_session_async(session_id)
     
     # Cleanup audio files for this session
     session_audio_dir = os.path.join("static", "audio", session_id)
     if os.path.exists(session_audio_dir) and session_id.strip(): # Check strip to avoid deleting root audio if empty
         try:
             shutil.rmtree(session_audio_dir)
-            print(f"Deleted audio content for session: {session_id}")
+            logger.info(f"Deleted audio content for session: {session_id}")
         except Exception as e:
-            print(f"Failed to delete audio contents: {e}")
+            logger.error(f"Failed to delete audio contents: {e}")
             
     return {"message": "Session deleted"}
 
 @app.put("/sessions/{session_id}")
 async def update_chat_session(session_id: str, title: str = Form(...)):
-    update_session_title(session_id, title)
+    await update_session_title_async(session_id, title)
     return {"id": session_id, "title": title}
 
+@app.post("/backups")
+async def create_backup():
+    try:
+        return await asyncio.to_thread(backup_service.create_backup)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/backups")
+async def list_backups():
+    return {"backups": backup_service.list_backups()}
+
+@app.post("/maintenance/compact")
+async def compact_history(idle_days: int = 30):
+    if idle_days < 0:
+        raise HTTPException(status_code=400, detail="idle_days must not be negative")
+    return await run_maintenance_async(idle_days)
+
+@app.get("/search/messages")
+async def search_chat_history(q: str, session_id: Optional[str] = None, since: Optional[str] = None,
+                              until: Optional[str] = None, limit: int = 20):
+    if limit <= 0 or limit > 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    results = await search_messages_async(q, session_id=session_id, since=since, until=until, limit=limit)
+    return {"results": results}
+
 @app.post("/upload")
 async def upload_document(file: UploadFile = File(...)):
     try:
@@ -231,28 +326,44 @@ async def upload_document(file: UploadFile = File(...)):
             shutil.copyfileobj(file.file, buffer)
         
         # Ingest
-        result = ingest_document(temp_path, file.filename)
+        result = await ingest_document_async(temp_path, file.filename)
         
         # Cleanup
         os.remove(temp_path)
+
+        # Cached knowledge-base searches may be missing the new document
+        if llm_service:
+            await llm_service.tools.invalidate_async("search_knowledge")
         
         return {"message": result}
     except Exception as e:
-        print(f"Upload error: {e}")
+        logger.error(f"Upload error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/knowledge")
 async def clear_knowledge_base_endpoint():
     from app.services.rag import clear_knowledge_base
     if clear_knowledge_base():
+        if llm_service:
+            await llm_service.tools.invalidate_async("search_knowledge")
         return {"message": "Knowledge base cleared successfully"}
     else:
         raise HTTPException(status_code=500, detail="Failed to clear knowledge base")
 
+# Turns of the same session run one at a time
+session_scheduler = SessionScheduler()
+
 @app.post("/chat")
-async def chat(message: str = Form(...), session_id: str = Form(...), file: UploadFile = File(None)):
+async def chat(request: Request, message: str = Form(...), session_id: str = Form(...), file: UploadFile = File(None),
+               timing: bool = Form(False)):
+    """Streams the answer as SSE; with timing=true a final `event: timing` frame breaks down where the time went."""
     if not llm_service:
         raise HTTPException(status_code=500, detail="LLM Service not available")
+    # Messages of an unknown session would be dropped at commit time
+    if not await session_exists_async(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    if not session_scheduler.has_room(session_id):
+        raise HTTPException(status_code=409, detail="A response is already being generated for this session")
     
     image_data = None
     mime_type = None
@@ -260,17 +371,23 @@ async def chat(message: str = Form(...), session_id: str = Form(...), file: Uplo
         image_data = await file.read()
         mime_type = file.content_type
 
-    async def event_generator():
+    trace = TurnTrace("chat", session_id=session_id)
+
+    async def chat_events():
         user_message = message
         
         # Simple intent detection for search
         if "search for" in user_message.lower() or "google" in user_message.lower():
             # Perform search synchronously for now
             search_query = user_message.replace("search for", "").replace("google", "").strip()
-            search_results = search_web(search_query)
+            with trace.span("search_web"):
+                try:
+                    search_results = search_web(search_query)
+                except SearchError as e:
+                    search_results = f"Error performing search: {e}"
             prompt = f"User asked: {user_message}\n\nSearch Results:\n{search_results}\n\nProvide a helpful answer based on the search results."
             
-            async for chunk in llm_service.generate_response_stream(prompt, session_id=session_id):
+            async for chunk in llm_service.generate_response_stream(prompt, session_id=session_id, trace=trace):
                 if "text" in chunk:
                     payload = json.dumps({"text": chunk['text']})
                     yield f"data: {payload}\n\n"
@@ -279,7 +396,7 @@ async def chat(message: str = Form(...), session_id: str = Form(...), file: Uplo
                     if system_control_service and "tool" in cmd:
                         tool_name = cmd["tool"]
                         args = cmd.get("args", {})
-                        print(f"Executing tool: {tool_name} with args: {args}")
+                        logger.info(f"Executing tool: {tool_name} with args: {args}")
                         
                         execution_result = ""
                         if tool_name == "set_volume":
@@ -295,19 +412,15 @@ async def chat(message: str = Form(...), session_id: str = Form(...), file: Uplo
             topic = user_message[9:].strip()
             
             # Save the user's original message to DB manually, since we disabled it in the service
-            from app.core.db import add_message
-            add_message(session_id, "user", user_message)
+            await add_message_async(session_id, "user", user_message)
             
             async for chunk in generate_research_report(topic, llm_service, session_id):
                 if "text" in chunk:
                     payload = json.dumps({"text": chunk['text']})
                     yield f"data: {payload}\n\n"
         else:
-            # Retrieve context from RAG
-            context = retrieve_context(user_message)
-            print(f"Retrieved context: {context[:100]}...") # Debug log
-
-            async for chunk in llm_service.generate_response_stream(user_message, session_id=session_id, image_data=image_data, mime_type=mime_type, context=context):
+            # Knowledge base context is retrieved by the agent, concurrently with memories and history
+            async for chunk in llm_service.generate_response_stream(user_message, session_id=session_id, image_data=image_data, mime_type=mime_type, retrieve_knowledge=True, trace=trace):
                 if "text" in chunk:
                     payload = json.dumps({"text": chunk['text']})
                     yield f"data: {payload}\n\n"
@@ -316,7 +429,7 @@ async def chat(message: str = Form(...), session_id: str = Form(...), file: Uplo
                     if system_control_service and "tool" in cmd:
                         tool_name = cmd["tool"]
                         args = cmd.get("args", {})
-                        print(f"Executing tool: {tool_name} with args: {args}")
+                        logger.info(f"Executing tool: {tool_name} with args: {args}")
                         
                         execution_result = ""
                         if tool_name == "set_volume":
@@ -328,6 +441,21 @@ async def chat(message: str = Form(...), session_id: str = Form(...), file: Uplo
                         
                         yield f"event: command\ndata: {json.dumps(cmd)}\n\n"
 
+    async def event_generator():
+        queued = time.perf_counter()
+        try:
+            async with session_scheduler.turn(session_id):
+                trace.record("queue_wait", time.perf_counter() - queued, started=queued)
+                # Closing the stream on disconnect cancels the provider call and running tools
+                async for event in session_scheduler.stream_until_disconnect(chat_events(), request.is_disconnected):
+                    yield event
+        except SessionBusyError as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            trace.finish()
+        if timing:
+            yield f"event: timing\ndata: {json.dumps(trace.breakdown())}\n\n"
+
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 @app.post("/tts")
@@ -354,7 +482,7 @@ async def text_to_speech(text: str = Form(...), session_id: str = Form(None)):
         audio_file = await generate_audio(text, voice, session_id=session_id)
         return {"audio_url": f"/static/audio/{audio_file}"}
     except Exception as e:
-        print(f"TTS Error: {e}")
+        logger.error(f"TTS Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
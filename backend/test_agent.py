@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("google.genai")
+pytest.importorskip("httpx")
+
+from app.core import db
+from app.services import agent as agent_module
+from app.services.llm_provider import LLMProvider
+from app.services.tools import Tool, ToolRegistry
+
+
+class ScriptedProvider(LLMProvider):
+    """Streams a scripted list of chunks per turn and records how far each stream was read."""
+    embedding_model = "none"
+
+    def __init__(self, turns):
+        self.turns = list(turns)
+        self.messages = []
+        self.chunks_read = []
+        self.closed_early = 0
+
+    async def configure(self, settings):
+        pass
+
+    async def send_message_stream(self, history, message, images=None):
+        self.messages.append(message)
+        self.chunks_read.append(0)
+        try:
+            for chunk in self.turns.pop(0):
+                self.chunks_read[-1] += 1
+                yield chunk
+        except GeneratorExit:
+            self.closed_early += 1
+            raise
+
+    async def get_embedding(self, text):
+        return []
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "history.db"))
+    monkeypatch.setattr(agent_module, "TOOL_CACHE_PATH", str(tmp_path / "tool_cache.db"))
+    db.init_db()
+    yield agent_module.AgentService()
+    db.shutdown_db()
+
+
+def test_tool_call_is_dispatched_as_soon_as_it_closes(agent, monkeypatch):
+    provider = ScriptedProvider([
+        ["Let me check. ", '{"tool": "probe", "ar', 'gs": {"q": "x"}} Result: sunny', " (made up)", " more"],
+        ["It is ", "cloudy."],
+    ])
+
+    async def configure(hold=False):
+        agent.settings = {}
+        agent.provider = provider
+        return provider
+
+    monkeypatch.setattr(agent, "_configure", configure)
+    calls = []
+
+    async def probe(ctx, args):
+        calls.append(args)
+        return f"probed {args['q']}"
+
+    agent.tools = ToolRegistry([Tool("probe", probe, blocking=False)])
+    session_id = db.create_session("Early dispatch")
+
+    async def run():
+        return [chunk["text"] async for chunk in agent.generate_response_stream("check x", session_id)
+                if "text" in chunk]
+
+    texts = asyncio.run(run())
+
+    # The tool call's turn ends at its closing brace; the hallucinated rest is never shown
+    assert "".join(texts) == 'Let me check. {"tool": "probe", "args": {"q": "x"}}It is cloudy.'
+    assert texts[2] == 'gs": {"q": "x"}}'
+    # The first stream was closed right there, before its trailing chunks were read
+    assert provider.closed_early == 1
+    assert provider.chunks_read == [3, 2]
+    assert calls == [{"q": "x"}]
+    assert provider.messages[1].startswith("Tool Result: probed x")
+
+
+def test_closing_the_stream_keeps_the_partial_answer(agent, monkeypatch):
+    provider = ScriptedProvider([["Partial ", "answer", " never read"]])
+    released = []
+
+    async def configure(hold=False):
+        agent.settings = {}
+        agent.provider = provider
+        return provider
+
+    async def release(held):
+        # Closing a real provider suspends (e.g. an HTTP client shutting down)
+        await asyncio.sleep(0)
+        released.append(held)
+
+    monkeypatch.setattr(agent, "_configure", configure)
+    monkeypatch.setattr(agent.provider_registry, "release", release)
+    session_id = db.create_session("Closed early")
+
+    async def run():
+        stream = agent.generate_response_stream("hi", session_id)
+        shown = [(await stream.__anext__())["text"], (await stream.__anext__())["text"]]
+        # What a client disconnect does to the response generator
+        await stream.aclose()
+        await asyncio.gather(*agent._background_tasks)
+        return shown
+
+    assert asyncio.run(run()) == ["Partial ", "answer"]
+    assert provider.closed_early == 1
+    assert released == [provider]
+    assert db.get_session_messages(session_id)[-1] == {"role": "model", "content": "Partial answer"}
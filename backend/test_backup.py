@@ -0,0 +1,76 @@
+import json
+import os
+import sqlite3
+import pytest
+from app.core import db
+from app.services.backup import BackupService
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "history.db"))
+    db.init_db()
+    session_id = db.create_session("Backed up")
+    db.add_message(session_id, "user", "please keep this")
+
+    chroma_dir = tmp_path / "chroma_db"
+    segment = chroma_dir / "segment-1"
+    segment.mkdir(parents=True)
+    (segment / "data_level0.bin").write_bytes(b"\x01" * 4096)
+    conn = sqlite3.connect(chroma_dir / "chroma.sqlite3")
+    conn.execute("CREATE TABLE embeddings (id TEXT)")
+    conn.execute("INSERT INTO embeddings VALUES ('m1')")
+    conn.commit()
+    conn.close()
+
+    settings_file = tmp_path / "user_settings.json"
+    settings_file.write_text(json.dumps({"theme": "dark"}))
+
+    service = BackupService(backup_dir=str(tmp_path / "backups"), retention=2,
+                            chroma_dir=str(chroma_dir), settings_file=str(settings_file))
+    yield service, session_id, segment
+    db.shutdown_db()
+
+
+def test_backup_contains_all_state(state):
+    service, session_id, _ = state
+    manifest = service.create_backup()
+
+    backup_path = os.path.join(service.backup_dir, manifest["name"])
+    conn = sqlite3.connect(os.path.join(backup_path, "history.db"))
+    assert conn.execute("SELECT content FROM messages WHERE session_id = ?", (session_id,)).fetchall() == [("please keep this",)]
+    conn.close()
+
+    conn = sqlite3.connect(os.path.join(backup_path, "chroma_db", "chroma.sqlite3"))
+    assert conn.execute("SELECT id FROM embeddings").fetchall() == [("m1",)]
+    conn.close()
+
+    assert os.path.exists(os.path.join(backup_path, "user_settings.json"))
+    assert manifest["components"]["history"]["steps"] >= 1
+    assert manifest["total_bytes"] > 0
+    assert service.list_backups()[0]["name"] == manifest["name"]
+
+
+def test_unchanged_chroma_files_are_hard_linked(state):
+    service, _, segment = state
+    service.create_backup()
+    second = service.create_backup()
+    assert second["components"]["chroma"]["linked_files"] == 1
+
+    (segment / "data_level0.bin").write_bytes(b"\x02" * 8192)
+    third = service.create_backup()
+    assert third["components"]["chroma"]["linked_files"] == 0
+
+    # Retention keeps only the newest two backups
+    assert len(service.list_backups()) == 2
+    assert service.stats()["backups_taken"] == 3
+
+
+def test_concurrent_backup_is_rejected(state):
+    service, _, _ = state
+    service._lock.acquire()
+    try:
+        with pytest.raises(RuntimeError):
+            service.create_backup()
+    finally:
+        service._lock.release()
@@ -0,0 +1,42 @@
+from app.services.context_budget import (
+    ContextBudget, context_window_for, estimate_tokens, take_for_summary, truncate_to_tokens,
+)
+
+
+def make_history(count, size=400):
+    return [{"role": "user" if i % 2 == 0 else "model", "content": f"{i:04d}" + "x" * (size - 4)} for i in range(count)]
+
+
+def test_plan_keeps_newest_turns_within_window():
+    budget = ContextBudget(4096)
+    history = make_history(100)
+    plan = budget.plan("system " * 200, "hello", [("profile", "User Profile: Ann")], history)
+
+    assert 0 < len(plan.history) < 100
+    assert plan.history == history[-len(plan.history):]
+    assert plan.dropped_messages == 100 - len(plan.history)
+    used = sum(v for k, v in plan.usage.items())
+    assert used <= 4096
+
+
+def test_context_parts_are_trimmed_in_priority_order():
+    budget = ContextBudget(2000, output_reserve=0)
+    parts = [("profile", "p" * 400), ("memories", "m" * 4000), ("documents", "d" * 4000)]
+    plan = budget.plan("", "hi", parts, [])
+
+    labels = [label for label, _ in plan.context_parts]
+    assert labels[:2] == ["profile", "memories"]
+    assert plan.context_parts[0][1] == "p" * 400
+    assert plan.context_parts[1][1].endswith("[...]")
+    context_tokens = sum(estimate_tokens(text) for _, text in plan.context_parts)
+    assert context_tokens <= int((2000 - plan.usage["system"] - plan.usage["message"]) * 0.35) + 2
+
+
+def test_settings_and_helpers():
+    assert context_window_for({"providers": {"ollama": {"num_ctx": 8192}}}, "ollama") == 8192
+    assert context_window_for({}, "ollama") == 4096
+    assert truncate_to_tokens("short", 10) == "short"
+    assert len(take_for_summary(make_history(50), max_tokens=1000)) == 9
+    # A single oversized message is still summarized, truncated
+    huge = take_for_summary([{"role": "user", "content": "y" * 100000}], max_tokens=100)
+    assert len(huge) == 1 and estimate_tokens(huge[0]["content"]) <= 102
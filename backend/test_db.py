@@ -0,0 +1,531 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import textwrap
+import pytest
+from app.core import db
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "history.db"))
+    db.init_db()
+    yield db
+    db.shutdown_db()
+
+
+def test_session_roundtrip(temp_db):
+    session_id = temp_db.create_session("Test Chat")
+    temp_db.add_message(session_id, "user", "Hello")
+    temp_db.add_message(session_id, "assistant", "Hi there")
+
+    messages = temp_db.get_session_messages(session_id)
+    assert messages == [
+        {"role": "user", "content": "Hello"},
+        {"role": "model", "content": "Hi there"},
+    ]
+
+    temp_db.update_session_title(session_id, "Renamed")
+    sessions = temp_db.get_sessions()
+    assert sessions[0]["title"] == "Renamed"
+
+    temp_db.delete_session(session_id)
+    assert temp_db.get_sessions() == []
+    assert temp_db.get_session_messages(session_id) == []
+
+
+def test_pool_uses_wal_and_reuses_connections(temp_db):
+    with temp_db.get_connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+        first = conn
+
+    with temp_db.get_connection() as conn:
+        assert conn is first
+
+
+def test_concurrent_writers(temp_db):
+    session_ids = [temp_db.create_session(f"Chat {i}") for i in range(8)]
+
+    def writer(session_id):
+        for i in range(50):
+            temp_db.add_message(session_id, "user", f"message {i}")
+
+    threads = [threading.Thread(target=writer, args=(s,)) for s in session_ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for session_id in session_ids:
+        messages = temp_db.get_session_messages(session_id)
+        assert [m["content"] for m in messages] == [f"message {i}" for i in range(50)]
+
+    assert len(temp_db.get_pool()._all) <= temp_db.POOL_SIZE
+
+
+def test_pool_follows_db_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "a.db"))
+    db.init_db()
+    pool_a = db.get_pool()
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "b.db"))
+    db.init_db()
+    assert db.get_pool() is not pool_a
+    with pytest.raises(RuntimeError):
+        pool_a.acquire()
+    db.close_pool()
+
+
+def test_async_api_runs_off_the_event_loop(temp_db):
+    import asyncio
+
+    async def scenario():
+        loop_thread = threading.get_ident()
+        seen_threads = []
+
+        def probe():
+            seen_threads.append(threading.get_ident())
+
+        session_id = await temp_db.create_session_async("Async Chat")
+        await temp_db.add_message_async(session_id, "user", "Hello")
+        await temp_db.run_in_db_thread(probe)
+        messages = await temp_db.get_session_messages_async(session_id)
+        assert seen_threads and seen_threads[0] != loop_thread
+        return session_id, messages
+
+    session_id, messages = asyncio.run(scenario())
+    assert messages == [{"role": "user", "content": "Hello"}]
+
+
+def test_write_behind_batches_and_reads_own_writes(temp_db):
+    session_id = temp_db.create_session("Batched")
+    batches_before = temp_db._writer.batches
+
+    for i in range(100):
+        temp_db.add_message(session_id, "user", f"message {i}")
+
+    # The reader flushes this session's queued rows before querying
+    messages = temp_db.get_session_messages(session_id)
+    assert [m["content"] for m in messages] == [f"message {i}" for i in range(100)]
+    assert temp_db._writer.batches - batches_before < 100
+
+
+def test_write_behind_survives_deleted_session(temp_db):
+    kept = temp_db.create_session("Kept")
+    doomed = temp_db.create_session("Doomed")
+    temp_db.delete_session(doomed)
+
+    temp_db.add_message(doomed, "user", "orphan")
+    temp_db.add_message(kept, "user", "still saved")
+    temp_db.flush_messages()
+
+    assert temp_db.get_session_messages(kept) == [{"role": "user", "content": "still saved"}]
+
+
+def test_write_behind_waits_out_a_locked_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "history.db"))
+    monkeypatch.setattr(db, "BUSY_TIMEOUT_MS", 20)
+    monkeypatch.setattr(db, "COMMIT_RETRY_DELAY_MS", 10)
+    db.init_db()
+    try:
+        session_id = db.create_session("Busy")
+        # Another connection holds the write lock for longer than busy_timeout, like a VACUUM would
+        locker = sqlite3.connect(db.DB_PATH, isolation_level=None)
+        locker.execute("BEGIN EXCLUSIVE")
+        db.add_message(session_id, "user", "not lost")
+        flusher = threading.Thread(target=db.flush_messages)
+        flusher.start()
+        flusher.join(0.3)
+        assert flusher.is_alive()
+        locker.execute("COMMIT")
+        locker.close()
+        flusher.join()
+
+        assert db.get_session_messages(session_id) == [{"role": "user", "content": "not lost"}]
+        with db.get_connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 1
+    finally:
+        db.shutdown_db()
+
+
+def test_delete_session_commits_queued_messages_first(temp_db, monkeypatch):
+    monkeypatch.setattr(temp_db, "FLUSH_INTERVAL_MS", 60000)
+    session_id = temp_db.create_session("Doomed")
+    temp_db.add_message(session_id, "user", "queued")
+    rows_before = temp_db._writer.rows
+
+    temp_db.delete_session(session_id)
+    temp_db.flush_messages()
+
+    # The queued row landed before the delete instead of failing as an orphan afterwards
+    assert temp_db._writer.rows == rows_before + 1
+    with temp_db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 0
+
+
+def test_shutdown_flushes_queue(tmp_path):
+    db_path = str(tmp_path / "history.db")
+    script = textwrap.dedent(f"""
+        from app.core import db
+        db.DB_PATH = {db_path!r}
+        db.FLUSH_INTERVAL_MS = 60000
+        db.init_db()
+        session_id = db.create_session("Shutdown")
+        for i in range(500):
+            db.add_message(session_id, "user", f"message {{i}}")
+        # No explicit flush: the atexit hook must drain the queue
+    """)
+    subprocess.run([sys.executable, "-c", script], check=True, cwd=os.path.dirname(__file__) or ".")
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 500
+    conn.close()
+
+
+def test_crash_leaves_consistent_prefix(tmp_path):
+    db_path = str(tmp_path / "history.db")
+    script = textwrap.dedent(f"""
+        import os, sys, threading
+        from app.core import db
+        db.DB_PATH = {db_path!r}
+        db.init_db()
+        sessions = [db.create_session(f"Crash {{n}}") for n in range(4)]
+
+        def writer(session_id):
+            for i in range(2000):
+                db.add_message(session_id, "user", f"{{i}}")
+                if i == 500:
+                    db.flush_messages()
+                    sys.stdout.write(f"flushed {{session_id}}\\n")
+
+        threads = [threading.Thread(target=writer, args=(s,)) for s in sessions]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        sys.stdout.flush()
+        # Simulate a hard crash while batches are still queued / in flight
+        os._exit(1)
+    """)
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                            cwd=os.path.dirname(__file__) or ".")
+    flushed = {line.split()[1] for line in result.stdout.splitlines() if line.startswith("flushed")}
+    assert len(flushed) == 4
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    for session_id in flushed:
+        contents = [int(row[0]) for row in conn.execute(
+            "SELECT content FROM messages WHERE session_id = ? ORDER BY id", (session_id,))]
+        # Acknowledged flushes are durable, and what survived is a gap-free prefix
+        assert len(contents) >= 501
+        assert contents == list(range(len(contents)))
+    conn.close()
+
+
+def test_keyset_pagination(temp_db):
+    session_id = temp_db.create_session("Paged")
+    for i in range(25):
+        temp_db.add_message(session_id, "user" if i % 2 == 0 else "assistant", f"message {i}")
+
+    seen = []
+    before_id = None
+    while True:
+        page = temp_db.get_session_messages_page(session_id, before_id=before_id, limit=10)
+        seen = [m["content"] for m in page["messages"]] + seen
+        before_id = page["next_before_id"]
+        if before_id is None:
+            break
+    assert seen == [f"message {i}" for i in range(25)]
+
+    everything = temp_db.get_session_messages_page(session_id, limit=None)
+    assert len(everything["messages"]) == 25 and everything["next_before_id"] is None
+    assert everything["messages"][1]["role"] == "model"
+
+    tail = temp_db.get_session_messages(session_id, limit=3)
+    assert [m["content"] for m in tail] == ["message 22", "message 23", "message 24"]
+
+
+def test_migrations_add_session_index(temp_db):
+    with temp_db.get_connection() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 5", ("x",)
+        ).fetchall()
+    assert version == len(temp_db.MIGRATIONS)
+    assert any("idx_messages_session_id" in row[3] for row in plan)
+
+
+def test_full_text_search(temp_db):
+    trip = temp_db.create_session("Trip planning")
+    other = temp_db.create_session("Cooking")
+    temp_db.add_message(trip, "user", "I want to visit the café district in Kyoto")
+    temp_db.add_message(trip, "assistant", "Kyoto has great cafes near Gion.")
+    temp_db.add_message(other, "user", "How long do I boil an egg?")
+
+    results = temp_db.search_messages("kyoto")
+    assert {r["session_id"] for r in results} == {trip}
+    assert all("<mark>" in r["snippet"] for r in results)
+    assert results[0]["session_title"] == "Trip planning"
+
+    # Accents are folded and FTS syntax in user input is neutralised
+    assert len(temp_db.search_messages("cafe")) == 1
+    assert temp_db.search_messages('(egg" *') == temp_db.search_messages("egg")
+
+    assert temp_db.search_messages("kyoto", session_id=other) == []
+    assert temp_db.search_messages("kyoto", since="2000-01-01T00:00:00")
+    assert temp_db.search_messages("kyoto", until="2000-01-01") == []
+
+    # Deleting a session removes its messages from the index
+    temp_db.delete_session(trip)
+    assert temp_db.search_messages("kyoto") == []
+
+
+def test_session_summaries_and_pagination(temp_db):
+    with temp_db.get_connection() as conn:
+        with conn:
+            for i in range(12):
+                conn.execute(
+                    "INSERT INTO sessions (id, title, last_message_at) VALUES (?, ?, ?)",
+                    (f"s{i:02d}", f"Chat {i}", f"2026-01-01 00:00:{i % 6:02d}")
+                )
+    temp_db.add_message("s03", "user", "first")
+    temp_db.add_message("s03", "assistant", "  latest\n reply  ")
+    temp_db.flush_messages()
+
+    sessions = temp_db.get_sessions()
+    assert sessions[0]["id"] == "s03"
+    assert sessions[0]["message_count"] == 2
+    assert sessions[0]["preview"] == "latest reply"
+
+    seen = []
+    cursor = None
+    while True:
+        page = temp_db.get_sessions_page(cursor=cursor, limit=5)
+        seen.extend(s["id"] for s in page["sessions"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [s["id"] for s in sessions]
+    assert len(set(seen)) == 12
+
+
+def test_migrates_legacy_database(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE sessions (id TEXT PRIMARY KEY, title TEXT NOT NULL, created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, role TEXT NOT NULL,
+            content TEXT NOT NULL, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions (id) ON DELETE CASCADE);
+        INSERT INTO sessions (id, title) VALUES ('old', 'Old chat');
+        INSERT INTO messages (session_id, role, content) VALUES ('old', 'user', 'remember the lighthouse');
+        INSERT INTO messages (session_id, role, content) VALUES ('old', 'assistant', 'Lighthouse noted');
+    """)
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(db, "DB_PATH", db_path)
+    db.init_db()
+    try:
+        session = db.get_sessions()[0]
+        assert session["message_count"] == 2
+        assert session["preview"] == "Lighthouse noted"
+        assert session["last_message_at"] is not None
+        assert len(db.search_messages("lighthouse")) == 2
+    finally:
+        db.shutdown_db()
+
+
+def test_history_cache_write_through(temp_db, monkeypatch):
+    session_id = temp_db.create_session("Cached")
+    temp_db.add_message(session_id, "user", "one")
+    assert temp_db.get_session_messages(session_id) == [{"role": "user", "content": "one"}]
+    hits_before = temp_db.get_history_cache_stats()["hits"]
+
+    temp_db.add_message(session_id, "assistant", "two")
+    temp_db.flush_messages()
+
+    def no_sqlite():
+        raise AssertionError("history should be served from the cache")
+
+    # The appended write is visible without going back to SQLite
+    monkeypatch.setattr(temp_db, "get_connection", no_sqlite)
+    assert temp_db.get_session_messages(session_id) == [
+        {"role": "user", "content": "one"},
+        {"role": "model", "content": "two"},
+    ]
+    assert temp_db.get_session_messages(session_id, limit=1) == [{"role": "model", "content": "two"}]
+    assert temp_db.get_history_cache_stats()["hits"] == hits_before + 2
+
+
+def test_history_cache_eviction_and_stats(temp_db, monkeypatch):
+    cache = temp_db.HistoryCache(max_bytes=2000)
+    monkeypatch.setattr(temp_db, "_history_cache", cache)
+    sessions = [temp_db.create_session(f"S{i}") for i in range(3)]
+    for session_id in sessions:
+        temp_db.add_message(session_id, "user", "x" * 500)
+
+    for session_id in sessions:
+        temp_db.get_session_messages(session_id)
+    stats = cache.stats()
+    assert stats["misses"] == 3
+    assert stats["size_bytes"] <= 2000
+    assert stats["evictions"] >= 1
+
+    temp_db.get_session_messages(sessions[-1])
+    assert cache.stats()["hits"] == 1
+
+    temp_db.delete_session(sessions[-1])
+    assert temp_db.get_session_messages(sessions[-1]) == []
+
+
+def test_dropped_message_is_evicted_from_history_cache(temp_db):
+    session_id = temp_db.create_session("Doomed")
+    temp_db.add_message(session_id, "user", "kept")
+    assert temp_db.get_session_messages(session_id) == [{"role": "user", "content": "kept"}]
+    assert temp_db.session_exists(session_id)
+
+    # The session disappears behind the cache's back (e.g. a delete racing a queued write)
+    with temp_db.get_connection() as conn, conn:
+        conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+    assert not temp_db.session_exists(session_id)
+
+    temp_db.add_message(session_id, "user", "lost")
+    temp_db.flush_messages()
+    assert temp_db.get_session_messages(session_id) == []
+
+
+def test_add_message_rejects_missing_session_id(temp_db):
+    assert not temp_db.session_exists("")
+    with pytest.raises(ValueError):
+        temp_db.add_message("", "user", "orphan")
+
+
+def test_archive_and_transparent_rehydrate(temp_db):
+    session_id = temp_db.create_session("Old chat")
+    for i in range(200):
+        temp_db.add_message(session_id, "user", f"message {i} " + "lorem ipsum " * 20)
+    fresh = temp_db.create_session("Fresh chat")
+    temp_db.add_message(fresh, "user", "still active")
+    expected = temp_db.get_session_messages(session_id)
+    temp_db.flush_messages()
+
+    with temp_db.get_connection() as conn:
+        with conn:
+            conn.execute("UPDATE sessions SET last_message_at = datetime('now', '-90 days') WHERE id = ?", (session_id,))
+
+    report = temp_db.run_maintenance(idle_days=30)
+    assert report["archived"]["sessions"] == 1
+    assert report["archived"]["messages"] == 200
+    assert report["archived"]["compressed_bytes"] < report["archived"]["raw_bytes"] / 5
+    assert report["bytes_reclaimed"] > 0
+
+    with temp_db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0] == 0
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    # Opening the session brings its messages back with their original ids
+    assert temp_db.get_session_messages(session_id) == expected
+    page = temp_db.get_session_messages_page(session_id, limit=5)
+    assert page["messages"][-1]["id"] == 200
+    assert temp_db.get_session_messages(fresh) == [{"role": "user", "content": "still active"}]
+    with temp_db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM archived_sessions").fetchone()[0] == 0
+
+
+def test_archived_sessions_stay_searchable(temp_db):
+    trip = temp_db.create_session("Trip")
+    temp_db.add_message(trip, "user", "Planning a two week trip to Japan in the spring, starting in Tokyo")
+    temp_db.add_message(trip, "assistant", "Cherry blossoms peak in early April.")
+    other = temp_db.create_session("Other")
+    temp_db.add_message(other, "user", "Japan rail pass prices?")
+    temp_db.flush_messages()
+
+    before = temp_db.search_messages("japan", session_id=trip)
+    temp_db.archive_session(trip)
+
+    after = temp_db.search_messages("japan", session_id=trip)
+    assert [(r["id"], r["role"], r["session_title"]) for r in after] == \
+        [(r["id"], r["role"], r["session_title"]) for r in before]
+    assert "<mark>Japan</mark>" in after[0]["snippet"]
+    assert {r["session_id"] for r in temp_db.search_messages("japan")} == {trip, other}
+    assert temp_db.search_messages("japan", until="2000-01-01") == []
+
+    # Rehydrating moves the rows back to the live index without duplicates
+    temp_db.get_session_messages(trip)
+    assert len(temp_db.search_messages("japan", session_id=trip)) == 1
+
+    temp_db.archive_session(trip)
+    temp_db.delete_session(trip)
+    assert {r["session_id"] for r in temp_db.search_messages("japan")} == {other}
+    with temp_db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM archived_messages").fetchone()[0] == 0
+
+
+def test_archive_keeps_messages_written_later(temp_db):
+    session_id = temp_db.create_session("Archived then resumed")
+    temp_db.add_message(session_id, "user", "before")
+    temp_db.archive_session(session_id)
+    temp_db.add_message(session_id, "user", "after")
+    temp_db.flush_messages()
+    temp_db.archive_session(session_id)
+
+    assert [m["content"] for m in temp_db.get_session_messages(session_id)] == ["before", "after"]
+
+
+def test_ndjson_export_import_roundtrip(temp_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(temp_db, "EXPORT_CHUNK_SIZE", 3)
+    monkeypatch.setattr(temp_db, "IMPORT_CHUNK_SIZE", 4)
+    first = temp_db.create_session("First")
+    second = temp_db.create_session("Second")
+    for i in range(7):
+        temp_db.add_message(first, "user", f"first {i}")
+    temp_db.add_message(second, "assistant", "ünïcode ✓\nwith newline")
+    temp_db.archive_session(second)
+
+    export_path = tmp_path / "history.ndjson"
+    with open(export_path, "w", encoding="utf-8") as f:
+        for line in temp_db.export_ndjson():
+            f.write(line)
+    lines = export_path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 2 + 8
+
+    monkeypatch.setattr(temp_db, "DB_PATH", str(tmp_path / "imported.db"))
+    temp_db.init_db()
+    with open(export_path, "rb") as f:
+        report = temp_db.import_ndjson(list(f) + [b"not json\n", b'{"type": "message", "session_id": "nope"}\n'])
+    assert report == {"sessions": 2, "messages": 8, "skipped": 2}
+
+    sessions = {s["title"]: s for s in temp_db.get_sessions()}
+    assert set(sessions) == {"First", "Second"}
+    assert sessions["First"]["id"] != first
+    assert sessions["First"]["message_count"] == 7
+    assert [m["content"] for m in temp_db.get_session_messages(sessions["First"]["id"])] == [f"first {i}" for i in range(7)]
+    assert temp_db.get_session_messages(sessions["Second"]["id"]) == [{"role": "model", "content": "ünïcode ✓\nwith newline"}]
+    assert temp_db.search_messages("newline")
+
+
+def test_session_summary_and_message_ranges(temp_db):
+    session_id = temp_db.create_session("Long chat")
+    for i in range(10):
+        temp_db.add_message(session_id, "user" if i % 2 == 0 else "model", f"message {i}")
+
+    # Counting sees queued writes; ranges are positional and chronological
+    assert temp_db.count_session_messages(session_id) == 10
+    assert [m["content"] for m in temp_db.get_session_messages_range(session_id, 3, 6)] == ["message 3", "message 4", "message 5"]
+    assert temp_db.get_session_messages_range(session_id, 8, 20)[-1]["content"] == "message 9"
+
+    assert temp_db.get_session_summary(session_id) is None
+    temp_db.save_session_summary(session_id, "first four", 4)
+    temp_db.save_session_summary(session_id, "first six", 6)
+    # An older, slower update never overwrites a newer summary
+    temp_db.save_session_summary(session_id, "first five", 5)
+    summary = temp_db.get_session_summary(session_id)
+    assert (summary["summary"], summary["covered_count"]) == ("first six", 6)
+
+    temp_db.delete_session(session_id)
+    assert temp_db.get_session_summary(session_id) is None
@@ -0,0 +1,67 @@
+import asyncio
+
+from app.services.embedding_batch import EmbeddingBatcher, embed_in_batches, normalize_vector, split_batches
+
+
+class Recorder:
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+
+    async def __call__(self, texts):
+        self.batches.append(list(texts))
+        await asyncio.sleep(0.01)
+        if self.fail_on in texts:
+            raise RuntimeError("quota exceeded")
+        return [[float(len(text))] for text in texts]
+
+
+def test_split_batches():
+    assert split_batches(list("abcde"), 2) == [["a", "b"], ["c", "d"], ["e"]]
+    assert split_batches([], 3) == []
+
+
+def test_embed_in_batches_keeps_order_and_isolates_failures():
+    embed = Recorder(fail_on="ccc")
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+    vectors = asyncio.run(embed_in_batches(embed, texts, max_batch=2))
+    assert vectors == [[1.0], [2.0], [], [], [5.0]]
+    assert sorted(map(len, embed.batches)) == [1, 2, 2]
+
+
+def test_batcher_coalesces_concurrent_requests():
+    embed = Recorder()
+
+    async def main():
+        batcher = EmbeddingBatcher(embed, max_batch=3)
+        first = await asyncio.gather(*(batcher.embed(text) for text in ["a", "bb", "a", "ccc", "dddd"]))
+        second = await batcher.embed("ee")
+        return batcher, first, second
+
+    batcher, first, second = asyncio.run(main())
+    assert first == [[1.0], [2.0], [1.0], [3.0], [4.0]]
+    assert second == [2.0]
+    # Three pending requests fill a batch (the repeated "a" is sent once); the rest
+    # go out together at the end of the loop iteration; the later call on its own
+    assert embed.batches == [["a", "bb"], ["ccc", "dddd"], ["ee"]]
+    assert (batcher.requests, batcher.batches) == (6, 3)
+
+
+def test_batcher_holds_its_sends_until_they_finish():
+    async def main():
+        batcher = EmbeddingBatcher(Recorder(), max_batch=2)
+        request = asyncio.ensure_future(batcher.embed_many(["a", "bb"]))
+        # Past the flush, while the request sleeps in Recorder
+        await asyncio.sleep(0.005)
+        in_flight = len(batcher._sending)
+        vectors = await request
+        await asyncio.sleep(0)
+        return in_flight, vectors, len(batcher._sending)
+
+    assert asyncio.run(main()) == (1, [[1.0], [2.0]], 0)
+
+
+def test_normalize_vector_scales_to_unit_length():
+    assert normalize_vector([3.0, 4.0]) == [0.6, 0.8]
+    assert normalize_vector([0.0, 0.0]) == [0.0, 0.0]
+    assert normalize_vector([]) == []
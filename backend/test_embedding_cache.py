@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from app.core.embedding_cache import EmbeddingCache
+
+
+class Counter:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 0.5] if text != "fail" else [] for text in texts]
+
+
+def test_only_uncached_texts_are_computed():
+    cache = EmbeddingCache()
+    compute = Counter()
+
+    assert cache.embed("gemini", "m", ["a", "bb", "a"], compute) == [[1.0, 0.5], [2.0, 0.5], [1.0, 0.5]]
+    assert cache.embed("gemini", "m", ["bb", "ccc"], compute) == [[2.0, 0.5], [3.0, 0.5]]
+    assert cache.embed("gemini", "m", ["ccc"], compute) == [[3.0, 0.5]]
+    assert compute.calls == [["a", "bb"], ["ccc"]]
+
+    stats = cache.stats()
+    assert stats["texts_saved"] == 2
+    assert stats["requests_saved"] == 1
+    assert stats["hit_rate"] == pytest.approx(2 / 6)
+
+
+def test_keys_include_provider_and_model():
+    cache = EmbeddingCache()
+    compute = Counter()
+    cache.embed("gemini", "m1", ["a"], compute)
+    cache.embed("gemini", "m2", ["a"], compute)
+    cache.embed("ollama", "m1", ["a"], compute)
+    assert len(compute.calls) == 3
+
+
+def test_failures_are_not_cached():
+    cache = EmbeddingCache()
+    compute = Counter()
+    assert cache.embed("gemini", "m", ["fail"], compute) == [[]]
+    cache.embed("gemini", "m", ["fail"], compute)
+    assert len(compute.calls) == 2
+
+
+def test_vectors_persist_across_restarts(tmp_path):
+    path = str(tmp_path / "embeddings.db")
+    cache = EmbeddingCache(path=path)
+    cache.embed("gemini", "m", ["hello"], lambda texts: [[0.1, 0.2, 0.3]])
+    cache.close()
+
+    reopened = EmbeddingCache(path=path)
+    vector = reopened.embed("gemini", "m", ["hello"], lambda texts: pytest.fail("should be cached"))[0]
+    # Stored as float32
+    assert vector == pytest.approx([0.1, 0.2, 0.3], rel=1e-6)
+    assert reopened.stats()["disk_hits"] == 1
+    reopened.close()
+
+
+def test_memory_is_bounded_and_disk_pruned(tmp_path):
+    path = str(tmp_path / "embeddings.db")
+    # Two float32 vectors of two dimensions
+    cache = EmbeddingCache(path=path, max_memory_bytes=16, max_disk_entries=3)
+    for text in ["a", "b", "c", "d"]:
+        cache.embed("gemini", "m", [text], lambda texts: [[1.0, 2.0]])
+    stats = cache.stats()
+    assert (stats["memory_entries"], stats["memory_bytes"]) == (2, 16)
+    cache.close()
+
+    reopened = EmbeddingCache(path=path, max_disk_entries=3)
+    assert reopened._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 3
+    reopened.close()
+
+
+def test_memory_hits_do_not_wait_for_disk_io(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.db"))
+    cache.embed("gemini", "m", ["warm"], lambda texts: [[1.0]])
+
+    async def main():
+        # Stands in for a slow WAL commit in the background writer
+        with cache._db_lock:
+            return await asyncio.wait_for(
+                cache.aembed("gemini", "m", ["warm"], lambda texts: pytest.fail("should be cached")), 1)
+
+    assert asyncio.run(main()) == [[1.0]]
+    cache.close()
+
+
+def test_async_embed_writes_in_the_background(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.db"))
+    calls = []
+
+    async def compute(texts):
+        calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    async def main():
+        first = await cache.aembed("ollama", "llama3", ["x", "yy", "x"], compute)
+        second = await cache.aembed("ollama", "llama3", ["yy"], compute)
+        await asyncio.sleep(0.1)
+        return first, second
+
+    assert asyncio.run(main()) == ([[1.0], [2.0], [1.0]], [[2.0]])
+    assert calls == [["x", "yy"]]
+    assert cache._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 2
+    cache.close()
@@ -0,0 +1,80 @@
+import json
+import logging
+import sys
+
+import pytest
+
+from app.core import logger as app_logger
+
+
+@pytest.fixture
+def log_dir(tmp_path, monkeypatch):
+    app_logger.shutdown_logging()
+    monkeypatch.setattr(app_logger, "LOG_DIR", str(tmp_path))
+    yield tmp_path
+    app_logger.shutdown_logging()
+    monkeypatch.undo()
+    app_logger._setup()
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_json_formatter_includes_extra_fields_and_exception():
+    formatter = app_logger.JsonFormatter()
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.getLogger("app.test").makeRecord(
+            "app.test", logging.ERROR, __file__, 1, "Tool %s failed", ("search",), None,
+            extra={"session_id": "s1", "duration_ms": 12.5})
+        record.exc_info = sys.exc_info()
+
+    entry = json.loads(formatter.format(record))
+    assert entry["level"] == "ERROR"
+    assert entry["logger"] == "app.test"
+    assert entry["msg"] == "Tool search failed"
+    assert entry["session_id"] == "s1"
+    assert entry["duration_ms"] == 12.5
+    assert "ValueError: boom" in entry["exc"]
+
+
+def test_get_logger_nests_under_app_logger():
+    assert app_logger.get_logger("app.services.agent").name == "app.services.agent"
+    assert app_logger.get_logger("main").name == "app.main"
+
+
+def test_shutdown_flushes_queued_records(log_dir):
+    log = app_logger.get_logger("test.flush")
+    for i in range(200):
+        log.warning("message %d", i, extra={"n": i})
+    app_logger.shutdown_logging()
+
+    lines = read_lines(log_dir / app_logger.LOG_FILE)
+    assert [line["n"] for line in lines] == list(range(200))
+    assert lines[-1]["msg"] == "message 199"
+
+
+def test_debug_records_skipped_below_level(log_dir):
+    log = app_logger.get_logger("test.level")
+    app_logger.set_level("INFO")
+    log.debug("hidden %r", "chunk")
+    log.info("shown")
+    app_logger.shutdown_logging()
+
+    assert [line["msg"] for line in read_lines(log_dir / app_logger.LOG_FILE)] == ["shown"]
+
+
+def test_file_rotates_at_max_bytes(log_dir, monkeypatch):
+    monkeypatch.setattr(app_logger, "LOG_MAX_BYTES", 2000)
+    monkeypatch.setattr(app_logger, "LOG_BACKUP_COUNT", 2)
+    log = app_logger.get_logger("test.rotate")
+    for i in range(100):
+        log.info("x" * 100)
+    app_logger.shutdown_logging()
+
+    files = sorted(p.name for p in log_dir.iterdir())
+    assert files == [app_logger.LOG_FILE, app_logger.LOG_FILE + ".1", app_logger.LOG_FILE + ".2"]
+    assert all(p.stat().st_size <= 2000 for p in log_dir.iterdir())
@@ -0,0 +1,39 @@
+import asyncio
+import math
+
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+
+from app.services.llm_provider import LLMProvider
+from app.services.memory import NORMALIZED_MARKER, MemoryService
+
+
+class UnitProvider(LLMProvider):
+    """Embeds like Ollama's /api/embed: unit vectors."""
+
+    async def configure(self, settings):
+        pass
+
+    async def send_message_stream(self, history, message, images=None):
+        yield ""
+
+    async def get_embedding(self, text):
+        return [1.0, 0.0] if "blue" in text else [0.0, 1.0]
+
+
+def test_raw_ollama_vectors_are_normalized(tmp_path):
+    path = str(tmp_path / "chroma")
+    # A store written before the migration, with the legacy /api/embeddings' raw vectors
+    legacy = chromadb.PersistentClient(path=path).get_or_create_collection(name="user_memories")
+    legacy.add(ids=["blue", "red"], documents=["likes blue", "likes red"],
+               embeddings=[[30.0, 0.0], [0.0, 0.5]], metadatas=[{"type": "memory"}] * 2)
+
+    migrated = MemoryService(persist_directory=path)
+    stored = migrated.collection.get(ids=["blue", "red"], include=["embeddings"])
+    for vector in stored["embeddings"]:
+        assert math.sqrt(sum(x * x for x in vector)) == pytest.approx(1.0)
+    assert migrated.collection.metadata[NORMALIZED_MARKER] == 1
+
+    results = asyncio.run(migrated.search_memory("what is blue", UnitProvider(), limit=1))
+    assert results == ["likes blue"]
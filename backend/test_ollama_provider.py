@@ -0,0 +1,223 @@
+import asyncio
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from app.core import embedding_cache
+from app.core.embedding_cache import EmbeddingCache
+from app.providers.ollama import OllamaProvider
+from app.services.embedding_batch import normalize_vector
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+    """Stand-in for the Ollama API: NDJSON chat streaming and embeddings over keep-alive HTTP/1.1."""
+    protocol_version = "HTTP/1.1"
+    chunk_delay = 0.05
+    has_embed_endpoint = True
+    client_ports = []
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        FakeOllama.client_ports.append(self.client_address[1])
+        FakeOllama.requests.append((self.path, body))
+        if self.path == "/api/embeddings":
+            self._send_json(200, {"embedding": [0.1, 0.2, 0.3]})
+        elif self.path == "/api/embed":
+            if not self.has_embed_endpoint:
+                self._send_text(404, "404 page not found")
+            else:
+                self._send_json(200, {"embeddings": [[float(len(text)), 1.0] for text in body["input"]]})
+        elif body["model"] == "missing":
+            self._send_json(404, {"error": "model 'missing' not found"})
+        elif body["model"] == "slow":
+            time.sleep(1)
+            self._send_json(200, {"message": {"content": "late"}, "done": True})
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, word in enumerate(["Hello", " there", "!"]):
+                self._write_chunk(json.dumps({"message": {"content": word}, "done": False}) + "\n")
+                time.sleep(self.chunk_delay)
+            self._write_chunk(json.dumps({"message": {"content": ""}, "done": True}) + "\n")
+            self._write_chunk("")
+
+    def _send_json(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_text(self, status, text):
+        payload = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+@pytest.fixture(autouse=True)
+def fresh_embedding_cache(monkeypatch):
+    monkeypatch.setattr(embedding_cache, "_shared", EmbeddingCache())
+
+
+@pytest.fixture
+def server():
+    FakeOllama.client_ports.clear()
+    FakeOllama.requests.clear()
+    FakeOllama.has_embed_endpoint = True
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllama)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+async def make_provider(base_url, model="llama3", **options):
+    provider = OllamaProvider()
+    await provider.configure({"providers": {"ollama": {"base_url": base_url, "model": model, **options}},
+                              "system_instruction": "Be brief."})
+    return provider
+
+
+async def collect(provider, message="hi"):
+    return [chunk async for chunk in provider.send_message_stream([{"role": "model", "content": "Hey"}], message)]
+
+
+def test_streams_lines_without_blocking_the_loop(server):
+    async def main():
+        provider = await make_provider(server)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        chunks = await collect(provider)
+        ticking.cancel()
+        await provider.aclose()
+        return chunks, ticks
+
+    chunks, ticks = asyncio.run(main())
+    assert chunks == ["Hello", " there", "!"]
+    # ~150 ms of server delays; the loop kept ticking throughout
+    assert ticks >= 8
+
+    path, body = FakeOllama.requests[0]
+    assert path == "/api/chat"
+    assert [m["role"] for m in body["messages"]] == ["system", "assistant", "user"]
+    assert body["options"]["num_ctx"] == 4096
+
+
+def test_requests_reuse_one_keep_alive_connection(server):
+    async def main():
+        provider = await make_provider(server)
+        await collect(provider)
+        embedding = await provider.get_embedding("hello")
+        await collect(provider)
+        await provider.aclose()
+        return embedding
+
+    assert asyncio.run(main()) == pytest.approx(normalize_vector([5.0, 1.0]))
+    assert len(FakeOllama.client_ports) == 3
+    assert len(set(FakeOllama.client_ports)) == 1
+
+
+def test_closed_provider_does_not_reopen_its_client(server):
+    async def main():
+        provider = await make_provider(server)
+        await collect(provider)
+        await provider.aclose()
+        return await collect(provider)
+
+    chunks = asyncio.run(main())
+    assert len(chunks) == 1 and "closed" in chunks[0]
+    assert len(FakeOllama.requests) == 1
+
+
+def test_server_errors_and_timeouts_come_back_as_text(server):
+    async def main():
+        missing = await collect(await make_provider(server, model="missing"))
+        slow = await collect(await make_provider(server, model="slow", read_timeout=0.2))
+        return missing, slow
+
+    missing, slow = asyncio.run(main())
+    assert len(missing) == 1 and "model 'missing' not found" in missing[0]
+    assert len(slow) == 1 and slow[0].startswith("Error communicating with Ollama")
+
+
+def test_embeddings_are_batched_into_few_requests(server):
+    async def main():
+        provider = await make_provider(server)
+        # Concurrent single requests are coalesced; a long list is split into max-size batches
+        singles = await asyncio.gather(*(provider.get_embedding("x" * n) for n in range(1, 6)))
+        many = await provider.get_embeddings(["y" * n for n in range(1, 71)])
+        await provider.aclose()
+        return singles, many
+
+    singles, many = asyncio.run(main())
+    assert singles == [pytest.approx(normalize_vector([n, 1.0])) for n in range(1, 6)]
+    assert many == [pytest.approx(normalize_vector([n, 1.0])) for n in range(1, 71)]
+    batch_sizes = [len(body["input"]) for path, body in FakeOllama.requests if path == "/api/embed"]
+    assert batch_sizes[0] == 5
+    assert sorted(batch_sizes[1:]) == [6, 32, 32]
+
+
+def test_embeddings_fall_back_to_the_legacy_endpoint(server):
+    FakeOllama.has_embed_endpoint = False
+
+    async def main():
+        provider = await make_provider(server)
+        vectors = await provider.get_embeddings(["a", "b"])
+        await provider.get_embedding("c")
+        await provider.aclose()
+        return vectors
+
+    # The legacy endpoint's raw vectors are normalized like /api/embed's
+    vectors = asyncio.run(main())
+    assert vectors == [pytest.approx(normalize_vector([0.1, 0.2, 0.3]))] * 2
+    assert math.fsum(x * x for x in vectors[0]) == pytest.approx(1.0)
+    paths = [path for path, _ in FakeOllama.requests]
+    assert paths.count("/api/embed") == 1
+    assert paths.count("/api/embeddings") == 3
+
+
+def test_repeated_embeddings_come_from_the_cache(server):
+    async def main():
+        provider = await make_provider(server)
+        first = await provider.get_embeddings(["plan", "ship"])
+        again = await provider.get_embedding("plan")
+        mixed = await provider.get_embeddings(["ship", "new text"])
+        await provider.aclose()
+        return first, again, mixed
+
+    first, again, mixed = asyncio.run(main())
+    # Cached vectors come back as float32
+    assert again == pytest.approx(first[0], rel=1e-6)
+    assert mixed == [pytest.approx(first[1], rel=1e-6), pytest.approx(normalize_vector([8.0, 1.0]))]
+    assert [body["input"] for path, body in FakeOllama.requests if path == "/api/embed"] == [["plan", "ship"], ["new text"]]
+    stats = embedding_cache._shared.stats()
+    assert (stats["texts_saved"], stats["requests_saved"]) == (2, 1)
@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+from app.core import db
+from app.services.preflight import run_preflight
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "history.db"))
+    db.init_db()
+    yield db
+    db.shutdown_db()
+
+
+class Provider:
+    def __init__(self, embedding_model):
+        self.embedding_model = embedding_model
+        self.embedded = []
+
+    async def get_embedding(self, text):
+        self.embedded.append(text)
+        await asyncio.sleep(0.01)
+        return [1.0, 0.0]
+
+
+class Memory:
+    def __init__(self):
+        self.embeddings = []
+
+    async def search_memory(self, query, provider, limit=3, embedding=None):
+        if not embedding:
+            embedding = await provider.get_embedding(query)
+        self.embeddings.append(embedding)
+        return ["likes tea"]
+
+
+class Knowledge:
+    EMBEDDING_MODEL = "gemini-embedding-2"
+
+    def __init__(self):
+        self.embeddings = []
+
+    def retrieve_context(self, query, embedding=None):
+        self.embeddings.append(embedding)
+        return "doc chunk"
+
+
+def test_query_is_embedded_once_when_models_match(temp_db):
+    session_id = temp_db.create_session()
+    temp_db.add_message(session_id, "user", "earlier")
+    temp_db.save_session_summary(session_id, "summary", 1)
+    provider, memory, knowledge = Provider("gemini-embedding-2"), Memory(), Knowledge()
+
+    result = asyncio.run(run_preflight("plan?", session_id, provider, memory, knowledge, history_limit=10))
+
+    assert provider.embedded == ["plan?"]
+    assert memory.embeddings == [[1.0, 0.0]] and knowledge.embeddings == [[1.0, 0.0]]
+    assert result.shared_embedding
+    assert (result.memories, result.knowledge) == (["likes tea"], "doc chunk")
+    assert [m["content"] for m in result.history] == ["earlier"]
+    assert result.total_messages == 1 and result.summary["summary"] == "summary"
+    assert {"embedding", "memories", "knowledge", "history", "total"} <= set(result.timings)
+
+
+def test_different_embedding_models_are_not_shared(temp_db):
+    provider, memory, knowledge = Provider("llama3"), Memory(), Knowledge()
+
+    result = asyncio.run(run_preflight("plan?", None, provider, memory, knowledge))
+
+    # Memory embeds with the provider; the knowledge base embeds with its own model
+    assert not result.shared_embedding
+    assert knowledge.embeddings == [None]
+    assert result.history == [] and result.summary is None
+
+
+def test_failing_lookup_does_not_fail_preflight(temp_db):
+    class Broken(Knowledge):
+        def retrieve_context(self, query, embedding=None):
+            raise RuntimeError("chroma down")
+
+    result = asyncio.run(run_preflight("plan?", None, Provider("gemini-embedding-2"), Memory(), Broken()))
+    assert result.knowledge == "" and result.memories == ["likes tea"]
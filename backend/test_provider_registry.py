@@ -0,0 +1,86 @@
+import asyncio
+from app.services.llm_provider import LLMProvider
+from app.services.provider_registry import ProviderRegistry
+
+
+class FakeProvider(LLMProvider):
+    instances = 0
+
+    def __init__(self):
+        FakeProvider.instances += 1
+        self.configured_with = None
+        self.closed = False
+
+    async def configure(self, settings):
+        self.configured_with = settings
+
+    async def send_message_stream(self, history, message, images=None):
+        yield "ok"
+
+    async def get_embedding(self, text):
+        return [0.0]
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_registry_reuses_provider_until_settings_change():
+    async def scenario():
+        registry = ProviderRegistry({"fake": FakeProvider})
+        settings = {"model": "a", "system_instruction": "be nice"}
+
+        first = await registry.get("fake", settings)
+        again = await registry.get("fake", dict(settings))
+        assert again is first
+
+        changed = await registry.get("fake", {**settings, "model": "b"})
+        assert changed is not first
+        assert first.closed
+        assert changed.configured_with["model"] == "b"
+        assert registry.stats()["builds"] == 2 and registry.stats()["hits"] == 1
+
+        await registry.aclose()
+        assert changed.closed
+
+    asyncio.run(scenario())
+
+
+class SlowProvider(FakeProvider):
+    async def configure(self, settings):
+        await asyncio.sleep(0.01)
+        await super().configure(settings)
+
+
+def test_replaced_provider_is_closed_after_its_last_holder_releases_it():
+    async def scenario():
+        registry = ProviderRegistry({"fake": FakeProvider})
+        streaming = await registry.get("fake", {"model": "a"}, hold=True)
+        summarizing = registry.acquire(streaming)
+
+        replacement = await registry.get("fake", {"model": "b"})
+        assert replacement is not streaming
+        assert not streaming.closed
+        assert registry.stats()["retiring"] == 1
+
+        await registry.release(streaming)
+        assert not streaming.closed
+        await registry.release(summarizing)
+        assert streaming.closed
+        assert registry.stats()["retiring"] == 0
+
+        # Nobody holds the current one: replacing it closes it right away
+        await registry.get("fake", {"model": "c"})
+        assert replacement.closed
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_rebuilds_build_one_provider():
+    async def scenario():
+        registry = ProviderRegistry({"fake": SlowProvider})
+        providers = await asyncio.gather(*(registry.get("fake", {"model": "a"}) for _ in range(5)))
+        assert all(provider is providers[0] for provider in providers)
+        assert registry.stats()["builds"] == 1
+        await registry.aclose()
+
+    asyncio.run(scenario())
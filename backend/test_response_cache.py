@@ -0,0 +1,68 @@
+from app.services import response_cache
+from app.services.response_cache import (
+    SemanticResponseCache, context_fingerprint, normalize_message, replay_chunks,
+)
+
+SCOPE = ("gemini", "gemini-2.5-flash", "gemini-embedding-2", context_fingerprint(["persona"]))
+
+
+def test_normalize_message_ignores_case_spacing_and_trailing_punctuation():
+    assert normalize_message("  What's my   favorite color?? ") == "what's my favorite color"
+    assert normalize_message("Summarize plan.pdf.") == "summarize plan.pdf"
+
+
+def test_near_duplicate_hits_and_distant_message_misses():
+    cache = SemanticResponseCache(threshold=0.95, enabled=True)
+    cache.store([1.0, 0.0, 0.2], SCOPE, "Blue.", generation_seconds=1.5)
+
+    assert cache.lookup([0.98, 0.01, 0.21], SCOPE) == "Blue."
+    assert cache.lookup([0.0, 1.0, 0.0], SCOPE) is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["lookups"] == 2
+    assert stats["hit_rate"] == 0.5
+    assert 1.4 < stats["saved_seconds"] <= 1.5
+
+
+def test_scope_separates_personas_and_context():
+    cache = SemanticResponseCache(enabled=True)
+    cache.store([1.0, 0.0], SCOPE, "Blue.", generation_seconds=1.0)
+    other = SCOPE[:3] + (context_fingerprint(["persona", "Memory Context:\n- likes red"]),)
+
+    assert cache.lookup([1.0, 0.0], other) is None
+    assert cache.lookup([1.0, 0.0], SCOPE) == "Blue."
+
+
+def test_entries_expire_and_are_bounded(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: clock[0])
+    cache = SemanticResponseCache(ttl_seconds=60, max_entries=2, enabled=True)
+    cache.store([1.0, 0.0, 0.0], SCOPE, "a", 1.0)
+    cache.store([0.0, 1.0, 0.0], SCOPE, "b", 1.0)
+    cache.store([0.0, 0.0, 1.0], SCOPE, "c", 1.0)
+
+    assert cache.lookup([1.0, 0.0, 0.0], SCOPE) is None
+    assert cache.stats()["evictions"] == 1
+    assert cache.lookup([0.0, 1.0, 0.0], SCOPE) == "b"
+
+    clock[0] += 61
+    assert cache.lookup([0.0, 1.0, 0.0], SCOPE) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_configure_applies_settings_with_defaults():
+    cache = SemanticResponseCache()
+    cache.configure({"enabled": True, "threshold": 0.9})
+    assert cache.enabled and cache.threshold == 0.9
+    assert cache.ttl_seconds == response_cache.SEMANTIC_CACHE_DEFAULTS["ttl_seconds"]
+
+    cache.configure(None)
+    assert not cache.enabled
+
+
+def test_replay_chunks_reassemble_the_answer():
+    text = "The plan is to ship the backend on Friday and the frontend a week later. " * 3
+    chunks = list(replay_chunks(text, size=20))
+    assert "".join(chunks) == text
+    assert all(len(chunk) <= 20 for chunk in chunks)
+    assert list(replay_chunks("")) == []
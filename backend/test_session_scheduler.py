@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from app.services.session_scheduler import SessionBusyError, SessionScheduler
+
+
+def test_turns_of_a_session_run_one_at_a_time():
+    scheduler = SessionScheduler(queue_limit=2)
+    events = []
+
+    async def turn(session_id, name):
+        async with scheduler.turn(session_id):
+            events.append(f"start {name}")
+            await asyncio.sleep(0.05)
+            events.append(f"end {name}")
+
+    async def main():
+        await asyncio.gather(turn("a", "a1"), turn("a", "a2"), turn("b", "b1"))
+
+    asyncio.run(main())
+    # a2 waits for a1; b1 runs alongside
+    assert events.index("end a1") < events.index("start a2")
+    assert events.index("start b1") < events.index("end a1")
+    assert scheduler.stats()["queued"] == 1
+    assert scheduler.stats()["active_sessions"] == 0
+
+
+def test_overlapping_turns_beyond_the_queue_are_rejected():
+    scheduler = SessionScheduler(queue_limit=0)
+
+    async def main():
+        started = asyncio.Event()
+
+        async def first():
+            async with scheduler.turn("a"):
+                started.set()
+                await asyncio.sleep(0.1)
+
+        task = asyncio.create_task(first())
+        await started.wait()
+        assert not scheduler.has_room("a")
+        with pytest.raises(SessionBusyError):
+            async with scheduler.turn("a"):
+                pass
+        await task
+        assert scheduler.has_room("a")
+
+    asyncio.run(main())
+    assert scheduler.stats()["rejected"] == 1
+
+
+def test_queued_turn_gives_up_after_timeout():
+    scheduler = SessionScheduler(queue_limit=1, queue_timeout=0.05)
+
+    async def main():
+        async with scheduler.turn("a"):
+            with pytest.raises(SessionBusyError):
+                async with scheduler.turn("a"):
+                    pass
+
+    asyncio.run(main())
+
+
+def test_disconnect_cancels_the_pending_step_and_closes_the_stream():
+    scheduler = SessionScheduler()
+    seen = []
+
+    async def agent():
+        try:
+            yield "first"
+            await asyncio.sleep(10)  # a slow provider call or tool
+            yield "never"
+        except asyncio.CancelledError:
+            seen.append("cancelled")
+            raise
+        finally:
+            seen.append("closed")
+
+    async def main():
+        connected = [True]
+
+        async def is_disconnected():
+            return not connected[0]
+
+        received = []
+        async for chunk in scheduler.stream_until_disconnect(agent(), is_disconnected, poll_interval=0.01):
+            received.append(chunk)
+            connected[0] = False
+        return received
+
+    assert asyncio.run(asyncio.wait_for(main(), 2)) == ["first"]
+    assert seen == ["cancelled", "closed"]
+    assert scheduler.stats()["disconnects"] == 1
+
+
+def test_stream_passes_everything_through_while_connected():
+    scheduler = SessionScheduler()
+
+    async def agent():
+        for i in range(3):
+            await asyncio.sleep(0.02)
+            yield i
+
+    async def main():
+        async def is_disconnected():
+            return False
+        return [chunk async for chunk in scheduler.stream_until_disconnect(agent(), is_disconnected, poll_interval=0.01)]
+
+    assert asyncio.run(main()) == [0, 1, 2]
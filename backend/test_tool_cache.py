@@ -0,0 +1,169 @@
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from app.services.tool_cache import ToolResultCache
+from app.services.tools import Tool, ToolContext, ToolRegistry, build_tool_registry
+
+
+def test_hits_ttl_and_normalized_args(monkeypatch):
+    cache = ToolResultCache()
+    calls = []
+
+    def search():
+        calls.append(1)
+        return f"result {len(calls)}"
+
+    assert cache.get_or_compute("google_search", {"query": "Weather  in Tokyo "}, 60, search) == "result 1"
+    assert cache.get_or_compute("google_search", {"query": "weather in tokyo"}, 60, search) == "result 1"
+    assert len(calls) == 1
+
+    # Expired entries are recomputed
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.get_or_compute("google_search", {"query": "weather in tokyo"}, 60, search) == "result 2"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_lru_bound_and_invalidate():
+    cache = ToolResultCache(max_entries=2)
+    for q in ["a", "b", "c"]:
+        cache.get_or_compute("search_knowledge", {"query": q}, 60, lambda: q)
+    assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1
+
+    cache.get_or_compute("read_url", {"url": "http://x"}, 60, lambda: "page")
+    cache.invalidate("search_knowledge")
+    assert cache.stats()["entries"] == 1
+    assert cache.get_or_compute("read_url", {"url": "http://x"}, 60, lambda: "other") == "page"
+
+
+def test_identical_concurrent_calls_share_one_flight():
+    cache = ToolResultCache()
+    started = threading.Event()
+    calls = []
+
+    def slow_fetch():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return "page"
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        first = pool.submit(cache.get_or_compute, "read_url", {"url": "http://x"}, 60, slow_fetch)
+        started.wait()
+        others = [pool.submit(cache.get_or_compute, "read_url", {"url": "http://x"}, 60, slow_fetch) for _ in range(4)]
+        results = [first.result()] + [f.result() for f in others]
+
+    assert results == ["page"] * 5
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_persisted_entries_survive_restart(tmp_path):
+    path = str(tmp_path / "tool_cache.db")
+    cache = ToolResultCache(path=path)
+    cache.get_or_compute("google_search", {"query": "x"}, 60, lambda: {"output": "found", "display": []})
+    cache.close()
+
+    reopened = ToolResultCache(path=path)
+    value = reopened.get_or_compute("google_search", {"query": "x"}, 60, lambda: {"output": "fresh", "display": []})
+    assert value == {"output": "found", "display": []}
+    assert reopened.stats()["disk_hits"] == 1
+    reopened.close()
+
+
+def test_memory_hits_do_not_wait_for_disk_io(tmp_path):
+    cache = ToolResultCache(path=str(tmp_path / "tool_cache.db"))
+    cache.get_or_compute("google_search", {"query": "warm"}, 60, lambda: "cached")
+    results = []
+
+    def lookup():
+        results.append(cache.get_or_compute("google_search", {"query": "warm"}, 60, lambda: "recomputed"))
+
+    # Stands in for a slow read or commit of another lookup
+    with cache._db_lock:
+        worker = threading.Thread(target=lookup)
+        worker.start()
+        worker.join(1)
+        assert results == ["cached"]
+    cache.close()
+
+
+def test_registry_invalidates_off_the_event_loop(tmp_path):
+    cache = ToolResultCache(path=str(tmp_path / "tool_cache.db"))
+    cache.get_or_compute("search_knowledge", {"query": "x"}, 60, lambda: "stale")
+    registry = ToolRegistry([Tool("search_knowledge", lambda ctx, args: "kb", cache_ttl=60)], cache=cache)
+    threads = []
+    invalidate = cache.invalidate
+
+    def probe(tool_name):
+        threads.append(threading.get_ident())
+        invalidate(tool_name)
+
+    cache.invalidate = probe
+
+    async def main():
+        await registry.invalidate_async("search_knowledge")
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(main())
+    assert threads and threads[0] != loop_thread
+    assert cache.get_or_compute("search_knowledge", {"query": "x"}, 60, lambda: "fresh") == "fresh"
+    cache.close()
+
+
+def test_registry_caches_successes_only_and_invalidates():
+    outputs = iter(["Error performing search: offline", "Search Results: 1", "Search Results: 2"])
+    registry = ToolRegistry([
+        Tool("google_search", lambda ctx, args: next(outputs), cache_ttl=60),
+        Tool("search_knowledge", lambda ctx, args: "kb", cache_ttl=60),
+        Tool("ingest_file", lambda ctx, args: "Successfully ingested", invalidates=("search_knowledge",)),
+    ], cache=ToolResultCache())
+    ctx = ToolContext(agent=SimpleNamespace())
+
+    async def run(name, args):
+        return (await registry.run(registry.get(name), args, ctx)).output
+
+    async def scenario():
+        return [await run("google_search", {"query": "q"}) for _ in range(3)]
+
+    assert asyncio.run(scenario()) == ["Error performing search: offline", "Search Results: 1", "Search Results: 1"]
+
+    asyncio.run(run("search_knowledge", {"query": "plan"}))
+    assert registry.cache.stats()["entries"] == 2
+    asyncio.run(run("ingest_file", {}))
+    assert registry.cache.stats()["entries"] == 1
+
+
+
+def test_failed_google_search_is_not_cached(monkeypatch):
+    calls = []
+
+    class RateLimitedDDGS:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def text(self, query, max_results):
+            calls.append(query)
+            raise RuntimeError("202 Ratelimit")
+
+    # duckduckgo_search isn't needed to exercise the real search_web
+    monkeypatch.setitem(sys.modules, "duckduckgo_search", SimpleNamespace(DDGS=RateLimitedDDGS))
+    monkeypatch.delitem(sys.modules, "app.services.search", raising=False)
+    registry = build_tool_registry(cache=ToolResultCache())
+    ctx = ToolContext(agent=SimpleNamespace())
+
+    async def scenario():
+        tool = registry.get("google_search")
+        return [(await registry.run(tool, {"query": "q"}, ctx)).output for _ in range(3)]
+
+    outputs = asyncio.run(scenario())
+    assert outputs == ["Error performing search: 202 Ratelimit"] * 3
+    assert len(calls) == 3
+    assert registry.cache.stats()["entries"] == 0
@@ -0,0 +1,133 @@
+import json
+import random
+import time
+from app.services.tool_parser import ToolCallParser, extract_tool_call
+
+
+def random_chunks(text, rng):
+    """Split text at random boundaries, like a streaming provider would."""
+    chunks = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 12)
+        chunks.append(text[i:i + size])
+        i += size
+    return chunks
+
+
+def parse_streamed(chunks):
+    parser = ToolCallParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.finish()
+    return parser.calls
+
+
+PROSE = [
+    "Sure, let me check that for you. ",
+    "Here's a set {a, b} in math notation. ",
+    "A dict looks like {\"key\": 1}. ",
+    "Quotes \"inside\" prose and a stray } brace. ",
+    "Escapes like \\\" and \\\\ show up too. ",
+    "",
+]
+
+ARG_VALUES = [
+    "plain",
+    "braces { and } inside",
+    "an \"escaped\" quote",
+    "backslash \\ then brace }",
+    "unicode é中 and newline\nhere",
+    "{\"tool\": \"fake\"}",
+]
+
+
+def test_chunk_boundaries_do_not_change_the_result():
+    rng = random.Random(1234)
+    for _ in range(300):
+        command = {"tool": rng.choice(["search_web", "remember", "recall"]),
+                   "args": {"query": rng.choice(ARG_VALUES), "n": rng.randint(0, 99)}}
+        encoded = json.dumps(command, ensure_ascii=rng.random() < 0.5)
+        text = rng.choice(PROSE) + encoded + rng.choice(PROSE)
+
+        whole = extract_tool_call(text)
+        assert whole is not None
+        assert whole.command == command
+        assert text[whole.start:whole.end] == encoded
+
+        calls = parse_streamed(random_chunks(text, rng))
+        assert calls[0].command == command
+        assert (calls[0].start, calls[0].end) == (whole.start, whole.end)
+
+
+def test_one_character_chunks():
+    text = 'ok {"tool": "remember", "args": {"text": "a \\"b\\" {c}"}} done'
+    calls = parse_streamed(list(text))
+    assert calls[0].command == {"tool": "remember", "args": {"text": 'a "b" {c}'}}
+    assert text[calls[0].end:] == " done"
+
+
+def test_call_inside_unbalanced_prose_brace():
+    # The opening brace in prose never closes; the call is recovered at finish()
+    text = 'Step {1: first {"tool": "search_web", "args": {"query": "x"}} then more'
+    call = extract_tool_call(text)
+    assert call.command["tool"] == "search_web"
+    assert text[call.start:call.end] == '{"tool": "search_web", "args": {"query": "x"}}'
+
+
+def test_call_nested_in_invalid_outer_object():
+    text = '{note: {"tool": "recall", "args": {}}}'
+    call = extract_tool_call(text)
+    assert call.command == {"tool": "recall", "args": {}}
+    assert (call.start, call.end) == (7, 37)
+
+
+def test_objects_without_tool_are_ignored():
+    assert extract_tool_call('{"answer": 42} and {"tool"') is None
+    assert extract_tool_call("no json here") is None
+
+    calls = parse_streamed(['{"a": 1} {"tool": "x", "args": {}} {"tool": "y", "args": {}}'])
+    assert [c.command["tool"] for c in calls] == ["x", "y"]
+
+
+def test_feed_reports_call_as_soon_as_it_closes():
+    parser = ToolCallParser()
+    assert parser.feed('Working on it. {"tool": "open_app", "args": {"name": "no') == []
+    found = parser.feed('tepad"}} and then the model keeps talking')
+    assert found[0].command["args"] == {"name": "notepad"}
+
+
+def test_array_of_calls_is_one_tool_call():
+    commands = [{"tool": "system_control", "args": {"action": "open_app", "app_name": "code ."}},
+                {"tool": "system_control", "args": {"action": "set_volume", "level": 30}}]
+    text = "See [the docs](http://x) and [1, 2]. On it. " + json.dumps(commands) + " ignored"
+    rng = random.Random(7)
+    for _ in range(50):
+        calls = parse_streamed(random_chunks(text, rng))
+        assert calls[0].commands == commands
+        assert calls[0].command == commands[0]
+        assert text[calls[0].end:] == " ignored"
+
+
+def test_array_without_tools_is_ignored():
+    assert extract_tool_call('[{"a": 1}, 2] then {"tool": "x", "args": {}}').command == {"tool": "x", "args": {}}
+
+
+def test_stray_and_deeply_nested_brackets_stay_linear():
+    tool = '{"tool": "recall", "args": {}}'
+    texts = [
+        "{" * 3000 + "}" * 3000 + tool,
+        "a { b " * 3000 + tool,
+        "[" * 3000 + "]" * 3000 + tool,
+        '{"a": ' * 3000 + "1" + "}" * 3000 + tool,
+        # Nested objects that each turn invalid only at their closing brace
+        '{"a": ' * 2000 + "1" + ", }" * 2000 + tool,
+        "{x: {y: [1, 2,}} " * 2000 + tool,
+    ]
+    for text in texts:
+        began = time.perf_counter()
+        call = extract_tool_call(text)
+        calls = parse_streamed([text[i:i + 40] for i in range(0, len(text), 40)])
+        assert time.perf_counter() - began < 2
+        assert text[call.start:call.end] == tool
+        assert (calls[0].start, calls[0].end) == (call.start, call.end)
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+from app.services.tools import Tool, ToolContext, ToolRegistry, ToolResult, build_tool_registry
+
+
+def make_context(**services):
+    agent = SimpleNamespace(system_control=None, vision_service=None, code_interpreter=None,
+                            memory_service=None, workflow_service=None, provider=None)
+    for name, value in services.items():
+        setattr(agent, name, value)
+    return ToolContext(agent=agent)
+
+
+def test_blocking_tool_does_not_block_the_event_loop():
+    def slow(ctx, args):
+        time.sleep(0.3)
+        return threading.current_thread().name
+
+    registry = ToolRegistry([Tool("slow", slow)])
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        result = await registry.run(registry.get("slow"), {}, make_context())
+        ticking.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(main())
+    assert result.output.startswith("tool")
+    # The loop kept running other work while the tool slept in its thread
+    assert ticks >= 10
+
+
+def test_timeout_missing_args_and_errors_become_output():
+    def hang(ctx, args):
+        time.sleep(1)
+
+    async def fail(ctx, args):
+        raise ValueError("boom")
+
+    registry = ToolRegistry([
+        Tool("hang", hang, timeout=0.05),
+        Tool("fail", fail, blocking=False),
+        Tool("needs", lambda ctx, args: "ok", required=("query",)),
+    ])
+    ctx = make_context()
+
+    async def main():
+        return [await registry.run(registry.get(name), args, ctx)
+                for name, args in [("hang", {}), ("fail", {}), ("needs", {}), ("needs", {"query": "x"})]]
+
+    hang_result, fail_result, missing, ok = asyncio.run(main())
+    assert "timed out" in hang_result.output
+    assert fail_result.output == "Error running tool 'fail': boom"
+    assert "query" in missing.output
+    assert ok == ToolResult("ok")
+
+
+def test_builtin_system_control_tool():
+    calls = []
+    system_control = SimpleNamespace(set_volume=lambda level: calls.append(level) or f"Volume set to {level}")
+    registry = build_tool_registry()
+    ctx = make_context(system_control=system_control)
+    tool = registry.get("system_control")
+    args = {"action": "set_volume", "level": "40"}
+
+    assert tool.announce(ctx, args) == "\n\n*Setting volume to 40%...*\n\n"
+    result = asyncio.run(registry.run(tool, args, ctx))
+    assert result.output == "Volume set to 40"
+    assert calls == [40]
+
+    # Without the service the tool reports it instead of failing
+    assert asyncio.run(registry.run(tool, args, make_context())).output == "Error: System Control Service not available."
+
+
+def test_run_many_is_concurrent_but_serializes_shared_resources():
+    active = {"gui": 0, "max_gui": 0}
+    lock = threading.Lock()
+
+    def net(ctx, args):
+        time.sleep(0.2)
+        return f"net {args['n']}"
+
+    def gui(ctx, args):
+        with lock:
+            active["gui"] += 1
+            active["max_gui"] = max(active["max_gui"], active["gui"])
+        time.sleep(0.05)
+        with lock:
+            active["gui"] -= 1
+        return f"gui {args['n']}"
+
+    registry = ToolRegistry([Tool("net", net), Tool("gui", gui, resource="gui")])
+    calls = [("net", {"n": 1}), ("gui", {"n": 2}), ("net", {"n": 3}), ("gui", {"n": 4}), ("nope", {})]
+
+    start = time.perf_counter()
+    results = asyncio.run(registry.run_many(calls, make_context()))
+    elapsed = time.perf_counter() - start
+
+    assert [r.output for r in results] == ["net 1", "gui 2", "net 3", "gui 4", "Error: Unknown tool 'nope'."]
+    assert elapsed < 0.35
+    assert active["max_gui"] == 1
+
+
+def test_cancelled_or_timed_out_python_interrupts_the_kernel():
+    class Kernel:
+        def __init__(self):
+            self.interrupts = 0
+            self.stop = threading.Event()
+
+        def execute_code(self, code):
+            self.stop.wait(2)
+            return {"output": "", "result": None}
+
+        def interrupt(self):
+            self.interrupts += 1
+            self.stop.set()
+
+    registry = build_tool_registry()
+    tool = registry.get("execute_python")
+
+    async def cancel_midway(ctx):
+        task = asyncio.create_task(registry.run(tool, {"code": "while True: pass"}, ctx))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    kernel = Kernel()
+    assert asyncio.run(cancel_midway(make_context(code_interpreter=kernel)))
+    assert kernel.interrupts == 1
+
+    kernel = Kernel()
+    registry.register(Tool("execute_python", tool.handler, timeout=0.1, resource="kernel", on_cancel=tool.on_cancel))
+    result = asyncio.run(registry.run(registry.get("execute_python"), {"code": "x"}, make_context(code_interpreter=kernel)))
+    assert "timed out" in result.output
+    assert kernel.interrupts == 1
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+import pytest
+
+from app.core import tracing
+from app.core.tracing import TurnTrace, traced
+from app.services.tools import Tool, ToolContext, ToolRegistry
+
+
+def test_breakdown_adds_up_repeated_steps():
+    trace = TurnTrace("chat", session_id="s1")
+    for _ in range(2):
+        with trace.span("provider.stream"):
+            time.sleep(0.02)
+    trace.record("preflight.memories", 0.015)
+    trace.finish()
+    trace.finish()
+
+    timings = trace.breakdown()["timings_ms"]
+    assert timings["provider.stream"] >= 40
+    assert timings["preflight.memories"] == 15.0
+    assert timings["total"] >= timings["provider.stream"]
+
+
+def test_span_records_time_of_failed_steps():
+    trace = TurnTrace("chat")
+    with pytest.raises(ValueError):
+        with trace.span("configure"):
+            raise ValueError("bad settings")
+    assert "configure" in trace.breakdown()["timings_ms"]
+
+
+def test_traced_without_trace_is_a_no_op():
+    with traced(None, "anything") as span:
+        assert span is None
+
+
+def test_tool_runs_are_recorded_on_the_turn_trace():
+    registry = ToolRegistry([Tool("slow", lambda ctx, args: time.sleep(0.02) or "done")])
+    trace = TurnTrace("chat")
+    result = asyncio.run(registry.run(registry.get("slow"), {}, ToolContext(agent=None, trace=trace)))
+    assert result.output == "done"
+    assert trace.breakdown()["timings_ms"]["tool.slow"] >= 20
+
+
+def test_spans_are_exported_in_memory():
+    pytest.importorskip("opentelemetry.sdk")
+    trace = TurnTrace("chat", session_id="s1")
+    with trace.span("configure"):
+        pass
+    trace.record("provider.ttft", 0.25, provider="gemini")
+    trace.finish()
+
+    spans = tracing.recent_spans.spans(trace.trace_id)
+    assert {s["name"] for s in spans} == {"chat", "configure", "provider.ttft"}
+    root = next(s for s in spans if s["name"] == "chat")
+    assert all(s["parent_id"] == root["span_id"] for s in spans if s is not root)
+    assert next(s for s in spans if s["name"] == "provider.ttft")["duration_ms"] == pytest.approx(250, abs=1)